@@ -0,0 +1,326 @@
+"""
+こうかとん無双の負荷計測スクリプト
+画面を開かずに（SDLのダミードライバで）シナリオごとにWorldを動かし，
+更新・衝突判定・描画の各処理にかかった1フレームあたりの時間を計測する
+
+使い方：
+    python bench_kokaton.py                          # 全シナリオを計測して結果を表示
+    python bench_kokaton.py --out result.json        # 結果をJSONに書き出す
+    python bench_kokaton.py --baseline bench_baseline.json  # 基準値と比較（悪化していたら終了コード1，条件が違えば2）
+    python bench_kokaton.py --update-baseline        # 基準値を計測結果で書き換える
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import musou_kokaton as mk
+import pygame as pg
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+PHASES = ("update", "collide", "draw")  # 計測する処理
+COMPARED = ("p50", "p90")  # 基準値と比較する統計量
+MATCHED = {"frames": None, "seed": None, "render_scale": 1.0, "pipeline": False}  # 基準値と揃っていないと比較しない条件（と古い基準値での既定値）
+
+
+def invincible(world: mk.World):
+    """
+    爆弾に当たってもシナリオが終わらないよう，こうかとんをずっとhyper状態にする
+    """
+    world.bird.change_state("hyper", 10**9)
+
+
+def keep_score(world: mk.World, score: int=1000):
+    """
+    スコアを使う機能を毎フレーム発動できるよう，スコアを一定に保つ
+    """
+    world.score.score = score
+
+
+def circle_keys(frame: int) -> dict[int, bool]:
+    """
+    こうかとんを画面内で回らせるための押下キーを返す
+    """
+    keys = {k: False for k in mk.Bird.delta}
+    keys[(pg.K_RIGHT, pg.K_DOWN, pg.K_LEFT, pg.K_UP)[frame//25%4]] = True
+    return keys
+
+
+def press(*keys: int) -> list[tuple[int, int]]:
+    """
+    keysを押したキーイベントのリストを返す
+    """
+    return [(pg.KEYDOWN, k) for k in keys]
+
+
+class Scenario:
+    """
+    計測シナリオの基底クラス
+    setupでWorldを用意し，inputsで毎フレームの入力を返す
+    """
+    name = ""
+    description = ""
+
+    def setup(self, world: mk.World):
+        invincible(world)
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        return mk.FrameInput(circle_keys(frame))
+
+
+class Enemies50(Scenario):
+    name = "enemies50"
+    description = "画面上に敵機50機を並べ，爆弾を投下させ続ける"
+
+    def setup(self, world: mk.World):
+        super().setup(world)
+        for _ in range(50):
+            world.emys.add(mk.Enemy())
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        while len(world.emys) < 50:
+            world.emys.add(mk.Enemy())
+        return super().inputs(world, frame)
+
+
+class BeamplusalphaBurst(Scenario):
+    name = "beamplusalpha_burst"
+    description = "毎フレームF1キーでBeamplusalphaの全方向ビームを放つ"
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        keep_score(world)
+        return mk.FrameInput(circle_keys(frame), press(pg.K_F1))
+
+
+class BeamPlusVolley(Scenario):
+    name = "beamplus_volley"
+    description = "スコア990で10フレームごとにスペースキーを押し，BeamPlusを99発ずつ放つ"
+
+    def setup(self, world: mk.World):
+        super().setup(world)
+        for _ in range(10):
+            world.emys.add(mk.Enemy())
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        keep_score(world, 990)
+        return mk.FrameInput(circle_keys(frame), press(pg.K_SPACE) if frame%10 == 0 else [])
+
+
+class Bombs500(Scenario):
+    name = "bombs500"
+    description = "爆弾を常に500個飛ばしておく"
+
+    def setup(self, world: mk.World):
+        super().setup(world)
+        self.droppers = [mk.Enemy() for _ in range(20)]
+        for emy in self.droppers:
+            emy.rect.centery = random.randint(50, mk.HEIGHT//3)
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        while len(world.bombs) < 500:
+            world.bombs.add(mk.Bomb.spawn(random.choice(self.droppers), world.bird))
+        return super().inputs(world, frame)
+
+
+class AllEffects(Scenario):
+    name = "all_effects"
+    description = "防御壁，前後の防御壁，重力場，画面全体の重力場，こうかボールをすべて発動し続ける"
+
+    def setup(self, world: mk.World):
+        super().setup(world)
+        for _ in range(10):
+            world.emys.add(mk.Enemy())
+
+    def inputs(self, world: mk.World, frame: int) -> mk.FrameInput:
+        keep_score(world)
+        events = []
+        if len(world.shields) == 0:
+            events += press(pg.K_CAPSLOCK)
+        if len(world.FrontKS) == 0:
+            events += press(pg.K_x)
+        if len(world.gravities) == 0:
+            events += press(pg.K_TAB)
+        if len(world.neogrs) == 0:
+            events += press(pg.K_RETURN)
+        if frame%20 == 0:
+            events += press(pg.K_d)
+        return mk.FrameInput(circle_keys(frame), events)
+
+
+SCENARIOS = {sc.name: sc for sc in (Enemies50, BeamplusalphaBurst, BeamPlusVolley, Bombs500, AllEffects)}
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """
+    計測値（秒）のリストから平均・パーセンタイル・最大値（ミリ秒）を求める
+    """
+    xs = sorted(samples)
+    def pct(p: float) -> float:
+        return xs[min(len(xs)-1, int(p/100*len(xs)))]*1000
+    stats = {
+        "mean": sum(xs)/len(xs)*1000,
+        "p50": pct(50),
+        "p90": pct(90),
+        "p99": pct(99),
+        "max": xs[-1]*1000,
+    }
+    return {k: round(v, 4) for k, v in stats.items()}
+
+
+def run_scenario(scenario: Scenario, screen: pg.Surface, frames: int, warmup: int, seed: int,
+                 render_scale: float=1.0, pipeline: bool=False) -> dict:
+    """
+    シナリオを1つ実行し，処理ごとの1フレームあたりの時間の統計を返す
+    引数1 scenario：実行するシナリオ
+    引数2 screen：描画先Surface
+    引数3 frames：計測するフレーム数
+    引数4 warmup：計測前に捨てるフレーム数
+    引数5 seed：乱数の種
+    引数6 render_scale：内部で描画する解像度の倍率
+    引数7 pipeline：Trueなら描画を裏のスレッド（RenderThread）で行い，drawには渡す・待つ・写す時間が入る
+    戻り値：処理名と統計の辞書
+    """
+    random.seed(seed)  # シナリオ側の乱数
+    mk.Rng.seed(seed)  # ゲーム側の乱数
+    world = mk.World()
+    renderer = mk.Renderer(screen, render_scale)
+    render_thread = mk.RenderThread(renderer) if pipeline else None
+    scenario.setup(world)
+    stamps: dict[str, float] = {}
+    world.on_phase = lambda phase: stamps.__setitem__(phase, time.perf_counter())
+    samples = {phase: [] for phase in PHASES+("frame",)}
+    for frame in range(warmup+frames):
+        inputs = scenario.inputs(world, frame)
+        t0 = time.perf_counter()
+        world.step(inputs)
+        t1 = time.perf_counter()
+        pg.display.update(render_thread.submit(world) if render_thread is not None else renderer.draw(world))
+        t2 = time.perf_counter()
+        if world.over:
+            raise RuntimeError(f"{scenario.name}: ゲームオーバーになった（{frame}フレーム目）")
+        if frame < warmup:
+            continue
+        collide = stamps["collide"]-stamps["spawn"]
+        samples["collide"].append(collide)
+        samples["update"].append(t1-t0-collide)
+        samples["draw"].append(t2-t1)
+        samples["frame"].append(t2-t0)
+    if render_thread is not None:
+        render_thread.close()
+    result = {phase: percentiles(xs) for phase, xs in samples.items()}
+    result["sprites"] = world.counts()
+    result["volleys"] = dict(world.volleys.stats)
+    return result
+
+
+def mismatches(result: dict, baseline: dict) -> list[str]:
+    """
+    計測の条件（フレーム数，乱数の種，内部解像度，描画スレッド）が基準値と違う項目の説明のリストを返す
+    条件が違うと時間を比べても意味がないので，違うときは比較しない
+    """
+    diffs = []
+    for key, default in MATCHED.items():
+        now, base = result["meta"].get(key, default), baseline.get("meta", {}).get(key, default)
+        if now != base:
+            diffs.append(f"{key}: baseline {base}, now {now}")
+    return diffs
+
+
+def compare(result: dict, baseline: dict, tolerance: float, floor: float) -> list[str]:
+    """
+    計測結果を基準値と比べ，許容範囲を超えて遅くなった項目の説明のリストを返す
+    引数1 result：計測結果
+    引数2 baseline：基準値
+    引数3 tolerance：許容する悪化の割合（0.25なら25%）
+    引数4 floor：許容する悪化の最小幅（ミリ秒）：ごく短い処理の揺らぎを無視する
+    """
+    regressions = []
+    for name, phases in baseline["scenarios"].items():
+        if name not in result["scenarios"]:
+            continue
+        for phase in PHASES+("frame",):
+            for stat in COMPARED:
+                base = phases[phase][stat]
+                now = result["scenarios"][name][phase][stat]
+                if now > base*(1+tolerance) and now-base > floor:
+                    regressions.append(f"{name}.{phase}.{stat}: {base:.3f} ms -> {now:.3f} ms")
+    return regressions
+
+
+def print_result(result: dict):
+    for name, phases in result["scenarios"].items():
+        print(f"[{name}] {SCENARIOS[name].description}")
+        for phase in PHASES+("frame",):
+            st = phases[phase]
+            print(f"  {phase:8s} mean {st['mean']:7.3f}  p50 {st['p50']:7.3f}  p90 {st['p90']:7.3f}"
+                  f"  p99 {st['p99']:7.3f}  max {st['max']:7.3f} ms")
+
+
+def main(argv: list[str]|None=None) -> int:
+    parser = argparse.ArgumentParser(description="こうかとん無双の負荷計測")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="実行するシナリオ（複数指定可）")
+    parser.add_argument("--frames", type=int, default=300, help="計測するフレーム数")
+    parser.add_argument("--warmup", type=int, default=30, help="計測前に捨てるフレーム数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+    parser.add_argument("--render-scale", type=float, default=1.0, help="内部で描画する解像度の倍率（0.5なら800×450）")
+    parser.add_argument("--pipeline", action="store_true", help="描画を裏のスレッドで行う（ステップと重なる分だけframeが短くなる）")
+    parser.add_argument("--out", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較する基準値のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="許容する悪化の割合")
+    parser.add_argument("--floor", type=float, default=0.2, help="許容する悪化の最小幅（ミリ秒）")
+    parser.add_argument("--update-baseline", action="store_true", help=f"{os.path.basename(BASELINE)}を書き換える")
+    args = parser.parse_args(argv)
+
+    mk.init_headless()
+    screen = pg.display.set_mode((mk.WIDTH, mk.HEIGHT))
+    mk.Assets.load_all()
+    mk.prebuild_atlases(mk.Bird(3, (0, 0)))
+
+    result = {
+        "meta": {
+            "python": platform.python_version(),
+            "pygame": pg.version.ver,
+            "machine": platform.machine(),
+            "frames": args.frames,
+            "seed": args.seed,
+            "render_scale": args.render_scale,
+            "pipeline": args.pipeline,
+        },
+        "scenarios": {},
+    }
+    for name in args.scenario or SCENARIOS:
+        result["scenarios"][name] = run_scenario(
+            SCENARIOS[name](), screen, args.frames, args.warmup, args.seed, args.render_scale, args.pipeline
+        )
+    print_result(result)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.update_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        diffs = mismatches(result, baseline)
+        for line in diffs:
+            print("MISMATCH", line)
+        if diffs:
+            print("計測の条件が基準値と違うので比較しない（条件を揃えるか，--update-baselineで基準値を作り直す）")
+            return 2
+        regressions = compare(result, baseline, args.tolerance, args.floor)
+        for line in regressions:
+            print("REGRESSION", line)
+        if regressions:
+            return 1
+        print("基準値との比較：問題なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
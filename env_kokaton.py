@@ -0,0 +1,352 @@
+"""
+こうかとん無双を自動で遊ばせるための環境（reset/step）
+KokatonEnvは1つのゲームをresetとstepで進め，画面（NumPy配列のビュー）と状態ベクトルを返す
+VecKokatonEnvは複数のゲームをワーカープロセスで並列に進め，画面と状態ベクトルを共有メモリに書かせる
+
+使い方：
+    python env_kokaton.py --envs 4 --workers 4 --steps 2000   # 並列に進めたときのステップ数/秒を表示する
+    python env_kokaton.py --envs 1 --workers 0 --no-render     # 今のプロセスで1つだけ（画面なし）
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import time
+from multiprocessing import shared_memory
+
+import musou_kokaton as mk
+import numpy as np
+import pygame as pg
+
+
+OBS_SCALE = 0.25  # 画面の観測の解像度の倍率（0.25なら400×225）
+MAX_STEPS = 3000  # 1回のゲームの最大ステップ数（超えたら終わりにする）
+STATE_ENEMIES = 8  # 状態ベクトルに入れる敵機の数
+STATE_BOMBS = 16  # 状態ベクトルに入れる爆弾の数（こうかとんに近い順）
+STATE_DIM = 4+2*STATE_ENEMIES+2*STATE_BOMBS  # こうかとんの位置と向き，敵機と爆弾の位置
+ACTION_KEYS = (  # 行動で押せるキー（行動番号//16が1から順に対応する）
+    pg.K_SPACE, pg.K_RETURN, pg.K_RSHIFT, pg.K_TAB, pg.K_CAPSLOCK, pg.K_F1, pg.K_x, pg.K_d,
+)
+NUM_ACTIONS = 16*(len(ACTION_KEYS)+1)  # 移動キー4つの押下の組み合わせ×（押すキーなし＋ACTION_KEYS）
+
+
+def action_input(action: int) -> mk.FrameInput:
+    """
+    行動番号を1ステップの入力にする
+    下位4ビットがBird.deltaの順（上，下，左，右）の移動キーの押下，action//16が押すキー（0なら押さない）
+    """
+    keys = {k: bool(action >> i & 1) for i, k in enumerate(mk.Bird.delta)}
+    key = action//16
+    return mk.FrameInput(keys, [(pg.KEYDOWN, ACTION_KEYS[key-1])] if key else [])
+
+
+def init_process(render: bool):
+    """
+    環境を動かすプロセスの初期化：画面を開かずにpygameを初期化し，画像を一度だけ読み込む
+    引数 render：Trueなら画面の観測を描くので，画像を画面のピクセル形式に変換するための小さなダミーの画面を開く
+    """
+    os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")  # SDLにSIGTERMを横取りさせない
+    mk.init_headless()
+    if render:
+        pg.display.set_mode((1, 1))
+    mk.Assets.load_all()
+    if render:
+        mk.prebuild_atlases(mk.Bird(3, (0, 0)))
+
+
+def pixel_format(surface: pg.Surface|None=None) -> str:
+    """
+    画面のピクセル形式に合わせたpg.image.frombufferの形式を返す（同じ形式ならblitで変換しないので速い）
+    引数 surface：ピクセル形式を調べるSurface（Noneなら画面）
+    戻り値："BGRA"，"RGBA"，"ARGB"のどれか（画面がないか，どれにも合わなければ"BGRA"）
+    """
+    surface = surface or pg.display.get_surface()
+    if surface is None or surface.get_bytesize() != 4:
+        return "BGRA"
+    order = ["A"]*4  # メモリ上のバイトの順のチャンネル
+    for channel, shift in zip("RGB", surface.get_shifts()):
+        order[shift//8 if sys.byteorder == "little" else 3-shift//8] = channel
+    fmt = "".join(order)
+    return fmt if fmt in ("BGRA", "RGBA", "ARGB") else "BGRA"
+
+
+def rgb_view(pixels: np.ndarray, fmt: str) -> np.ndarray:
+    """
+    （…, 高さ, 幅, 4）の画素の配列から，RGBの順の（…, 幅, 高さ, 3）のビューを作る（コピーしない）
+    引数1 pixels：pg.image.frombufferに渡した画素の配列
+    引数2 fmt：その形式（pixel_formatの戻り値）
+    """
+    r, b = fmt.index("R"), fmt.index("B")
+    step = 1 if b > r else -1
+    rgb = pixels[..., r:b+step if b+step >= 0 else None:step]
+    return rgb.swapaxes(-3, -2)
+
+
+class KokatonEnv:
+    """
+    1つのゲームをreset/stepで進める環境
+    画面はNumPyの配列を画素に使うSurface（pg.image.frombuffer）に描くので，観測はその配列のビューでコピーしない
+    （surfarray.pixels3dのビューはSurfaceをロックし，持っている間はblitできないため）
+    観測の形はsurfarray.pixels3dと同じ（幅, 高さ, RGB）で，次のstepで書き換わる
+    乱数列は環境ごとに持ち，stepのたびにRngに付け替えるので，1つのプロセスで複数の環境を動かしても種ごとに同じ結果になる
+    """
+    def __init__(self, render: bool=True, obs_scale: float=OBS_SCALE, max_steps: int=MAX_STEPS,
+                 pixels: np.ndarray|None=None, state: np.ndarray|None=None):
+        """
+        引数1 render：Falseなら画面を描かない（観測はNone）
+        引数2 obs_scale：画面の観測の解像度の倍率
+        引数3 max_steps：1回のゲームの最大ステップ数
+        引数4 pixels：画面の画素に使う（高さ, 幅, 4）のuint8配列（Noneなら作る，共有メモリを渡せる）
+        引数5 state：状態ベクトルを書く（STATE_DIM,）のfloat32配列（Noneなら作る）
+        """
+        self.max_steps = max_steps
+        self.streams: dict[str, random.Random] = {}
+        self.state = state if state is not None else np.zeros(STATE_DIM, np.float32)
+        self.screen = self.renderer = self.obs = None
+        if render:
+            width, height = mk.render_size(obs_scale)
+            self.pixels = pixels if pixels is not None else np.zeros((height, width, 4), np.uint8)
+            self.fmt = pixel_format()
+            self.screen = pg.image.frombuffer(self.pixels, (width, height), self.fmt)
+            self.obs = rgb_view(self.pixels, self.fmt)
+            self.obs_scale = obs_scale
+        self.world: mk.World|None = None
+        self.score = 0
+
+    def reset(self, seed: int|None=None) -> tuple[np.ndarray|None, np.ndarray]:
+        """
+        新しいゲームを始める
+        引数 seed：乱数の種（Noneならランダム）
+        戻り値：画面の観測と状態ベクトル
+        """
+        mk.Rng.streams = self.streams
+        mk.Rng.seed(seed)
+        if self.world is not None:  # 前のゲームのスプライトをプールに返す
+            self.world.close()
+        self.world = mk.World()
+        self.score = 0
+        if self.screen is not None:
+            self.renderer = mk.Renderer(self.screen, self.obs_scale)
+            self.renderer.draw(self.world)
+        return self.obs, self.observe_state()
+
+    def next_seed(self) -> int:
+        """
+        次のゲームの乱数の種を今のゲームの乱数列の続きから決める（最初の種が同じなら，続くゲームも同じになる）
+        """
+        return self.streams["enemy"].randrange(2**63)
+
+    def step(self, action: int) -> tuple[np.ndarray|None, np.ndarray, int, bool, dict]:
+        """
+        行動を1ステップ分行う
+        引数 action：行動番号（action_inputを参照）
+        戻り値：画面の観測，状態ベクトル，報酬（スコアの増分），終わったか，情報の辞書
+        """
+        mk.Rng.streams = self.streams
+        world = self.world
+        world.step(action_input(action))
+        if self.renderer is not None:
+            self.renderer.draw(world)
+        reward = world.score.score-self.score
+        self.score = world.score.score
+        done = world.over or world.tmr >= self.max_steps
+        info = {"steps": world.tmr, "score": world.score.score, "level": world.levels.level, "over": world.over}
+        return self.obs, self.observe_state(), reward, done, info
+
+    def observe_state(self) -> np.ndarray:
+        """
+        状態ベクトル（画面の大きさで割った座標）を書いて返す
+        こうかとんのx, y, 向きのx, y，敵機STATE_ENEMIES機のx, y，こうかとんに近い順の爆弾STATE_BOMBS個のx, y
+        足りない分は-1で埋める
+        """
+        world, state = self.world, self.state
+        state.fill(-1)
+        bird = world.bird.rect
+        state[0:4] = bird.centerx/mk.WIDTH, bird.centery/mk.HEIGHT, *world.bird.get_direction()
+        emys = [spr.rect.center for spr in world.emys][:STATE_ENEMIES]
+        if emys:
+            state[4:4+2*len(emys)] = (np.array(emys, np.float32)/(mk.WIDTH, mk.HEIGHT)).ravel()
+        bombs = np.array([spr.rect.center for spr in world.bombs], np.float32).reshape(-1, 2)
+        if len(bombs):
+            near = np.argsort(((bombs-bird.center)**2).sum(axis=1))[:STATE_BOMBS]
+            start = 4+2*STATE_ENEMIES
+            state[start:start+2*len(near)] = (bombs[near]/(mk.WIDTH, mk.HEIGHT)).ravel()
+        return state
+
+
+def worker_main(conn, indices: list[int], num: int, obs_name: str|None, state_name: str, render: bool,
+                obs_scale: float, max_steps: int):
+    """
+    ワーカープロセス：受け持ちの環境を作り，親からの命令（reset，step，close）を実行する
+    画面と状態ベクトルは共有メモリの受け持ちの場所に直接書く
+    """
+    init_process(render)
+    conn.send(pixel_format())  # 親が観測のビューを作れるよう，画素の形式を知らせる
+    width, height = mk.render_size(obs_scale)
+    state_shm = shared_memory.SharedMemory(state_name)
+    states = np.ndarray((num, STATE_DIM), np.float32, buffer=state_shm.buf)
+    obs_shm = shared_memory.SharedMemory(obs_name) if obs_name else None
+    pixels = np.ndarray((num, height, width, 4), np.uint8, buffer=obs_shm.buf) if obs_shm else None
+    envs = [
+        KokatonEnv(render, obs_scale, max_steps, pixels[i] if pixels is not None else None, states[i])
+        for i in indices
+    ]
+    try:
+        while True:
+            cmd, args = conn.recv()
+            if cmd == "reset":
+                for env, seed in zip(envs, args):
+                    env.reset(seed)
+                conn.send(None)
+            elif cmd == "step":
+                results = []
+                for env, action in zip(envs, args):
+                    _, _, reward, done, info = env.step(action)
+                    if done:  # 終わったゲームはすぐに次のゲームを始める（乱数列は続きから）
+                        info["episode"] = {"steps": info["steps"], "score": info["score"]}
+                        env.reset(env.next_seed())
+                    results.append((reward, done, info))
+                conn.send(results)
+            elif cmd == "close":
+                break
+    finally:
+        del envs, states, pixels  # 共有メモリを閉じる前にビューを消す
+        state_shm.close()
+        if obs_shm:
+            obs_shm.close()
+        conn.close()
+
+
+class VecKokatonEnv:
+    """
+    num個のゲームをworkers個のワーカープロセスで並列に進める環境
+    画面と状態ベクトルはワーカーが共有メモリに直接書くので，親プロセスへはコピーしない
+    obsは（num, 幅, 高さ, RGB），statesは（num, STATE_DIM）のビューで，次のstepで書き換わる
+    終わったゲームはそのワーカーがすぐに次のゲームを始め，infoの"episode"に結果を入れる
+    """
+    def __init__(self, num: int, workers: int|None=None, render: bool=True, obs_scale: float=OBS_SCALE,
+                 max_steps: int=MAX_STEPS):
+        """
+        引数1 num：ゲームの数
+        引数2 workers：ワーカープロセスの数（Noneならnumと同じ，numより多くはしない）
+        引数3 render：Falseなら画面を描かない（obsはNone）
+        引数4 obs_scale：画面の観測の解像度の倍率
+        引数5 max_steps：1回のゲームの最大ステップ数
+        """
+        self.num = num
+        workers = min(num, workers or num)
+        width, height = mk.render_size(obs_scale)
+        self.state_shm = shared_memory.SharedMemory(create=True, size=num*STATE_DIM*4)
+        self.states = np.ndarray((num, STATE_DIM), np.float32, buffer=self.state_shm.buf)
+        self.obs_shm = shared_memory.SharedMemory(create=True, size=num*height*width*4) if render else None
+        self.obs = None
+        ctx = multiprocessing.get_context("spawn")  # pygame（SDL）の状態をforkで子プロセスに持ち込まない
+        self.chunks = [list(range(num))[i::workers] for i in range(workers)]
+        self.conns, self.procs = [], []
+        for indices in self.chunks:
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=worker_main, daemon=True,
+                args=(child, indices, num, self.obs_shm.name if self.obs_shm else None, self.state_shm.name,
+                      render, obs_scale, max_steps),
+            )
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+        fmt = [conn.recv() for conn in self.conns][0]  # ワーカーはどれも同じドライバなので同じ形式
+        if self.obs_shm is not None:
+            pixels = np.ndarray((num, height, width, 4), np.uint8, buffer=self.obs_shm.buf)
+            self.obs = rgb_view(pixels, fmt)
+
+    def reset(self, seeds: list[int]|None=None) -> tuple[np.ndarray|None, np.ndarray]:
+        """
+        すべてのゲームを始める
+        引数 seeds：ゲームごとの乱数の種（Noneなら0, 1, 2, ...）
+        戻り値：画面の観測と状態ベクトル
+        """
+        seeds = seeds if seeds is not None else list(range(self.num))
+        for conn, indices in zip(self.conns, self.chunks):
+            conn.send(("reset", [seeds[i] for i in indices]))
+        for conn in self.conns:
+            conn.recv()
+        return self.obs, self.states
+
+    def step(self, actions) -> tuple[np.ndarray|None, np.ndarray, np.ndarray, np.ndarray, list[dict]]:
+        """
+        すべてのゲームを1ステップ進める（ワーカーごとに並列）
+        引数 actions：ゲームごとの行動番号
+        戻り値：画面の観測，状態ベクトル，報酬，終わったか，情報の辞書のリスト
+        """
+        for conn, indices in zip(self.conns, self.chunks):
+            conn.send(("step", [int(actions[i]) for i in indices]))
+        rewards = np.zeros(self.num, np.int64)
+        dones = np.zeros(self.num, bool)
+        infos: list[dict] = [{}]*self.num
+        for conn, indices in zip(self.conns, self.chunks):
+            for i, (reward, done, info) in zip(indices, conn.recv()):
+                rewards[i], dones[i], infos[i] = reward, done, info
+        return self.obs, self.states, rewards, dones, infos
+
+    def close(self):
+        """
+        ワーカープロセスを終わらせ，共有メモリを解放する
+        """
+        for conn in self.conns:
+            conn.send(("close", None))
+        for proc in self.procs:
+            proc.join()
+        self.obs = self.states = None
+        for shm in (self.state_shm, self.obs_shm):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+
+def main(argv: list[str]|None=None) -> int:
+    parser = argparse.ArgumentParser(description="こうかとん無双の環境のスループット計測")
+    parser.add_argument("--envs", type=int, default=4, help="並列に進めるゲームの数")
+    parser.add_argument("--workers", type=int, default=None, help="ワーカープロセスの数（0なら今のプロセスで順に進める）")
+    parser.add_argument("--steps", type=int, default=2000, help="計測するステップ数（ゲームごと）")
+    parser.add_argument("--obs-scale", type=float, default=OBS_SCALE, help="画面の観測の解像度の倍率")
+    parser.add_argument("--render", action=argparse.BooleanOptionalAction, default=True, help="画面の観測を描く")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種（行動の乱数とゲームごとの種）")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    seeds = [args.seed+i for i in range(args.envs)]
+    episodes = 0
+    if args.workers == 0:
+        init_process(args.render)
+        envs = [KokatonEnv(args.render, args.obs_scale) for _ in seeds]
+        for env, seed in zip(envs, seeds):
+            env.reset(seed)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            for env, action in zip(envs, rng.integers(NUM_ACTIONS, size=len(envs))):
+                done = env.step(int(action))[3]
+                if done:
+                    episodes += 1
+                    env.reset(env.next_seed())  # ワーカーと同じく乱数列の続きから種を決める
+        elapsed = time.perf_counter()-start
+        workers = 1
+    else:
+        vec = VecKokatonEnv(args.envs, args.workers, args.render, args.obs_scale)
+        workers = len(vec.procs)
+        vec.reset(seeds)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            dones = vec.step(rng.integers(NUM_ACTIONS, size=args.envs))[3]
+            episodes += int(dones.sum())
+        elapsed = time.perf_counter()-start
+        vec.close()
+    total = args.envs*args.steps/elapsed
+    cores = min(workers, os.cpu_count() or 1)
+    print(f"{args.envs} envs, {workers} workers, {cores} cores, render={args.render}, obs {mk.render_size(args.obs_scale)}")
+    print(f"{total:.0f} steps/s total, {total/cores:.0f} steps/s per core, {episodes} episodes, {elapsed:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
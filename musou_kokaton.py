@@ -1,9 +1,20 @@
+import argparse
+import gc
 import math
+import os
+import queue
 import random
+import struct
 import sys
+import threading
 import time
-from typing import Any
+import tracemalloc
+import warnings
+import weakref
+from collections import Counter, OrderedDict, deque
+from typing import Any, Callable, Iterator
 
+import numpy as np
 from pygame.locals import *
 import pygame as pg
 from pygame.sprite import AbstractGroup
@@ -11,25 +22,436 @@ from pygame.sprite import AbstractGroup
 
 WIDTH = 1600  # ゲームウィンドウの幅
 HEIGHT = 900  # ゲームウィンドウの高さ
+FIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fig")  # 画像ファイルのディレクトリ
+ATLAS_ANGLE_STEP = 5  # アトラスの回転角の量子化幅（度）：小さいほど滑らかだがメモリを使う
+ATLAS_SCALE_BUCKETS = 4  # アトラスの拡大率の段階数
+GRID_CELL = 100  # 衝突判定用の空間ハッシュのセルの大きさ（ピクセル）
+AURA_RATE = 1  # 1フレームに出すオーラの粒の数
+AURA_MAX = 64  # オーラの粒の最大数
+POOL_CAPACITY = 512  # 種類ごとにプールにとっておくスプライトの上限数
+GRID_BRUTE_RATIO = 250  # 組み合わせの数がスプライトの数の和のこの倍以下なら空間ハッシュを使わず総当たりで判定する（計測で決めた損益分岐点）
+DIRTY_MAX_RECTS = 96  # 変化した領域がこの数を超えたら画面全体を描き直す
+DIRTY_MAX_RATIO = 0.4  # 変化した領域の面積が画面のこの割合を超えたら画面全体を描き直す
+RENDER_SCALE = 1.0  # 内部で描画する解像度の倍率（0.5なら800×450で描いてウィンドウに拡大する）
+RENDER_UPSCALE = "blit"  # 拡大の方法："blit"（1回の拡大blit）か"scaled"（pg.SCALEDでSDLに拡大させる）
+SIM_RATE = 50  # 1秒あたりのゲームの進行ステップ数（寿命などのフレーム数はこのステップ数で数える）
+FRAME_RATE = 50  # 1秒あたりの描画回数の上限
+MAX_CATCHUP = 5  # 1回の描画の間に進めるステップ数の上限（超えた分の時間は捨てる）
+PACING = "tick"  # 描画の間隔の取り方："tick"，"tick_busy_loop"（より正確だがCPUを使う），"vsync"
+INTERPOLATE = False  # Trueなら前後のステップの間の位置に補間して描画する
+PIPELINE = False  # Trueなら描画を裏のスレッドで行い，次のステップと重ねる（--no-pipelineで1スレッドに戻せる）
+FRAME_REPORT = False  # Trueなら終了時にフレーム時間の揺らぎを表示する（--frame-report，--profileでも表示する）
+JITTER_WINDOW = 600  # 揺らぎの計算に使う直近の描画間隔の数
+PROFILE_WINDOW = 300  # 処理ごとの時間の分布に使う直近のフレーム数
+PROFILE_BINS = (0.25, 0.5, 1, 2, 4, 8, 16, 33)  # 時間の分布（ヒストグラム）の区切り（ミリ秒）
+PROFILE_OVERLAY_EVERY = 10  # 計測結果の表示を何フレームごとに書き換えるか
+WHEEL_SLOTS = 256  # タイミングホイールのスロット数（これより先の予定は周回待ちになる）
+ENEMY_PERIOD = 200  # 敵機が出現する間隔（ステップ数）
+BOMB_SPEED = 6  # 爆弾の速さ
+BEAM_SPEED_MIN = 5  # ビームの速さの下限（この間の乱数で決める）
+BEAM_SPEED_MAX = 20  # ビームの速さの上限
+NEOGRAVITY_COST = 200  # 画面全体の重力場を発動するのに使うスコア
+GRAVITY_COST = 50  # 重力場を発動するのに使うスコア
+SHIELD_COST = 50  # 防御壁を発動するのに使うスコア
+KOUKASHIELD_COST = 50  # 前後の防御壁を発動するのに使うスコア
+KOUKABALL_COST = 70  # こうかボールを放つのに使うスコア
+VOLLEY_BUDGET = 32  # 一斉射撃のビームを1ステップに生成する数の上限（残りは次のステップに回す）
+VOLLEY_MAX_PENDING = 512  # 生成を待つビームの上限数（超えた分は捨てる）
+MEMORY_EVERY = 500  # メモリの使用量を何ステップごとに調べるか
+MEMORY_WINDOW = 10  # この回数続けて増え続けたグループを警告する
+MEMORY_TOP = 10  # tracemalloc の差分を表示する行数
+STARTUP_REPORT = False  # Trueなら最初のフレームを描いたときに起動にかかった時間を表示する（--startup-report，--profileでも表示する）
+QUALITY_GOVERNOR = True  # Trueならフレーム時間に応じて見た目の品質を自動で上げ下げする（--no-qualityで止める）
+QUALITY_WINDOW = 30  # 品質を下げるか決めるのに使う直近のフレーム数
+QUALITY_RESTORE = 150  # このフレーム数続けて余裕があれば品質を1段戻す
+QUALITY_HEADROOM = 0.6  # フレームの処理時間が1フレームの予算のこの割合未満なら余裕があるとみなす
+QUALITY_LEVELS = (  # 品質の段階（後ろほど軽い）
+    # (1フレームに出すオーラの粒の数, オーラの粒の最大数, 爆発の時間の倍率, 同時に出す爆発の上限, 描画の解像度の倍率)
+    (AURA_RATE, AURA_MAX, 1.0, None, 1.0),
+    (0.5, 32, 0.5, 48, 1.0),
+    (0.25, 16, 0.3, 24, 0.75),
+    (0.1, 8, 0.2, 12, 0.5),
+)
+
+
+def to_display(img: pg.Surface, alpha: bool=False) -> pg.Surface:
+    """
+    Surfaceを画面のピクセル形式に変換して返す（画面未生成ならそのまま返す）
+    引数1 img：変換するSurface
+    引数2 alpha：Trueならカラーキーもピクセルごとの透明度に変換する（回転・拡大する画像用）
+    戻り値：変換後のSurface
+    """
+    if pg.display.get_surface() is None:
+        return img
+    if alpha or img.get_masks()[3]:  # ピクセルごとの透明度を持つ画像
+        return img.convert_alpha()
+    alpha = img.get_alpha()
+    img = img.convert()  # カラーキーは保持される
+    if alpha is not None:
+        img.set_alpha(alpha)  # 透明度はconvertで失われるので設定し直す
+    return img
+
+
+class Assets:
+    """
+    fig/以下の画像ファイルを一度だけ読み込み，共有Surfaceとして各クラスに渡すクラス
+    返したSurfaceは全インスタンスで共有するので，書き換えずにコピーや変換をして使うこと
+    preloadでファイルの読み込みを裏のスレッドで始めておけば，画面のピクセル形式への変換だけを
+    メインスレッドで行う（変換には画面が要るので裏では行わない）
+    """
+    imgs: dict[str, pg.Surface] = {}
+    raw: dict[str, pg.Surface] = {}  # 裏のスレッドで読み込んで，まだ変換していない画像
+    unconverted: set[str] = set()  # 画面生成前に読み込んだので変換していない画像
+    loader: threading.Thread|None = None
+    loads = Counter({"background": 0, "foreground": 0})  # 裏のスレッド／メインスレッドで読み込んだ数
+
+    @classmethod
+    def preload(cls):
+        """
+        まだ読み込んでいないfig/以下の画像を裏のスレッドで読み込み始める
+        """
+        if cls.loader is not None:
+            return
+        names = [name for name in sorted(os.listdir(FIG_DIR)) if name not in cls.imgs]
+        cls.loader = threading.Thread(target=cls.load_raw, args=(names,), name="assets", daemon=True)
+        cls.loader.start()
+
+    @classmethod
+    def load_raw(cls, names: list[str]):
+        """
+        裏のスレッドで画像ファイルを読み込む（先にメインスレッドで読み込まれたものは飛ばす）
+        """
+        for name in names:
+            if name in cls.imgs:
+                continue
+            cls.raw[name] = pg.image.load(os.path.join(FIG_DIR, name))
+            cls.loads["background"] += 1
+
+    @classmethod
+    def loading(cls) -> bool:
+        """
+        裏のスレッドがまだ読み込んでいればTrueを返す
+        """
+        return cls.loader is not None and cls.loader.is_alive()
+
+    @classmethod
+    def convert_next(cls) -> bool:
+        """
+        裏のスレッドで読み込み終わった画像を1枚だけ変換する
+        戻り値：変換した画像があればTrue
+        """
+        for name in list(cls.raw):
+            img = cls.raw.pop(name)
+            if name not in cls.imgs:
+                cls.imgs[name] = cls.convert(name, img)
+                return True
+        return False
+
+    @classmethod
+    def load_all(cls):
+        """
+        fig/以下のすべての画像を読み込み，画面のピクセル形式に変換しておく
+        裏のスレッドで読み込んでいれば終わるのを待ち，残りだけを読み込む
+        画面生成前に読み込んだ画像もここで変換し直す
+        """
+        if cls.loader is not None:
+            cls.loader.join()
+        while cls.convert_next():
+            pass
+        for name in sorted(os.listdir(FIG_DIR)):
+            if name in cls.unconverted:
+                cls.imgs[name] = cls.convert(name, cls.imgs[name])
+            elif name not in cls.imgs:
+                cls.get(name)
+
+    @classmethod
+    def get(cls, name: str) -> pg.Surface:
+        """
+        画像ファイル名に対応する共有Surfaceを返す（未読み込みならここで読み込む）
+        引数 name：fig/以下の画像ファイル名
+        戻り値：共有Surface
+        """
+        if name not in cls.imgs:
+            img = cls.raw.pop(name, None)
+            if img is None:
+                img = pg.image.load(os.path.join(FIG_DIR, name))
+                cls.loads["foreground"] += 1
+            cls.imgs[name] = cls.convert(name, img)
+        return cls.imgs[name]
+
+    @classmethod
+    def convert(cls, name: str, img: pg.Surface) -> pg.Surface:
+        """
+        読み込んだ画像を画面のピクセル形式に変換する
+        カラーキー付きの画像は回転・拡大したときに背景が残らないよう透明度付きに変換する
+        """
+        if pg.display.get_surface() is None:
+            cls.unconverted.add(name)
+        else:
+            cls.unconverted.discard(name)
+        return to_display(img, alpha=img.get_colorkey() is not None)
+
+
+class SurfaceCache:
+    """
+    図形から生成したSurfaceを（形状，大きさ，色，透明度，回転角）のキーごとに保持するLRUキャッシュ
+    形状（キーの先頭）ごとに上限数を持ち，超えたらその形状の中で最も長く使われていないSurfaceから捨てる
+    （BeamPlusの色×拡大率×回転角のように種類の多い形状が，他の形状のSurfaceを追い出さないように）
+    pin_bytes以上の大きなSurface（画面全体の重ね絵など）は作り直すと重いので捨てずに持っておく
+    返したSurfaceは共有されるので，書き換えずに使うこと
+    """
+    maxsize = 512  # 形状ごとに保持するSurfaceの上限数
+    pin_bytes = 256*1024  # この大きさ（バイト）以上のSurfaceは捨てない
+    kinds: "dict[str, OrderedDict[tuple, pg.Surface]]" = {}  # 形状と，そのSurfaceのLRU
+    pinned: dict[tuple, pg.Surface] = {}  # 捨てないSurface
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, key: tuple, factory: Callable[[], pg.Surface]) -> pg.Surface:
+        """
+        キーに対応するSurfaceを返す（未生成ならfactoryで生成し，画面のピクセル形式に変換して保持する）
+        引数1 key：("形状", 大きさ, 色, 透明度, 回転角, ...)のタプル
+        引数2 factory：Surfaceを生成する関数
+        戻り値：共有Surface
+        """
+        img = cls.pinned.get(key)
+        if img is not None:
+            cls.hits += 1
+            return img
+        surfs = cls.kinds.setdefault(key[0], OrderedDict())
+        img = surfs.get(key)
+        if img is not None:
+            cls.hits += 1
+            surfs.move_to_end(key)
+            return img
+        cls.misses += 1
+        img = to_display(factory())
+        if surface_bytes(img) >= cls.pin_bytes:
+            cls.pinned[key] = img
+            return img
+        surfs[key] = img
+        if len(surfs) > cls.maxsize:
+            surfs.popitem(last=False)
+        return img
+
+    @classmethod
+    def surfaces(cls) -> list[pg.Surface]:
+        """
+        保持しているすべてのSurfaceのリストを返す（監視用）
+        """
+        return [*cls.pinned.values(), *(img for surfs in cls.kinds.values() for img in surfs.values())]
+
+
+class Rng:
+    """
+    サブシステム（敵機，爆弾，ビーム，オーラ，BeamPlus）ごとの乱数列
+    種を1つ決めれば，サブシステムごとの乱数の使い方が変わっても他の乱数列はずれない
+    """
+    names = ("enemy", "bomb", "beam", "aura", "plus")
+    streams: dict[str, random.Random] = {}
+    current_seed: int|None = None
+
+    @classmethod
+    def seed(cls, seed: int|None=None) -> int:
+        """
+        すべての乱数列を種から初期化する（乱数列のオブジェクトはそのまま使い続けられる）
+        引数 seed：種（Noneならランダムに決める）
+        戻り値：使った種
+        """
+        if seed is None:
+            seed = random.randrange(2**63)
+        cls.current_seed = seed
+        for name in cls.names:
+            cls.get(name).seed(f"{seed}:{name}")
+        return seed
+
+    @classmethod
+    def get(cls, name: str) -> random.Random:
+        """
+        サブシステムnameの乱数列を返す
+        """
+        if name not in cls.streams:
+            cls.streams[name] = random.Random()
+        return cls.streams[name]
+
+
+def make_circle(rad: int, color, colorkey=(0, 0, 0), alpha: int|None=None, bg=None) -> pg.Surface:
+    """
+    半径radの円を描いたSurfaceを生成する
+    引数1 rad：円の半径
+    引数2 color：円の色
+    引数3 colorkey：透明にする色
+    引数4 alpha：Surface全体の透明度（Noneなら不透明）
+    引数5 bg：円を描く前に塗りつぶす背景色（Noneなら黒のまま）
+    戻り値：円を描いたSurface
+    """
+    img = pg.Surface((2*rad, 2*rad))
+    if bg is not None:
+        img.fill(bg)
+    if alpha is not None:
+        img.set_alpha(alpha)
+    pg.draw.circle(img, color, (rad, rad), rad)
+    img.set_colorkey(colorkey)
+    return img
+
+
+def make_bar(size: tuple[float, float], color, angle: float, scale: float=1.0) -> pg.Surface:
+    """
+    黒いSurfaceを回転・拡大した上に，回転前の大きさの矩形を描いたSurfaceを生成する（防御壁・BeamPlus用）
+    引数1 size：回転前の矩形の大きさ
+    引数2 color：矩形の色
+    引数3 angle：回転角（度数法）
+    引数4 scale：拡大率
+    戻り値：矩形を描いたSurface
+    """
+    img = pg.transform.rotozoom(pg.Surface(size), angle, scale)
+    pg.draw.rect(img, color, pg.Rect(0, 0, *size))
+    return img
+
+
+def make_rect(size: tuple[int, int], color, colorkey=None, alpha: int|None=None) -> pg.Surface:
+    """
+    全体を1色の矩形で塗ったSurfaceを生成する
+    引数1 size：Surfaceの大きさ
+    引数2 color：矩形の色
+    引数3 colorkey：透明にする色（Noneなら設定しない）
+    引数4 alpha：Surface全体の透明度（Noneなら不透明）
+    戻り値：矩形を描いたSurface
+    """
+    img = pg.Surface(size)
+    pg.draw.rect(img, color, pg.Rect(0, 0, *size))
+    if colorkey is not None:
+        img.set_colorkey(colorkey)
+    if alpha is not None:
+        img.set_alpha(alpha)
+    return img
+
+
+def bar_image(size: tuple[float, float], color, angle: float, scale: float=1.0, kind: str="bar") -> pg.Surface:
+    """
+    防御壁・BeamPlusの画像を量子化した回転角でキャッシュから取り出す
+    引数1 size：回転前の矩形の大きさ
+    引数2 color：矩形の色
+    引数3 angle：回転角（度数法）
+    引数4 scale：拡大率
+    引数5 kind：キャッシュの形状名（種類の多いBeamPlusは"plus"にして，防御壁の画像を追い出さないようにする）
+    戻り値：共有Surface
+    """
+    angle = quantize_angle(angle)
+    return SurfaceCache.get((kind, size, color, None, angle, scale), lambda: make_bar(size, color, angle, scale))
+
+
+def quantize_angle(angle: float, step: int|None=None) -> int:
+    """
+    回転角を量子化幅の倍数に丸め，0以上360未満の整数で返す
+    引数1 angle：回転角（度数法）
+    引数2 step：量子化幅（Noneなら設定値ATLAS_ANGLE_STEP）
+    戻り値：量子化した回転角
+    """
+    step = step or ATLAS_ANGLE_STEP
+    return int(round(angle/step)*step) % 360
+
+
+def scale_buckets(lo: float, hi: float, num: int|None=None) -> list[float]:
+    """
+    [lo, hi)の範囲をnum等分した各区間の中央値を拡大率の段階として返す
+    引数1 lo：拡大率の下限
+    引数2 hi：拡大率の上限
+    引数3 num：段階数（Noneなら設定値ATLAS_SCALE_BUCKETS）
+    戻り値：拡大率の段階のリスト
+    """
+    num = num or ATLAS_SCALE_BUCKETS
+    width = (hi-lo) / num
+    return [round(lo+width*(i+0.5), 3) for i in range(num)]
+
+
+class RotAtlas:
+    """
+    基準画像を量子化した回転角・拡大率ごとに回転・拡大しておくアトラス
+    生成時に回転させる代わりに，最も近い角度・拡大率の画像を引いて使う
+    """
+    def __init__(self, base: pg.Surface, scales: list[float], step: int|None=None):
+        """
+        引数1 base：基準画像
+        引数2 scales：拡大率の段階のリスト
+        引数3 step：回転角の量子化幅（Noneなら設定値ATLAS_ANGLE_STEP）
+        """
+        self.base = base
+        self.scales = scales
+        self.step = step or ATLAS_ANGLE_STEP
+        self.imgs: dict[tuple[int, float], pg.Surface] = {}
+
+    def build(self):
+        """
+        すべての回転角・拡大率の画像をまとめて生成しておく
+        """
+        for _ in self.build_steps():
+            pass
+
+    def build_steps(self) -> Iterator[None]:
+        """
+        回転角1つ分ずつ画像を生成する（スタート画面の表示中に少しずつ進める用）
+        """
+        for angle in range(0, 360, self.step):
+            for scale in self.scales:
+                self.get(angle, scale)
+            yield
+
+    def nearest_scale(self, scale: float) -> float:
+        """
+        最も近い拡大率の段階を返す
+        """
+        return min(self.scales, key=lambda s: abs(s-scale))
+
+    def get(self, angle: float, scale: float) -> pg.Surface:
+        """
+        最も近い回転角・拡大率の画像を返す（未生成ならここで生成する）
+        引数1 angle：回転角（度数法）
+        引数2 scale：拡大率
+        戻り値：共有Surface
+        """
+        key = quantize_angle(angle, self.step), self.nearest_scale(scale)
+        img = self.imgs.get(key)
+        if img is None:
+            img = self.imgs[key] = to_display(pg.transform.rotozoom(self.base, *key))
+        return img
 
-def start_screen(screen):
+    def nbytes(self) -> int:
+        """
+        アトラスが保持している画像の合計バイト数を返す
+        """
+        return sum(map(surface_bytes, self.imgs.values()))
+
+
+def surface_bytes(img: pg.Surface) -> int:
+    """
+    Surfaceのピクセルが使っているバイト数（行の詰め物を含む）を返す
+    """
+    return img.get_pitch()*img.get_height()
+
+
+def start_screen(screen, idle: Iterator|None=None):
     """
     スタート画面を表示する
     引数1 screen: 画面Surface
+    引数2 idle: キー入力を待つ間に1つずつ進める準備（warm_upなど）
     """
-    bg_img = pg.image.load("ex05/fig/pg_bg.jpg")
-    font_title = pg.font.Font(None, 150)
-    text_title = font_title.render("SHOOTING GAME", True, (0, 0, 0))
+    canvas = screen if screen.get_size() == (WIDTH, HEIGHT) else pg.Surface((WIDTH, HEIGHT))  # 内部解像度が小さいときはWIDTH×HEIGHTで描いて縮める
+    bg_img = Assets.get("pg_bg.jpg")
+    text_title = GlyphAtlas.get(150, (0, 0, 0), True).glyph("SHOOTING GAME")
     text_title_rect = text_title.get_rect(center=(WIDTH // 2, HEIGHT // 2 - 40))
 
-    font = pg.font.Font(None, 80)
-    text = font.render("Press SPACE BAR to start.", True, (0, 0, 0))
+    text = GlyphAtlas.get(80, (0, 0, 0), True).glyph("Press SPACE BAR to start.")
     text_rect = text.get_rect(center=(WIDTH // 2, HEIGHT // 2 + 90))
 
-    screen.blit(bg_img, (0, 0))
-    screen.blit(text_title, text_title_rect)  # タイトルを表示する
-    screen.blit(text, text_rect)  # 操作方法を表示する
+    canvas.blit(bg_img, (0, 0))
+    canvas.blit(text_title, text_title_rect)  # タイトルを表示する
+    canvas.blit(text, text_rect)  # 操作方法を表示する
+    if canvas is not screen:
+        pg.transform.smoothscale(canvas, screen.get_size(), screen)
     pg.display.flip()
+    Startup.mark("title_shown")
 
     while True:
         for event in pg.event.get():
@@ -38,6 +460,8 @@ def start_screen(screen):
                 sys.exit()
             elif event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
                 return
+        if idle is None or next(idle, None) is None:
+            pg.time.wait(5)  # 準備が終わったら入力を待つ間CPUを使わない
 
 def check_bound(obj: pg.Rect) -> tuple[bool, bool]:
     """
@@ -65,6 +489,240 @@ def calc_orientation(org: pg.Rect, dst: pg.Rect) -> tuple[float, float]:
     return x_diff/norm, y_diff/norm
 
 
+class SpatialHash:
+    """
+    画面を一様な格子に区切り，グループごとに各セルと重なるスプライトを登録しておく空間ハッシュ
+    衝突判定では近くのセルに登録されたスプライトとだけ矩形を比べるので，
+    判定の手間がグループの大きさの積ではなく，近くにあるスプライトの数で決まる
+    """
+    def __init__(self, cell: int=GRID_CELL):
+        """
+        引数 cell：セルの大きさ（ピクセル）
+        """
+        self.cell = cell
+        self.index: dict[pg.sprite.AbstractGroup, dict[int, list[pg.sprite.Sprite]]] = {}
+
+    def clear(self):
+        """
+        登録をすべて消す（スプライトが動いたあと，フレームごとに呼ぶ）
+        """
+        self.index = {}
+
+    def cells(self, rect: pg.Rect) -> list[int]:
+        """
+        矩形と重なるセルの番号のリストを返す
+        セル番号は(行<<12)+列なので，画面外にはみ出したセルもそのまま区別できる
+        """
+        c = self.cell
+        left, top, w, h = rect
+        x0, y0 = left//c, top//c
+        x1, y1 = (left+w-1)//c, (top+h-1)//c
+        if x0 == x1 and y0 == y1:  # ほとんどのスプライトは1セルに収まる
+            return [(y0<<12)+x0]
+        return [(y<<12)+x for y in range(y0, y1+1) for x in range(x0, x1+1)]
+
+    def add(self, group: pg.sprite.AbstractGroup) -> dict[int, list[pg.sprite.Sprite]]:
+        """
+        グループのスプライトを現在の位置でセルに登録する
+        """
+        cells: dict[int, list[pg.sprite.Sprite]] = {}
+        for spr in group.sprites():
+            for key in self.cells(spr.rect):
+                if key in cells:
+                    cells[key].append(spr)
+                else:
+                    cells[key] = [spr]
+        self.index[group] = cells
+        return cells
+
+    def query(self, sprite: pg.sprite.Sprite, group: pg.sprite.AbstractGroup,
+              cells: dict[int, list[pg.sprite.Sprite]], keys: list[int]|None=None) -> list:
+        """
+        spriteと重なるセルに登録されたgroupのスプライトのうち，衝突したもののリストを返す
+        keysにspriteのセル番号を渡せば，複数のグループと判定するときに計算し直さずに済む
+        """
+        rect = sprite.rect
+        hits = {}
+        for key in keys if keys is not None else self.cells(rect):
+            for spr in cells.get(key, ()):
+                if spr not in hits and spr in group and rect.colliderect(spr.rect):
+                    hits[spr] = None
+        return list(hits)
+
+
+class ProjectileStore:
+    """
+    飛び道具（Beam，BeamPlus，Bomb，KoukaBall）の位置と1フレームの移動量をNumPy配列でまとめて持つクラス
+    移動と画面外判定を配列演算でまとめて行い，消えたものはフレームごとにまとめて詰める
+    スプライトのrectには毎フレーム位置を書き戻すので，描画と衝突判定はこれまでどおりrectで行う
+    """
+    def __init__(self):
+        self.sprites: list[pg.sprite.Sprite] = []
+        self.rects: list[pg.Rect] = []  # 各スプライトのrect（位置の書き戻し用）
+        self.index: dict[pg.sprite.Sprite, int]|None = {}  # スプライトと配列の行番号の辞書（Noneなら作り直す）
+        self.pos = np.zeros((0, 2), np.int64)  # 左上の座標
+        self.vel = np.zeros((0, 2), np.int64)  # 1フレームの移動量（rect.move_ipと同じく0方向に切り捨てる）
+        self.size = np.zeros((0, 2), np.int64)  # 幅と高さ
+        self.new: list[pg.sprite.Sprite] = []  # 次のフレームから配列に加えるスプライト
+        self.dead: set[int] = set()  # 次に詰めるときに取り除く行番号
+
+    def __len__(self) -> int:
+        return len(self.sprites)-len(self.dead)+len(self.new)
+
+    def add(self, spr: pg.sprite.Sprite):
+        """
+        スプライトを登録する（速度ベクトルvx, vyと速さspeedを持つこと）
+        """
+        self.new.append(spr)
+
+    def remove(self, spr: pg.sprite.Sprite):
+        """
+        スプライトの登録を消す（配列からは次に詰めるときにまとめて取り除く）
+        """
+        if spr in self.new:  # プールで使い回したスプライトは古い行にも残っているので先に調べる
+            self.new.remove(spr)
+            return
+        if self.index is None:  # 詰めたあと初めて消されたときだけ作り直す
+            self.index = {s: i for i, s in enumerate(self.sprites)}
+        i = self.index.get(spr)
+        if i is not None:
+            self.dead.add(i)
+
+    def flush(self):
+        """
+        消えた行をまとめて詰め，新しく登録されたスプライトを配列に加える
+        """
+        if not (self.dead or self.new):
+            return
+        if self.dead:
+            keep = np.ones(len(self.sprites), bool)
+            keep[list(self.dead)] = False
+            self.pos, self.vel, self.size = self.pos[keep], self.vel[keep], self.size[keep]
+            self.sprites = [spr for spr, k in zip(self.sprites, keep.tolist()) if k]
+            self.rects = [spr.rect for spr in self.sprites]
+            self.dead.clear()
+        if self.new:
+            new = self.new
+            self.pos = np.concatenate([self.pos, np.array([spr.rect.topleft for spr in new], np.int64)])
+            vel = np.array([(spr.speed*spr.vx, spr.speed*spr.vy) for spr in new])
+            self.vel = np.concatenate([self.vel, np.trunc(vel).astype(np.int64)])
+            self.size = np.concatenate([self.size, np.array([spr.rect.size for spr in new], np.int64)])
+            self.sprites.extend(new)
+            self.rects.extend(spr.rect for spr in new)
+            self.new = []
+        self.index = None
+
+    def step(self):
+        """
+        すべての飛び道具を1フレーム分動かし，画面外に出たものを消す
+        """
+        self.flush()
+        if not self.sprites:
+            return
+        pos = self.pos
+        pos += self.vel
+        end = pos+self.size
+        out = (pos[:, 0] < 0) | (pos[:, 1] < 0) | (end[:, 0] > WIDTH) | (end[:, 1] > HEIGHT)
+        for rect, x, y in zip(self.rects, pos[:, 0].tolist(), pos[:, 1].tolist()):
+            rect.x = x
+            rect.y = y
+        outs = np.flatnonzero(out).tolist()
+        if outs:
+            index, self.index = self.index, {}  # 行番号は分かっているので，killから呼ばれるremoveでは探さない
+            for i in outs:
+                self.sprites[i].kill()
+            self.index = index
+            self.dead.update(outs)  # 配列からは次のフレームの初めにまとめて取り除く
+
+
+class ProjectileGroup(pg.sprite.Group):
+    """
+    追加・削除したスプライトをProjectileStoreにも登録・削除するスプライトグループ
+    """
+    def __init__(self, store: ProjectileStore, *sprites):
+        self.store = store
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.store.add(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        self.store.remove(sprite)
+
+
+class BirdBank:
+    """
+    こうかとん画像を（状態，向き，表情）ごとに一度だけ生成して共有するクラス
+    状態："normal"，"hyper"（laplacian変換済み）
+    表情："normal"（基の画像），"happy"（6.png），"sad"（8.png）
+    """
+    expressions = {6: "happy", 8: "sad"}  # 表情画像の番号と表情名の辞書
+    banks: dict[tuple, dict[tuple[str, tuple[int, int], str], pg.Surface]] = {}
+    expr_banks: dict[tuple[int, int]|None, dict[str, pg.Surface]] = {}  # 表情画像の大きさと，表情ごとの画像
+
+    @classmethod
+    def get(cls, num: int, size: tuple[int, int]|None=None, expr_size: tuple[int, int]|None=None) -> dict:
+        """
+        画像の番号と大きさに対応する画像の辞書を返す（未生成ならここで生成する）
+        引数1 num：こうかとん画像ファイル名の番号
+        引数2 size：向きごとの画像の大きさ（Noneなら2倍に拡大したまま）
+        引数3 expr_size：表情画像の大きさ（Noneなら2倍に拡大したまま）
+        戻り値：(状態, 向き, 表情)をキーとする画像の辞書
+        """
+        key = num, size, expr_size
+        if key not in cls.banks:
+            cls.banks[key] = cls.build(num, size, expr_size)
+        return cls.banks[key]
+
+    @classmethod
+    def build(cls, num: int, size: tuple[int, int]|None, expr_size: tuple[int, int]|None) -> dict:
+        """
+        8方向の回転画像とそのlaplacian変換，表情画像をまとめて生成する
+        """
+        img0 = pg.transform.rotozoom(Assets.get(f"{num}.png"), 0, 2.0)
+        if size is not None:
+            img0 = pg.transform.scale(img0, size)
+        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
+        imgs = {
+            (+1, 0): img,  # 右
+            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
+            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
+            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
+            (-1, 0): img0,  # 左
+            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
+            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
+            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
+        }
+        exprs = cls.get_expressions(expr_size)
+        bank = {}
+        for dire, dire_img in imgs.items():
+            bank["normal", dire, "normal"] = to_display(dire_img)
+            bank["hyper", dire, "normal"] = to_display(pg.transform.laplacian(dire_img))  # 画像imageを変換
+            for expr, expr_img in exprs.items():  # 表情画像は向きや状態によらず同じSurfaceを共有する
+                bank["normal", dire, expr] = expr_img
+                bank["hyper", dire, expr] = expr_img
+        return bank
+
+    @classmethod
+    def get_expressions(cls, expr_size: tuple[int, int]|None) -> dict[str, pg.Surface]:
+        """
+        表情ごとの画像を返す（表情画像はこうかとんの番号によらないので，大きさごとに一度だけ生成する）
+        引数 expr_size：表情画像の大きさ（Noneなら2倍に拡大したまま）
+        戻り値：表情名をキーとする画像の辞書
+        """
+        if expr_size not in cls.expr_banks:
+            exprs = {}
+            for expr_num, expr in cls.expressions.items():
+                expr_img = pg.transform.rotozoom(Assets.get(f"{expr_num}.png"), 10, 2.0)
+                if expr_size is not None:
+                    expr_img = pg.transform.scale(expr_img, expr_size)
+                exprs[expr] = to_display(expr_img)
+            cls.expr_banks[expr_size] = exprs
+        return cls.expr_banks[expr_size]
+
+
 class Bird(pg.sprite.Sprite):
     """
     ゲームキャラクター（こうかとん）に関するクラス
@@ -83,18 +741,8 @@ class Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img0 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 2.0)
-        img = pg.transform.flip(img0, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img0, -45, 1.0),  # 左上
-            (-1, 0): img0,  # 左
-            (-1, +1): pg.transform.rotozoom(img0, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
-        }
+        self.bank = BirdBank.get(num)
+        self.imgs = {dire: img for (state, dire, expr), img in self.bank.items() if state == expr == "normal"}
         self.dire = (+1, 0)
         self.image = self.imgs[self.dire]
         self.rect = self.image.get_rect()
@@ -102,23 +750,17 @@ class Bird(pg.sprite.Sprite):
         self.speed = 10
         self.state = "normal"
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        こうかとん画像を切り替える（画面への転送はRendererが行う）
+        引数 num：こうかとん画像ファイル名の番号
         """
+        self.image = self.bank["normal", self.dire, BirdBank.expressions[num]]
 
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 10, 2.0)
-
-        
-        screen.blit(self.image, self.rect)
-
-    def update(self, key_lst: list[bool], screen: pg.Surface):
+    def update(self, key_lst: list[bool]):
         """
         押下キーに応じてこうかとんを移動させる
-        引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
+        引数 key_lst：押下キーの真理値リスト
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta.items():
@@ -132,16 +774,11 @@ class Bird(pg.sprite.Sprite):
                     self.rect.move_ip(-self.speed*mv[0], -self.speed*mv[1])
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
-            self.image = self.imgs[self.dire]
-
             if self.state == "normal" or self.hyper_life < 0:
                 self.state = "normal"
-                self.image = self.imgs[self.dire]
             elif self.state == "hyper":
-                self.image = pg.transform.laplacian(self.imgs[self.dire])  # 画像imageを変換
                 self.hyper_life -= 1  # 発動時間hyper_lifeを1減らす
-            
-        screen.blit(self.image, self.rect)
+            self.image = self.bank[self.state, self.dire, "normal"]  # 変換済みの画像を引くだけ
 
     def get_direction(self) -> tuple[int, int]:
         return self.dire
@@ -174,19 +811,8 @@ class Small_Bird(pg.sprite.Sprite):
         引数2 xy：こうかとん画像の位置座標タプル
         """
         super().__init__()
-        img10 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 0, 2.0)
-        img10 = pg.transform.scale(img10, (70, 70))
-        img = pg.transform.flip(img10, True, False)  # デフォルトのこうかとん
-        self.imgs = {
-            (+1, 0): img,  # 右
-            (+1, -1): pg.transform.rotozoom(img, 45, 1.0),  # 右上
-            (0, -1): pg.transform.rotozoom(img, 90, 1.0),  # 上
-            (-1, -1): pg.transform.rotozoom(img10, -45, 1.0),  # 左上
-            (-1, 0): img10,  # 左
-            (-1, +1): pg.transform.rotozoom(img10, 45, 1.0),  # 左下
-            (0, +1): pg.transform.rotozoom(img, -90, 1.0),  # 下
-            (+1, +1): pg.transform.rotozoom(img, -45, 1.0),  # 右下
-        }
+        self.bank = BirdBank.get(num, (70, 70), (50, 50))
+        self.imgs = {dire: img for (state, dire, expr), img in self.bank.items() if state == expr == "normal"}
         self.dire = (+1, 0)
         self.image2 = self.imgs[self.dire]
         self.rect = self.image2.get_rect()
@@ -194,21 +820,17 @@ class Small_Bird(pg.sprite.Sprite):
         self.speed = 10
         self.state2 = "small"
 
-    def change_img(self, num: int, screen: pg.Surface):
+    def change_img(self, num: int):
         """
-        こうかとん画像を切り替え，画面に転送する
-        引数1 num：こうかとん画像ファイル名の番号
-        引数2 screen：画面Surface
+        こうかとん画像を切り替える（画面への転送はRendererが行う）
+        引数 num：こうかとん画像ファイル名の番号
         """
-        self.image2 = pg.transform.rotozoom(pg.image.load(f"ex05/fig/{num}.png"), 10, 2.0)
-        self.image2 = pg.transform.scale(self.image2, (50, 50))
-        screen.blit(self.image2, self.rect)
+        self.image2 = self.bank["normal", self.dire, BirdBank.expressions[num]]
         
-    def update(self, key_lst: list[bool], screen: pg.Surface):
+    def update(self, key_lst: list[bool]):
         """
         押下キーに応じてこうかとんを移動させる
-        引数1 key_lst：押下キーの真理値リスト
-        引数2 screen：画面Surface
+        引数 key_lst：押下キーの真理値リスト
         """
         sum_mv = [0, 0]
         for k, mv in __class__.delta2.items():
@@ -222,16 +844,12 @@ class Small_Bird(pg.sprite.Sprite):
                     self.rect.move_ip(-self.speed*mv[0], -self.speed*mv[1])
         if not (sum_mv[0] == 0 and sum_mv[1] == 0):
             self.dire = tuple(sum_mv)
-            self.image2 = self.imgs[self.dire]
-
             if self.state2 == "small" or self.hyper_life < 0:
                 self.state2 = "small"
-                self.image2 = self.imgs[self.dire]
+                self.image2 = self.bank["normal", self.dire, "normal"]
             elif self.state2 == "hyper":
-                self.image2 = pg.transform.laplacian(self.imgs[self.dire])  # 画像imageを変換
+                self.image2 = self.bank["hyper", self.dire, "normal"]  # 変換済みの画像を引くだけ
                 self.hyper_life -= 1  # 発動時間hyper_lifeを1減らす
-            
-        screen.blit(self.image2, self.rect)
 
     def get_direction(self) -> tuple[int, int]:
         return self.dire
@@ -246,30 +864,201 @@ class Small_Bird(pg.sprite.Sprite):
         self.hyper_life = hyper_life
 
         
-class Bomb(pg.sprite.Sprite):
+class SpritePool:
+    """
+    消えたスプライトをとっておき，次に生成するときにreset()で初期化し直して使い回すプール
+    """
+    def __init__(self, cls: type, capacity: int=POOL_CAPACITY):
+        """
+        引数1 cls：使い回すスプライトのクラス（Pooledを継承していること）
+        引数2 capacity：とっておくスプライトの上限数
+        """
+        self.cls = cls
+        self.capacity = capacity
+        self.free: list[pg.sprite.Sprite] = []
+        self.hits = 0  # 使い回した回数
+        self.misses = 0  # 新しく生成した回数
+        self.live = 0  # 使用中の数
+        self.high_water = 0  # 使用中の数の最大値
+
+    def get(self, *args) -> pg.sprite.Sprite:
+        """
+        とっておいたスプライトをargsで初期化し直して返す（なければ新しく生成する）
+        """
+        if self.free:
+            spr = self.free.pop()
+            spr.reset(*args)
+            self.hits += 1
+        else:
+            spr = self.cls(*args)
+            self.misses += 1
+        spr.in_use = True
+        self.live += 1
+        if self.live > self.high_water:
+            self.high_water = self.live
+        return spr
+
+    def release(self, spr: pg.sprite.Sprite):
+        """
+        消えたスプライトを上限数までとっておく
+        """
+        spr.in_use = False
+        self.live -= 1
+        if len(self.free) < self.capacity:
+            self.free.append(spr)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "live": self.live,
+            "free": len(self.free),
+            "high_water": self.high_water,
+        }
+
+
+class TimingWheel:
+    """
+    ステップ数で指定した時刻に関数を呼ぶタイミングホイール
+    時刻atの予定はat % スロット数 番のスロットに入り，run(now)はそのスロットの予定だけを調べる
+    （スロット数以上先の予定は周回待ちで残る）ので，1ステップの処理は生きている予定の数によらない
+    呼ばれた関数が時刻を返したら，その時刻にもう一度呼ぶ（Noneなら終わり）
+    """
+    def __init__(self, slots: int=WHEEL_SLOTS):
+        """
+        引数 slots：スロット数
+        """
+        self.slots: list[list[list]] = [[] for _ in range(slots)]
+        self.depth = 0  # 予定の数（監視用）
+        self.fired = 0  # 呼んだ回数
+
+    def schedule(self, at: int, callback: Callable[..., int|None], *args):
+        """
+        時刻atにcallback(at, *args)を呼ぶ予定を入れる
+        """
+        self.slots[at % len(self.slots)].append([at, callback, args])
+        self.depth += 1
+
+    def run(self, now: int):
+        """
+        時刻nowの予定を入れた順に実行する
+        """
+        idx = now % len(self.slots)
+        slot = self.slots[idx]
+        if not slot:
+            return
+        due = [entry for entry in slot if entry[0] <= now]
+        if not due:
+            return
+        self.slots[idx] = [entry for entry in slot if entry[0] > now]
+        for entry in due:
+            at, callback, args = entry
+            self.depth -= 1
+            self.fired += 1
+            nxt = callback(now, *args)
+            if nxt is not None:
+                entry[0] = nxt
+                self.slots[nxt % len(self.slots)].append(entry)
+                self.depth += 1
+
+
+class HookedGroup(pg.sprite.Group):
+    """
+    スプライトが加えられたときにon_addを呼ぶグループ（寿命や爆弾投下の予定をタイミングホイールに入れる）
+    """
+    def __init__(self, on_add: Callable[[pg.sprite.Sprite], None], *sprites):
+        self.on_add = on_add
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        self.on_add(sprite)
+
+
+class Timed:
+    """
+    寿命が来たら消えるスプライトのための基底クラス
+    HookedGroupに加えたときにexpiresの時刻がタイミングホイールに入り，その時刻にexpireが呼ばれる
+    寿命を毎フレーム数えないので，lifeは寿命の長さ（ステップ数）のまま変わらない
+    """
+    life = 0
+
+    def expires(self, now: int) -> int:
+        """
+        加えられた時刻nowから，最初にexpireを呼ぶ時刻を返す
+        毎フレームlifeを1減らして負になったら消していたのと同じく，life+1回目の更新で消す
+        """
+        return now+self.life
+
+    def expire(self, now: int) -> int|None:
+        """
+        寿命が来たので消える（次に呼ぶ時刻はないのでNoneを返す）
+        """
+        self.kill()
+        return None
+
+
+class Pooled:
+    """
+    kill()されたらプールに戻るスプライトのための基底クラス
+    継承したクラスは__init__の引数で初期化し直すreset()を持つこと
+    """
+    pool: SpritePool|None = None
+    in_use = False  # プールから取り出されて使用中ならTrue
+
+    @classmethod
+    def spawn(cls, *args) -> pg.sprite.Sprite:
+        """
+        プールから取り出して（プールがなければ生成して）返す
+        """
+        if cls.pool is None:
+            return cls(*args)
+        return cls.pool.get(*args)
+
+    def kill(self):
+        super().kill()
+        if self.in_use:  # spawn()で取り出したものだけプールに戻す
+            self.pool.release(self)
+
+    def fit_rect(self):
+        """
+        imageの大きさのrectを用意する（使い回すときは同じRectの大きさだけ変える）
+        """
+        rect = getattr(self, "rect", None)
+        if rect is None:
+            self.rect = self.image.get_rect()
+        else:
+            rect.size = self.image.get_size()
+
+
+class Bomb(Pooled, pg.sprite.Sprite):
     """
     爆弾に関するクラス
     """
     colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (255, 0, 255), (0, 255, 255)]
 
     def __init__(self, emy: "Enemy", bird: Bird):
+        super().__init__()
+        self.reset(emy, bird)
+
+    def reset(self, emy: "Enemy", bird: Bird):
         """
         爆弾円Surfaceを生成する
         引数1 emy：爆弾を投下する敵機
         引数2 bird：攻撃対象のこうかとん
         """
-        super().__init__()
-        rad = random.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
-        color = random.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
-        self.image = pg.Surface((2*rad, 2*rad))
-        pg.draw.circle(self.image, color, (rad, rad), rad)
-        self.image.set_colorkey((0, 0, 0))
-        self.rect = self.image.get_rect()
+        rng = Rng.get("bomb")
+        rad = rng.randint(10, 50)  # 爆弾円の半径：10以上50以下の乱数
+        color = rng.choice(__class__.colors)  # 爆弾円の色：クラス変数からランダム選択
+        self.image = SurfaceCache.get(
+            ("circle", 2*rad, color, None, 0), lambda: make_circle(rad, color)
+        )  # 半径と色が同じ爆弾は同じSurfaceを使い回す
+        self.fit_rect()
         # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
         self.vx, self.vy = calc_orientation(emy.rect, bird.rect)  
         self.rect.centerx = emy.rect.centerx
         self.rect.centery = emy.rect.centery + emy.rect.height/2
-        self.speed = 6
+        self.speed = BOMB_SPEED
 
     def update(self):
         """
@@ -281,26 +1070,48 @@ class Bomb(pg.sprite.Sprite):
             self.kill()
 
 
-class Beam(pg.sprite.Sprite):
+class Beam(Pooled, pg.sprite.Sprite):
     """
     ビームに関するクラス
     """
-    def __init__(self, bird: Bird, angle_a: float=0):
+    atlas: RotAtlas|None = None  # 回転・拡大済みのビーム画像
+
+    @classmethod
+    def get_atlas(cls) -> RotAtlas:
         """
-        ビーム画像Surfaceを生成する
-        引数 bird：ビームを放つこうかとん
+        ビーム画像のアトラスを返す（初回呼び出し時に生成する）
         """
+        if cls.atlas is None:
+            cls.atlas = RotAtlas(Assets.get("beam.png"), scale_buckets(1.5, 3.0))
+        return cls.atlas
+
+    def __init__(self, bird: Bird, angle_a: float=0, size: float|None=None, speed: float|None=None):
         super().__init__()
+        self.reset(bird, angle_a, size, speed)
+
+    def reset(self, bird: Bird, angle_a: float=0, size: float|None=None, speed: float|None=None):
+        """
+        ビーム画像Surfaceを生成する
+        引数1 bird：ビームを放つこうかとん
+        引数2 angle_a：こうかとんの向きからずらす角度
+        引数3 size：拡大率（Noneなら乱数で決める）
+        引数4 speed：速さ（Noneなら乱数で決める）
+        """
         self.vx, self.vy = bird.get_direction()
-        angle = math.degrees(math.atan2(-self.vy, self.vx))+angle_a
-        self.size = random.uniform(1.5, 3.0)
-        self.image = pg.transform.rotozoom(pg.image.load(f"ex05/fig/beam.png"), angle, self.size)
+        atlas = __class__.get_atlas()
+        angle = quantize_angle(math.degrees(math.atan2(-self.vy, self.vx))+angle_a, atlas.step)
+        if size is None:
+            size = Rng.get("beam").uniform(1.5, 3.0)
+        self.size = atlas.nearest_scale(size)
+        self.image = atlas.get(angle, self.size)  # 回転済みの画像を引くだけ
         self.vx = math.cos(math.radians(angle))
         self.vy = -math.sin(math.radians(angle))
-        self.rect = self.image.get_rect()
+        self.fit_rect()
         self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
         self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
-        self.speed = random.uniform(5, 20) #ビームのスピードをランダムに変更
+        if speed is None:
+            speed = Rng.get("beam").uniform(BEAM_SPEED_MIN, BEAM_SPEED_MAX) #ビームのスピードをランダムに変更
+        self.speed = speed
 
     def update(self):
         """
@@ -312,49 +1123,64 @@ class Beam(pg.sprite.Sprite):
             self.kill()
 
 
-class Explosion(pg.sprite.Sprite):
+class Explosion(Pooled, Timed, pg.sprite.Sprite):
     """
     爆発に関するクラス
     """
     def __init__(self, obj: "Bomb|Enemy", life: int):
+        super().__init__()
+        self.reset(obj, life)
+
+    def reset(self, obj: "Bomb|Enemy", life: int):
         """
         爆弾が爆発するエフェクトを生成する
         引数1 obj：爆発するBombまたは敵機インスタンス
         引数2 life：爆発時間
         """
-        super().__init__()
-        img = pg.image.load("ex05/fig/explosion.gif")
-        self.imgs = [img, pg.transform.flip(img, 1, 1)]
+        img = Assets.get("explosion.gif")
+        self.imgs = [img, SurfaceCache.get(("flip", "explosion.gif"), lambda: pg.transform.flip(img, 1, 1))]
         self.image = self.imgs[0]
-        self.rect = self.image.get_rect(center=obj.rect.center)
+        self.fit_rect()
+        self.rect.center = obj.rect.center
         self.life = life
+        self.end = 0  # 消える時刻
 
-    def update(self):
+    def expires(self, now: int) -> int:
+        self.end = now+self.life
+        return now  # 最初の更新で画像を選ぶ
+
+    def expire(self, now: int) -> int|None:
         """
-        爆発時間を1減算した爆発経過時間_lifeに応じて爆発画像を切り替えることで
-        爆発エフェクトを表現する
+        爆発経過時間に応じて爆発画像を切り替えることで爆発エフェクトを表現する
+        画像は10ステップごとにしか変わらないので，次に変わる時刻に呼ばれるよう予定を入れ直す
         """
-        self.life -= 1
-        self.image = self.imgs[self.life//10%2]
-        if self.life < 0:
+        life = self.end-now-1  # 毎フレーム1ずつ減らしていたときの残り時間
+        if life < 0:
             self.kill()
+            return None
+        self.image = self.imgs[life//10%2]
+        return now+life%10+1
 
 
 class Enemy(pg.sprite.Sprite):
     """
     敵機に関するクラス
     """
-    imgs = [pg.image.load(f"ex05/fig/alien{i}.png") for i in range(1, 4)]
+    img_names = [f"alien{i}.png" for i in range(1, 4)]  # 敵機画像のファイル名
+    count = 0  # これまでに生成した敵機の数
     
     def __init__(self):
         super().__init__()
-        self.image = random.choice(__class__.imgs)
+        __class__.count += 1
+        self.serial = __class__.count  # 生成順の番号（爆弾を投下する順番に使う）
+        rng = Rng.get("enemy")
+        self.image = Assets.get(rng.choice(__class__.img_names))
         self.rect = self.image.get_rect()
-        self.rect.center = random.randint(0, WIDTH), 0
+        self.rect.center = rng.randint(0, WIDTH), 0
         self.vy = +6
-        self.bound = random.randint(50, HEIGHT/2)  # 停止位置
+        self.bound = rng.randint(50, HEIGHT/2)  # 停止位置
         self.state = "down"  # 降下状態or停止状態
-        self.interval = random.randint(50, 300)  # 爆弾投下インターバル
+        self.interval = rng.randint(50, 300)  # 爆弾投下インターバル
 
     def update(self):
         """
@@ -367,8 +1193,16 @@ class Enemy(pg.sprite.Sprite):
             self.state = "stop"
         self.rect.centery += self.vy
 
+    def stop_delay(self) -> int:
+        """
+        あと何回目のupdateで停止状態になるかを返す（0なら次のupdateで停止）
+        """
+        if self.state == "stop" or self.rect.centery > self.bound:
+            return 0
+        return (self.bound-self.rect.centery)//self.vy+1
+
 
-class Shield(pg.sprite.Sprite):
+class Shield(Timed, pg.sprite.Sprite):
     """
     防御壁に関するクラス
     引数1 bird:防御壁
@@ -379,120 +1213,261 @@ class Shield(pg.sprite.Sprite):
         self.vx , self.vy = bird.get_direction()
         theta = math.atan2(-self.vy, self.vx) #こうかとんの向き (弧度法)
         angle = math.degrees(theta) #こうかとんの向き (度数法)
-        self.image = pg.Surface((20, bird.rect.height*2))
-        self.image = pg.transform.rotozoom(self.image, angle, 1.0)
-        pg.draw.rect(self.image, (0, 0, 0), pg.Rect(0, 0, 20, bird.rect.height*2))
+        self.image = bar_image((20, bird.rect.height*2), (0, 0, 0), angle)
         self.rect = self.image.get_rect()
         self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
         self.rect.centery = bird.rect.centery+bird.rect.height*self.vy
-        self.life = life
+        self.life = life  # 発動時間が過ぎたらTimedが消す
         # 爆弾を投下するemyから見た攻撃対象のbirdの方向を計算
-       
-    def update(self):
-        """
-        爆発時間を1減算し、発動時間中は防御壁矩形を有効化
-        """
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
 
 
-class Score:
+class GlyphAtlas:
     """
-    打ち落とした爆弾，敵機の数をスコアとして表示するクラス
-    爆弾：1点
-    敵機：10点
+    フォント・色ごとに，描画済みの文字（や決まった文字列）の画像を持っておくクラス
+    数字のように頻繁に変わる文字列は，1文字ずつの画像を並べて組み立てる
     """
-    def __init__(self):
-        self.font = pg.font.Font(None, 50)
-        self.color = (0, 0, 255)
-        self.score = 0
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
-        self.rect = self.image.get_rect()
+    atlases: dict[tuple, "GlyphAtlas"] = {}  # (フォントの大きさ, 色, アンチエイリアス)とアトラス
+
+    @classmethod
+    def get(cls, size: int, color: tuple[int, int, int], antialias: bool=False) -> "GlyphAtlas":
+        """
+        フォントの大きさと色に対応するアトラスを返す（なければ作る）
+        """
+        key = (size, tuple(color), antialias)
+        if key not in cls.atlases:
+            cls.atlases[key] = cls(size, color, antialias)
+        return cls.atlases[key]
+
+    def __init__(self, size: int, color: tuple[int, int, int], antialias: bool=False):
+        self.font = pg.font.Font(None, size)
+        self.color = color
+        self.antialias = antialias
+        self.glyphs: dict[str, pg.Surface] = {}  # 文字列と描画済みの画像
+        self.renders = 0  # font.renderを呼んだ回数
+
+    def glyph(self, text: str) -> pg.Surface:
+        """
+        文字列を描画した画像を返す（同じ文字列は一度しか描画しない）
+        """
+        img = self.glyphs.get(text)
+        if img is None:
+            img = self.glyphs[text] = to_display(self.font.render(text, self.antialias, self.color))
+            self.renders += 1
+        return img
+
+    def layout(self, chunks: list[str], topleft: tuple[int, int]) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        文字列の断片の画像を左から順に並べる
+        引数1 chunks：断片のリスト（見出しは1つの断片，数字は1文字ずつの断片にする）
+        引数2 topleft：左上の座標
+        戻り値：画像とRectのリスト
+        """
+        x, y = topleft
+        items = []
+        for chunk in chunks:
+            img = self.glyph(chunk)
+            items.append((img, pg.Rect((x, y), img.get_size())))
+            x += img.get_width()
+        return items
+
+
+class HudText:
+    """
+    「見出し＋数値」の形のHUDの文字列
+    見出しは1枚の画像，数値は字形アトラスの数字を並べて作り，数値が変わったときだけ並べ直す
+    """
+    def __init__(self, label: str, size: int, color: tuple[int, int, int], value: int=0):
+        """
+        引数1 label：見出し（"Score: "など）
+        引数2 size：フォントの大きさ
+        引数3 color：文字の色
+        引数4 value：最初の数値
+        """
+        self.label = label
+        self.atlas = GlyphAtlas.get(size, color)
+        self.value = None
+        self.topleft = None
+        self.set(value, (0, 0))
+
+    def set(self, value: int, topleft: tuple[int, int]):
+        """
+        表示する数値と位置を変える（変わっていなければ何もしない）
+        """
+        if value == self.value and topleft == self.topleft:
+            return
+        self.value, self.topleft = value, topleft
+        self.items = self.atlas.layout([self.label, *str(value)], topleft)
+        self.rect = self.items[0][1].unionall([rect for _, rect in self.items])
+
+
+class Score:
+    """
+    打ち落とした爆弾，敵機の数をスコアとして表示するクラス
+    爆弾：1点
+    敵機：10点
+    """
+    def __init__(self):
+        self.color = (0, 0, 255)
+        self.score = 0
+        self.text = HudText("Score: ", 50, self.color, self.score)
+        self.rect = self.text.rect.copy()
         self.rect.center = 100, HEIGHT-50
 
     def score_up(self, add):
         self.score += add
 
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"Score: {self.score}", 0, self.color)
-        screen.blit(self.image, self.rect)
+    def hud_items(self) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        スコアの文字の画像とRectのリストを返す（スコアが変わったときだけ並べ直す）
+        """
+        self.text.set(self.score, self.rect.topleft)
+        return self.text.items
 
 
-class NeoGravity(pg.sprite.Sprite):
+class NeoGravity(Timed, pg.sprite.Sprite):
     def __init__(self, life: int):
         super().__init__()
-        self.image = pg.Surface((WIDTH, HEIGHT))
-        pg.draw.rect(self.image, (10, 10, 10), pg.Rect(0, 0, WIDTH, HEIGHT))
-        self.image.set_colorkey((0, 0, 0))
-        self.image.set_alpha(200)
+        self.image = SurfaceCache.get(
+            ("rect", (WIDTH, HEIGHT), (10, 10, 10), 200, 0),
+            lambda: make_rect((WIDTH, HEIGHT), (10, 10, 10), (0, 0, 0), 200),
+        )  # 画面全体の大きさなので毎回作らずに使い回す
         self.rect = self.image.get_rect()
         self.rect.center = WIDTH/2, HEIGHT/2
         self.life = life
-        
-    def update(self):
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
 
 
-class Gravity(pg.sprite.Sprite):
+class Gravity(Timed, pg.sprite.Sprite):
     def __init__(self, bird, life):
         super().__init__()
         rad = 200
         self.life = life
-        self.image = pg.Surface((2*rad, 2*rad))
-        pg.draw.circle(self.image, (1, 1, 1), (rad, rad), rad)
+        self.image = SurfaceCache.get(
+            ("circle", 2*rad, (1, 1, 1), 127, 0), lambda: make_circle(rad, (1, 1, 1), alpha=127)
+        ) #黒を透明化
         self.rect = self.image.get_rect()
-        self.image.set_colorkey("black")
-        self.image.set_alpha(127) #黒を透明化
         self.rect.center = bird.rect.center #self.rectがこうかとんを追う
 
+    def expires(self, now: int) -> int:
+        return now+self.life-1  # lifeを1減らして0以下になったら消すので，他より1ステップ早い
+
     def update(self, bird):
         self.rect.center = bird.rect.center
-        self.life = self.life - 1
-        if self.life <= 0:
-            self.kill()
 
 
-class Aura(pg.sprite.Sprite):
+class ParticleEmitter:
     """
     こうかとんにオーラを纏わせる
+    オーラの粒は位置と残り時間をNumPy配列で持ち，1枚の共有Surfaceを1回のblitsでまとめて描画する
     """
-    def __init__(self, bird):
-        super().__init__()
-        bird_rect = bird.rect
-        self.image = pg.Surface((10, 10))
-        pg.draw.rect(self.image, "purple", (0, 0, 10, 10))
-        self.image.set_alpha(91) #purpleを透明化
-        self.rect = self.image.get_rect()
-        self.life = 35 #オーラブロックの生成個数
-        self.rect[:-2] = \
-            random.randint(bird_rect[0], bird_rect[0]+bird_rect[2]), \
-            random.randint(bird_rect[1], bird_rect[1]+bird_rect[3])
-            #ブロックをこうかとんの周りにランダムに生成
+    def __init__(self, image: pg.Surface, life: int, rate: float=AURA_RATE, max_count: int=AURA_MAX,
+                 rng: random.Random|None=None):
+        """
+        引数1 image：粒の画像（全粒で共有する）
+        引数2 life：粒の表示時間（フレーム数）
+        引数3 rate：1フレームに出す粒の数（小数なら数フレームに1個）
+        引数4 max_count：粒の最大数（超えたら古いものから消す）
+        引数5 rng：粒の位置を決める乱数列（Noneならオーラの乱数列）
+        """
+        self.image = image
+        self.rng = rng or Rng.get("aura")
+        self.life = life
+        self.rate = rate
+        self.max_count = max_count
+        self.credit = 0.0  # まだ出していない粒の端数
+        self.pos = np.zeros((0, 2), np.int64)
+        self.ttl = np.zeros(0, np.int64)  # 粒の残り時間
+
+    def __len__(self) -> int:
+        return len(self.ttl)
+
+    def configure(self, rate: float, max_count: int):
+        """
+        粒を出す数と最大数を変える（最大数を超えた分は古いものから消す）
+        引数1 rate：1フレームに出す粒の数
+        引数2 max_count：粒の最大数（1以上）
+        """
+        self.rate = rate
+        self.max_count = max_count
+        if len(self.ttl) > max_count:
+            self.pos, self.ttl = self.pos[-max_count:], self.ttl[-max_count:]
+
+    def emit(self, rect: pg.Rect):
+        """
+        rectの範囲内のランダムな位置に，rateに応じた数の粒を出す
+        引数 rect：粒を出す範囲（こうかとんのrect）
+        """
+        self.credit += self.rate
+        num = int(self.credit)
+        if num <= 0:
+            return
+        self.credit -= num
+        x, y, w, h = rect
+        rng = self.rng
+        new = [(rng.randint(x, x+w), rng.randint(y, y+h)) for _ in range(num)]  #ブロックをこうかとんの周りにランダムに生成
+        self.pos = np.concatenate([self.pos, np.array(new, np.int64)])[-self.max_count:]
+        self.ttl = np.concatenate([self.ttl, np.full(num, self.life, np.int64)])[-self.max_count:]
 
     def update(self):
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
-        
+        """
+        粒の残り時間を1減らし，時間切れの粒をまとめて消す
+        """
+        if not len(self.ttl):
+            return
+        self.ttl -= 1
+        keep = self.ttl >= 0
+        if not keep.all():
+            self.pos, self.ttl = self.pos[keep], self.ttl[keep]
+
+    def items(self) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        粒ごとの画像とRectのリストを返す
+        """
+        img = self.image
+        w, h = img.get_size()
+        return [(img, pg.Rect(x, y, w, h)) for x, y in self.pos.tolist()]
+
+    def draw(self, screen: pg.Surface):
+        """
+        すべての粒を1回のblitsで描画する
+        """
+        if len(self.ttl):
+            img = self.image
+            screen.blits([(img, xy) for xy in self.pos.tolist()], False)
+
+
+def make_aura() -> ParticleEmitter:
+    """
+    こうかとんのオーラ（半透明の紫の粒）のエミッタを生成する
+    """
+    image = SurfaceCache.get(
+        ("rect", (10, 10), "purple", 91, 0), lambda: make_rect((10, 10), "purple", alpha=91)
+    ) #purpleを透明化
+    return ParticleEmitter(image, 35)
+
+
 class BeamPlus(pg.sprite.Sprite):
     """
     2発のビームの発射を可能にするクラス
     """
-    def __init__(self, bird: Bird):
+    scales = scale_buckets(0.1, 1.0)  # ビームの拡大率の段階
+    colors = [  # ビームの色の候補（各色6段階．元は0〜255の乱数だったが，画像をキャッシュできるように216色に量子化した）
+        (r, g, b) for r in range(0, 256, 51) for g in range(0, 256, 51) for b in range(0, 256, 51)
+    ]
+
+    def __init__(self, bird: Bird, size: float|None=None, color: tuple[int, int, int]|None=None):
         """
         ビーム画像Surfaceを生成する
-        引数 bird：ビームを放つこうかとん
+        引数1 bird：ビームを放つこうかとん
+        引数2 size：拡大率（Noneなら乱数で決める）
+        引数3 color：色（Noneなら乱数で決める）
         """
         super().__init__()
         self.vx, self.vy = bird.get_direction()
         angle = math.degrees(math.atan2(-self.vy, self.vx))
-        self.image = pg.Surface((bird.rect.height/2, 20))
-        self.size = random.uniform(0.1, 1.0) #ビームの区別をつけるため小さくしている
-        self.image = pg.transform.rotozoom(self.image, angle, self.size)
-        pg.draw.rect(self.image, (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)), pg.Rect(0, 0, bird.rect.height/2, 20))
+        if size is None:
+            size, color = __class__.draw()
+        self.size = size #ビームの区別をつけるため小さくしている
+        self.image = bar_image((bird.rect.height/2, 20), color, angle, self.size, "plus")
         self.vx = math.cos(math.radians(angle))
         self.vy = -math.sin(math.radians(angle))
         self.rect = self.image.get_rect()
@@ -500,6 +1475,22 @@ class BeamPlus(pg.sprite.Sprite):
         self.rect.centerx = bird.rect.centerx+bird.rect.width*self.vx
         self.speed = 30 #大きさを小さくした分性能の差を無くすためにスピードを上げる
 
+    @classmethod
+    def draw(cls) -> tuple[float, tuple[int, int, int]]:
+        """
+        ビーム1発の拡大率と色を乱数で決める
+        """
+        rng = Rng.get("plus")
+        size = rng.choice(cls.scales)
+        return size, rng.choice(cls.colors)
+
+    @classmethod
+    def volley(cls, bird: Bird, num: int, group: pg.sprite.Group) -> "Volley":
+        """
+        num発のビームをまとめた一斉射撃を返す（乱数はここで引いておく）
+        """
+        return Volley(bird, cls, [cls.draw() for _ in range(num)], group)
+
     def update(self):
 
         """
@@ -510,7 +1501,7 @@ class BeamPlus(pg.sprite.Sprite):
         if check_bound(self.rect) != (True, True):
             self.kill()
 
-class FrontKoukaShield(pg.sprite.Sprite):
+class FrontKoukaShield(Timed, pg.sprite.Sprite):
     """
     こうかとんの前に防御壁を作るクラス
     引数1 bird 防御壁
@@ -522,9 +1513,7 @@ class FrontKoukaShield(pg.sprite.Sprite):
         self.life = life
         theta = math.atan2(-self.vy, self.vx) #こうかとんの向き(弧度法)
         angle = math.degrees(theta) #こうかとんの向き(度数法)
-        self.image = pg.Surface((20, bird.rect.height * 2))
-        self.image = pg.transform.rotozoom(self.image, angle, 1.0)
-        pg.draw.rect(self.image, (255, 0, 0), pg.Rect(0, 0, 20, bird.rect.height * 2))
+        self.image = bar_image((20, bird.rect.height * 2), (255, 0, 0), angle)
         self.rect = self.image.get_rect()
         self.rect.centerx = bird.rect.centerx + bird.rect.width*self.vx  # self.rect.centerxがこうかとんを追う
         self.rect.centery = bird.rect.centery + bird.rect.height*self.vy  # self.rect.centeryがこうかとんを追う
@@ -532,16 +1521,13 @@ class FrontKoukaShield(pg.sprite.Sprite):
 
     def update(self, bird: Bird):
         """
-        防御壁の発動秒数を１減算し、発動中はこうかとんの前に防御壁を有効化
+        発動中はこうかとんの前に防御壁を有効化（発動秒数が過ぎたらTimedが消す）
         """
         self.rect.centerx = bird.rect.centerx + bird.rect.width*self.vx
         self.rect.centery = bird.rect.centery + bird.rect.height*self.vy
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
 
 
-class BackKoukaShield(pg.sprite.Sprite):
+class BackKoukaShield(Timed, pg.sprite.Sprite):
     """
     こうかとんの後ろに防御壁を作るクラス
     """
@@ -556,22 +1542,17 @@ class BackKoukaShield(pg.sprite.Sprite):
         self.life = life
         rev_theta = math.atan2(-self.vy, -self.vx)
         angle2 = math.degrees(rev_theta)
-        self.image = pg.Surface((20, bird.rect.height*2))
-        self.image = pg.transform.rotozoom(self.image, angle2, 1.0)
-        pg.draw.rect(self.image, (255, 255, 0), pg.Rect(0, 0, 20,bird.rect.height * 2))
+        self.image = bar_image((20, bird.rect.height*2), (255, 255, 0), angle2)
         self.rect = self.image.get_rect()
         self.rect.centerx = bird.rect.centerx + bird.rect.width*(-self.vx)  # self.rect.centerxがこうかとんを追う
         self.rect.centery = bird.rect.centery + bird.rect.height*(-self.vy)  # self.rect.centeryがこうかとんを追う
 
     def update(self, bird: Bird):
         """
-        防御壁の発動時間を1減算、発動中はこうかとんの後ろに防御壁を展開
+        発動中はこうかとんの後ろに防御壁を展開（発動時間が過ぎたらTimedが消す）
         """
         self.rect.centerx = bird.rect.centerx + bird.rect.width*(-self.vx)
         self.rect.centery = bird.rect.centery + bird.rect.height*(-self.vy)
-        self.life -= 1
-        if self.life < 0:
-            self.kill()
 
 
 class KoukaBall(pg.sprite.Sprite):
@@ -587,13 +1568,11 @@ class KoukaBall(pg.sprite.Sprite):
         self.vx, self.vy = bird.get_direction()
         angle = math.degrees(math.atan2(-self.vy, self.vx))
         rad = 100
-        self.image = pg.Surface((2*rad, 2*rad))
-        color = self.image.fill("white")
-        
         # 白を消す処理を入れる
-        self.image.set_alpha(200)
-        pg.draw.circle(self.image,"mediumorchid", (rad, rad), rad)
-        self.image.set_colorkey("white")
+        self.image = SurfaceCache.get(
+            ("circle", 2*rad, "mediumorchid", 200, 0),
+            lambda: make_circle(rad, "mediumorchid", "white", 200, bg="white"),
+        )
         self.vx = math.cos(math.radians(angle))
         self.vy = -math.sin(math.radians(angle))
         self.rect = self.image.get_rect()
@@ -631,21 +1610,134 @@ class Beamplusalpha:
         """
         vx, vy = self.bird.get_direction()
         for i in range(-180, 181,int(100/(self.num-1))): #-180度から180度の間でint(100/(self.num-1))おきにビームをランダムの速さで発射
-            self.beam_list.append(Beam(self.bird, i)) #ビームの値をリストに代入
+            self.beam_list.append(Beam.spawn(self.bird, i)) #ビームの値をリストに代入
         return self.beam_list
-    
+
+    def volley(self, group: pg.sprite.Group) -> "Volley":
+        """
+        gen_beamsと同じビームの扇を一斉射撃として返す（角度ごとの拡大率と速さはここで引いておく）
+        """
+        rng = Rng.get("beam")
+        shots = [
+            (i, rng.uniform(1.5, 3.0), rng.uniform(BEAM_SPEED_MIN, BEAM_SPEED_MAX))
+            for i in range(-180, 181, int(100/(self.num-1)))
+        ]
+        return Volley(self.bird, Beam.spawn, shots, group)
+
+
+class Volley:
+    """
+    1回の発射で出る複数のビームをまとめて表す一斉射撃
+    発射したときのこうかとんの位置と向きを共有し，ビームごとには乱数で決めた値（shots）だけを持つ
+    VolleyQueueが1ステップに生成する数を制限するので，生成が遅れたビームは遅れたステップ数だけ進めて出す
+    """
+    def __init__(self, bird: Bird, make: Callable[..., pg.sprite.Sprite], shots: list[tuple], group: pg.sprite.Group):
+        """
+        引数1 bird：ビームを放つこうかとん
+        引数2 make：(一斉射撃, *shot)からビームを生成する関数
+        引数3 shots：ビームごとの引数のリスト
+        引数4 group：生成したビームを加えるグループ
+        """
+        self.rect = bird.rect.copy()  # ビームの生成ではこうかとんの代わりに使う
+        self.dire = bird.get_direction()
+        self.make = make
+        self.shots = deque(shots)
+        self.group = group
+        self.age = 0  # 発射してから経ったステップ数
+
+    def __len__(self) -> int:
+        return len(self.shots)
+
+    def get_direction(self) -> tuple[int, int]:
+        return self.dire
+
+    def spawn(self) -> pg.sprite.Sprite|None:
+        """
+        次のビームを1発生成して返す（遅れて画面外に出ていたらNone）
+        """
+        spr = self.make(self, *self.shots.popleft())
+        if self.age:  # 飛び道具と同じく1ステップの移動量は0方向に切り捨てる
+            spr.rect.move_ip(self.age*int(spr.speed*spr.vx), self.age*int(spr.speed*spr.vy))
+            if check_bound(spr.rect) != (True, True):
+                spr.kill()  # プールから出したものはプールに戻す
+                return None
+        return spr
+
+
+class VolleyQueue:
+    """
+    一斉射撃のビームを1ステップにbudget発までずつ生成するキュー
+    生成を待っているビームがmax_pendingを超えたら，新しい一斉射撃のはみ出した分を捨てる
+    """
+    def __init__(self, budget: int=VOLLEY_BUDGET, max_pending: int=VOLLEY_MAX_PENDING):
+        """
+        引数1 budget：1ステップに生成するビームの数の上限
+        引数2 max_pending：生成を待つビームの上限数
+        """
+        self.budget = budget
+        self.max_pending = max_pending
+        self.volleys: deque[Volley] = deque()
+        self.pending = 0  # 生成を待っているビームの数
+        self.stats = Counter({"volleys": 0, "spawned": 0, "deferred": 0, "dropped": 0})
+
+    def fire(self, volley: Volley):
+        """
+        一斉射撃をキューに加える
+        """
+        room = self.max_pending-self.pending
+        while len(volley.shots) > room:
+            volley.shots.pop()
+            self.stats["dropped"] += 1
+        if volley.shots:
+            self.volleys.append(volley)
+            self.pending += len(volley.shots)
+        self.stats["volleys"] += 1
+
+    def run(self):
+        """
+        古い一斉射撃から順にbudget発まで生成し，残りは次のステップに回す
+        """
+        budget = self.budget
+        while self.volleys and budget > 0:
+            volley = self.volleys[0]
+            while volley.shots and budget > 0:
+                budget -= 1
+                self.pending -= 1
+                spr = volley.spawn()
+                if spr is None:
+                    self.stats["dropped"] += 1
+                    continue
+                if volley.age:
+                    self.stats["deferred"] += 1
+                volley.group.add(spr)
+                self.stats["spawned"] += 1
+            if not volley.shots:
+                self.volleys.popleft()
+        for volley in self.volleys:
+            volley.age += 1
+
+
+for pooled_cls in (Beam, Bomb, Explosion):  # 頻繁に生成・消去されるスプライトはプールで使い回す
+    pooled_cls.pool = SpritePool(pooled_cls)
+
+
+def pool_stats() -> dict[str, dict[str, int]]:
+    """
+    プールごとの使い回し回数・生成回数・使用中の数の最大値などを返す（計測用）
+    """
+    return {cls.__name__: cls.pool.stats() for cls in (Beam, Bomb, Explosion)}
+
 
 class Levelup:
     def __init__(self):
         """
         ビームの結果に応じてレベルの上がる処理
         """
-        self.font = pg.font.Font(None, 50)
         self.color = (247, 146, 19)
         self.level = 0
-        self.image = self.font.render(f"LEVEL: {self.level}", 0, self.color) #現在のレベル表示
-        self.rect = self.image.get_rect()
-        self.rect.center = WIDTH-80, 30 #self.imageの内容の表示位置
+        self.text = HudText("LEVEL: ", 50, self.color, self.level) #現在のレベル表示
+        self.rect = self.text.rect.copy()
+        self.rect.center = WIDTH-80, 30 #レベルの表示位置
         
     def levelup(self, add):
         """
@@ -653,242 +1745,1639 @@ class Levelup:
         """
         self.level += add 
 
-    def update(self, screen: pg.Surface):
-        self.image = self.font.render(f"LEVEL: {self.level}", 0, self.color)
-        screen.blit(self.image, self.rect)
-        
-def main():
-    pg.display.set_caption("真！こうかとん無双")
-    screen = pg.display.set_mode((WIDTH, HEIGHT))
-    bg_img = pg.image.load("ex05/fig/pg_bg.jpg")
-    score = Score()
-
-    start_screen(screen)
-
-    bird = Bird(3, (900, 400))
-    s_bird = Small_Bird(3, (800, 300))
-    bombs = pg.sprite.Group()
-    beams = pg.sprite.Group()
-    exps = pg.sprite.Group()
-    emys = pg.sprite.Group()
-    neogrs = pg.sprite.Group()
-    gravities = pg.sprite.Group()
-    pluses = pg.sprite.Group()
-    levels = Levelup()
-    levels.level = 1
-    auras = pg.sprite.Group()
-
-    score.score = 0
-
-    shields = pg.sprite.Group()
-    
-    FrontKS = pg.sprite.Group()
-    BackKS = pg.sprite.Group()
-    Kkball = pg.sprite.Group()
-    tmr = 0
-    clock = pg.time.Clock()
-    while True:
-        key_lst = pg.key.get_pressed()
+    def hud_items(self) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        レベルの文字の画像とRectのリストを返す（レベルが変わったときだけ並べ直す）
+        """
+        self.text.set(self.level, self.rect.topleft)
+        return self.text.items
+
+
+def prebuild_atlases(bird: Bird):
+    """
+    ビームのアトラスと，8方向ぶんの防御壁の画像をゲーム開始前に生成しておく
+    引数 bird：防御壁を張るこうかとん
+    """
+    for _ in prebuild_steps(bird):
+        pass
+
+
+def prebuild_steps(bird: Bird) -> Iterator[None]:
+    """
+    prebuild_atlasesの処理を少しずつ進める（1つ進めるごとにyieldする）
+    """
+    yield from Beam.get_atlas().build_steps()
+    size = (20, bird.rect.height*2)
+    for vx, vy in bird.imgs:
+        angle = math.degrees(math.atan2(-vy, vx))
+        rev_angle = math.degrees(math.atan2(vy, -vx))
+        bar_image(size, (0, 0, 0), angle)  # Shield
+        bar_image(size, (255, 0, 0), angle)  # FrontKoukaShield
+        bar_image(size, (255, 255, 0), rev_angle)  # BackKoukaShield
+        yield
+
+
+def warm_up() -> Iterator[bool]:
+    """
+    スタート画面の表示中に1つずつ進める準備：裏で読み込んだ画像の変換，アトラスの生成
+    1つ進めるごとにTrueをyieldし，裏の読み込みを待つ間も（何もせずに）Trueをyieldする
+    """
+    while Assets.convert_next() or Assets.loading():
+        yield True
+    Assets.load_all()  # 画面生成前に読み込んだ画像の変換など，残りをまとめて
+    Startup.mark("assets")
+    yield True
+    for _ in prebuild_steps(Bird(3, (900, 400))):  # Worldのこうかとんと同じ画像
+        yield True
+    Startup.mark("atlases")
+
+
+class Startup:
+    """
+    起動にかかった時間を区間（読み込み，pg.init，画面生成，画像の読み込み，最初のフレームなど）ごとに記録するクラス
+    区間は前の記録からの時間で，スタート画面でキー入力を待った時間（title_shownからtitleまで）は起動時間に含めない
+    ライブラリの読み込み（import）の時間は含まないので，python -X importtime で計る
+    """
+    started: float|None = None  # 計測の起点の時刻（Noneなら最初の記録を起点にする）
+    marks: dict[str, float] = {}  # 区間名と，その区間が終わった時刻
+
+    @classmethod
+    def start(cls):
+        """
+        計測を始める（起動したらすぐに呼ぶ）
+        """
+        cls.started = time.perf_counter()
+        cls.marks = {}
+
+    @classmethod
+    def mark(cls, name: str):
+        """
+        区間nameが終わったことを記録する（最初の記録だけを残す）
+        """
+        cls.marks.setdefault(name, time.perf_counter())
+
+    @classmethod
+    def report(cls) -> dict[str, float]:
+        """
+        区間ごとの時間と，入力待ちを除いた最初のフレームまでの時間（ミリ秒）を返す
+        """
+        marks = sorted(cls.marks.items(), key=lambda item: item[1])
+        started = cls.started if cls.started is not None else marks[0][1] if marks else time.perf_counter()
+        report, prev = {}, started
+        for name, at in marks:
+            report[f"{name}_ms"] = round((at-prev)*1000, 3)
+            prev = at
+        waited = cls.marks.get("title", 0)-cls.marks.get("title_shown", 0)  # 準備が裏で進んでいても人を待っていた時間
+        report["playable_ms"] = round((prev-started-waited)*1000, 3)
+        report.update({f"{kind}_loads": num for kind, num in Assets.loads.items()})
+        return report
+
+
+
+
+class FrameInput:
+    """
+    1フレーム分の入力（押下中のキーとキーイベント）をまとめるクラス
+    """
+    def __init__(self, keys=None, events: list[tuple[int, int]]|None=None, quit: bool=False):
+        """
+        引数1 keys：押下キーの真理値リスト（Noneなら何も押していない）
+        引数2 events：(pg.KEYDOWNまたはpg.KEYUP, キー)のタプルのリスト
+        引数3 quit：ウィンドウが閉じられたかどうか
+        """
+        self.keys = keys if keys is not None else {k: False for k in Bird.delta}
+        self.events = events or []
+        self.quit = quit
+
+    @classmethod
+    def poll(cls) -> "FrameInput":
+        """
+        pygameのキー状態とイベントキューから入力を取り出す
+        """
+        keys = pg.key.get_pressed()
+        events = []
+        quit = False
         for event in pg.event.get():
             if event.type == pg.QUIT:
-                return 0
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                beams.add(Beam(bird))
-                for i in range(1,100):
-                    if score.score >= i*10:
-                        pluses.add(BeamPlus(bird))
-                        
-        
-            if event.type == pg.KEYDOWN and event.key == pg.K_SPACE:
-                beams.add(Beam(s_bird)) 
-            if event.type == pg.KEYDOWN and event.key == pg.K_LSHIFT:  # 左シフトが押されているか判定
+                quit = True
+            elif event.type in (pg.KEYDOWN, pg.KEYUP):
+                events.append((event.type, event.key))
+        return cls(keys, events, quit)
+
+    def pressed(self, key: int) -> bool:
+        """
+        このフレームでkeyが押されたかどうかを返す
+        """
+        return (pg.KEYDOWN, key) in self.events
+
+    def merged(self, later: "FrameInput") -> "FrameInput":
+        """
+        まだステップに渡していない入力に後の入力をつなげる（キー状態は後のものを使う）
+        """
+        return __class__(later.keys, self.events+later.events, self.quit or later.quit)
+
+    def held(self) -> "FrameInput":
+        """
+        キー状態だけを引き継いだ入力を返す（同じ描画の間の2ステップ目以降に渡す）
+        """
+        return __class__(self.keys)
+
+
+class InputLog:
+    """
+    ステップごとの入力（移動キーの状態とキーイベント）を記録する小さなバイナリ形式
+    ヘッダ：識別子，版，乱数の種，1秒あたりのステップ数
+    ステップ：移動キーの状態のビット列，イベント数，(押した/離した, キー)×イベント数
+    """
+    magic = b"KKIN"
+    version = 1
+    header = struct.Struct("<4sBQH")
+    step = struct.Struct("<BB")
+    event = struct.Struct("<BI")
+
+    def __init__(self, path: str, seed: int, sim_rate: int=SIM_RATE):
+        """
+        記録を始める
+        引数1 path：書き込むファイル
+        引数2 seed：Rng.seedに渡した種
+        引数3 sim_rate：1秒あたりのステップ数
+        """
+        self.file = open(path, "wb")
+        self.file.write(__class__.header.pack(__class__.magic, __class__.version, seed, sim_rate))
+        self.steps = 0
+
+    def write(self, inputs: FrameInput):
+        """
+        1ステップ分の入力を書き込む
+        """
+        if len(inputs.events) > 255:
+            raise ValueError(f"too many key events in one step: {len(inputs.events)}")
+        bits = sum(1 << i for i, k in enumerate(Bird.delta) if inputs.keys[k])
+        chunks = [__class__.step.pack(bits, len(inputs.events))]
+        for ev_type, key in inputs.events:
+            chunks.append(__class__.event.pack(ev_type == pg.KEYUP, key))
+        self.file.write(b"".join(chunks))
+        self.steps += 1
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def read(cls, path: str) -> tuple[int, int, list[FrameInput]]:
+        """
+        記録を読み込む
+        引数 path：読み込むファイル
+        戻り値：乱数の種，1秒あたりのステップ数，ステップごとの入力のリスト
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, seed, sim_rate = cls.header.unpack_from(data)
+        if magic != cls.magic or version != cls.version:
+            raise ValueError(f"{path}: not an input log (version {cls.version})")
+        steps = []
+        pos = cls.header.size
+        while pos < len(data):
+            bits, num = cls.step.unpack_from(data, pos)
+            pos += cls.step.size
+            keys = {k: bool(bits >> i & 1) for i, k in enumerate(Bird.delta)}
+            events = []
+            for _ in range(num):
+                up, key = cls.event.unpack_from(data, pos)
+                pos += cls.event.size
+                events.append((pg.KEYUP if up else pg.KEYDOWN, key))
+            steps.append(FrameInput(keys, events))
+        return seed, sim_rate, steps
+
+
+COLLISION_RULES = [
+    # (グループA, グループB, Aを消す, Bを消す, 得点, レベル, 爆発時間, こうかとんの反応)
+    # グループAのスプライトごとに上から順に判定し，最初に当たった規則だけを適用する
+    ("emys", "beams", True, True, 10, 1, 100, "happy"),
+    ("emys", "gravities", True, False, 10, 1, 100, "happy_all"),
+    ("emys", "Kkball", True, False, 10, 0, 50, None),
+    ("emys", "neogrs", True, False, 10, 0, 100, "happy"),
+    ("emys", "pluses", True, True, 10, 1, 100, "happy"),
+    ("bombs", "beams", True, True, 1, 0, 50, None),
+    ("bombs", "birds", True, False, 1, 0, 50, "hit"),  # hyper状態でなければゲームオーバー
+    ("bombs", "gravities", True, False, 1, 0, 50, None),
+    ("bombs", "shields", True, False, 1, 0, 50, None),
+    ("bombs", "FrontKS", True, False, 1, 0, 50, None),
+    ("bombs", "BackKS", True, False, 1, 0, 50, None),
+    ("bombs", "Kkball", True, False, 1, 0, 50, None),
+    ("bombs", "neogrs", True, False, 1, 0, 50, None),
+    ("bombs", "pluses", True, True, 1, 0, 50, None),
+]
+
+
+class CollisionRule:
+    """
+    2つのグループの衝突と，そのときに起こること（消去，得点，レベル，爆発，こうかとんの反応）をまとめるクラス
+    """
+    def __init__(self, a: str, b: str, kill_a: bool, kill_b: bool, score: int, level: int,
+                 exp_life: int, reaction: str|None):
+        """
+        引数1 a：判定するWorldのグループ名
+        引数2 b：判定相手のWorldのグループ名
+        引数3 kill_a：当たったaのスプライトを消すかどうか
+        引数4 kill_b：当たったbのスプライトを消すかどうか
+        引数5 score：加算する得点
+        引数6 level：加算するレベル
+        引数7 exp_life：aの位置に出す爆発の時間
+        引数8 reaction：こうかとんの反応（"happy"，"happy_all"，"hit"，None）
+        """
+        self.a, self.b = a, b
+        self.kill_a, self.kill_b = kill_a, kill_b
+        self.score = score
+        self.level = level
+        self.exp_life = exp_life
+        self.reaction = reaction
+        self.pairs = 0  # 広域判定で矩形が重なった組の数
+        self.hits = 0  # 当たったaのスプライトの数
+        self.phase = f"collide:{self.name}"  # 計測のときの処理名
+
+    @property
+    def name(self) -> str:
+        return f"{self.a}x{self.b}"
+
+
+class World:
+    """
+    ゲームの状態（スプライトグループ，スコア，敵機の出現タイマー）を持ち，
+    入力に応じて1フレームずつ進めるクラス
+    描画は行わないので，画面なしでも描画の速さに縛られずに進められる
+    """
+    def __init__(self):
+        self.bird = Bird(3, (900, 400))
+        self.s_bird = Small_Bird(3, (800, 300))
+        self.projectiles = ProjectileStore()  # 飛び道具の移動は配列でまとめて行う
+        self.tmr = 0
+        self.timers = TimingWheel()  # 寿命（更新の処理で実行）
+        self.spawner = TimingWheel()  # 敵機の出現と爆弾の投下（出現の処理で実行）
+        self.droppers: list[Enemy] = []  # このステップに爆弾を投下する敵機
+        self.volleys = VolleyQueue(VOLLEY_BUDGET, VOLLEY_MAX_PENDING)  # BeamPlusとBeamplusalphaの一斉射撃
+        self.bombs = ProjectileGroup(self.projectiles)
+        self.beams = ProjectileGroup(self.projectiles)
+        self.exps = HookedGroup(self.start_timer)
+        self.emys = HookedGroup(self.schedule_drops)
+        self.neogrs = HookedGroup(self.start_timer)
+        self.gravities = HookedGroup(self.start_timer)
+        self.pluses = ProjectileGroup(self.projectiles)
+        self.auras = make_aura()  # オーラはスプライトではなく粒としてまとめて扱う
+        self.shields = HookedGroup(self.start_timer)
+        self.FrontKS = HookedGroup(self.start_timer)
+        self.BackKS = HookedGroup(self.start_timer)
+        self.Kkball = ProjectileGroup(self.projectiles)
+        self.score = Score()
+        self.levels = Levelup()
+        self.levels.level = 1
+        self.spawner.schedule(0, self.spawn_enemy)
+        self.over = False  # こうかとんが爆弾に当たったらTrue
+        self.on_phase: Callable[[str], None]|None = None  # 各処理の終わりに処理名を渡して呼ぶ関数（計測用）
+        self.interpolate = False  # Trueならステップの初めにスプライトの位置を覚えておく（描画の補間用）
+        self.prev_pos: dict[pg.sprite.Sprite, tuple[int, int]] = {}  # 前のステップのスプライトの左上の座標
+        self.grid = SpatialHash()  # 大きなグループ同士の衝突判定に使う空間ハッシュ（小さければ総当たり）
+        self.birds = pg.sprite.GroupSingle(self.bird)  # 衝突判定用
+        self.rules = [CollisionRule(*rule) for rule in COLLISION_RULES]
+        self.exp_scale = 1.0  # 爆発の時間の倍率（品質を下げると短くする）
+        self.exp_max: int|None = None  # 同時に出す爆発の上限（Noneなら無制限）
+
+    def groups(self) -> dict[str, pg.sprite.Group]:
+        """
+        グループ名とスプライトグループの辞書を返す
+        """
+        return {name: group for name, group in vars(self).items() if isinstance(group, pg.sprite.Group)}
+
+    def close(self):
+        """
+        すべてのスプライトを消す（プールから取り出したものはプールに戻す）
+        Worldを作り直す前に呼ぶと，前のWorldのスプライトがプールの使用中の数に残らない
+        """
+        for group in self.groups().values():
+            for spr in group.sprites():
+                spr.kill()
+
+    def counts(self) -> dict[str, int]:
+        """
+        グループ名（とオーラ）ごとの現在の数を返す
+        """
+        counts = {name: len(group) for name, group in self.groups().items()}
+        counts["auras"] = len(self.auras)
+        return counts
+
+    def step(self, inputs: FrameInput) -> bool:
+        """
+        入力に応じてゲームを1フレーム進める
+        引数 inputs：このフレームの入力
+        戻り値：ゲームが続いていればTrue，ゲームオーバーならFalse
+        """
+        if self.over:
+            return False
+        if self.interpolate:
+            self.prev_pos = {spr: spr.rect.topleft for group in self.groups().values() for spr in group}
+            self.prev_pos[self.s_bird] = self.s_bird.rect.topleft
+        self.handle_input(inputs)
+        self.mark("input")
+        self.volleys.run()
+        self.mark("volleys")
+        self.spawn()
+        self.mark("spawn")
+        alive = self.collide()
+        self.mark("collide")
+        if not alive:
+            self.over = True
+            return False
+        self.update(inputs.keys)
+        self.mark("update")
+        self.tmr += 1
+        return True
+
+    def mark(self, phase: str):
+        """
+        処理phaseが終わったことをon_phaseに知らせる（未設定なら何もしない）
+        """
+        if self.on_phase is not None:
+            self.on_phase(phase)
+
+    def handle_input(self, inputs: FrameInput):
+        """
+        キーイベントに応じてビームや防御壁などを発動する
+        """
+        bird, s_bird, score, levels = self.bird, self.s_bird, self.score, self.levels
+        for ev_type, key in inputs.events:
+            if ev_type == pg.KEYDOWN and key == pg.K_SPACE:
+                self.beams.add(Beam.spawn(bird))
+                num = min(99, max(0, score.score//10))  # スコア10ごとに1発（最大99発）
+                if num:
+                    self.volleys.fire(BeamPlus.volley(bird, num, self.pluses))
+            if ev_type == pg.KEYDOWN and key == pg.K_SPACE:
+                self.beams.add(Beam.spawn(s_bird)) 
+            if ev_type == pg.KEYDOWN and key == pg.K_LSHIFT:  # 左シフトが押されているか判定
                 bird.speed = 20  # スピードアップ
-            if event.type == pg.KEYUP and event.key == pg.K_LSHIFT:  # 左シフトが押された状態から離れたら
+                s_bird.speed = 20
+            if ev_type == pg.KEYUP and key == pg.K_LSHIFT:  # 左シフトが押された状態から離れたら
                 bird.speed = 10  #もとのスピードに戻る
-            if event.type == pg.KEYDOWN and event.key == pg.K_LSHIFT:  # 左シフトが押されているか判定
-                s_bird.speed = 20  # スピードアップ
-            if event.type == pg.KEYUP and event.key == pg.K_LSHIFT:  # 左シフトが押された状態から離れたら
-                s_bird.speed = 10  #もとのスピードに戻る
-            if event.type == pg.KEYDOWN and event.key ==pg.K_RETURN:
-                if score.score > 200:
-                    neogrs.add(NeoGravity(400))
-                    score.score_up(-200)
-
+                s_bird.speed = 10
+            if ev_type == pg.KEYDOWN and key ==pg.K_RETURN:
+                if score.score > NEOGRAVITY_COST:
+                    self.neogrs.add(NeoGravity(400))
+                    score.score_up(-NEOGRAVITY_COST)
 
             # 追加機能3
-            if event.type == pg.KEYDOWN and event.key == pg.K_RSHIFT and score.score > 100:  #→Shiftキー押下、かつスコアが100より大きいとき
+            if ev_type == pg.KEYDOWN and key == pg.K_RSHIFT and score.score > 100:  #→Shiftキー押下、かつスコアが100より大きいとき
                 score.score -= 100
                 bird.change_state("hyper", 500)
 
-            if event.type == pg.KEYDOWN and event.key == pg.K_TAB and score.score > 50:
+            if ev_type == pg.KEYDOWN and key == pg.K_TAB and score.score > GRAVITY_COST:
                 #矢印キーとtabキーが押されて、スコアが50以上ならスコアを-50する.
-                gravities.add(Gravity(bird, 500))
-                score.score -= 50
+                self.gravities.add(Gravity(bird, 500))
+                score.score -= GRAVITY_COST
             
-            if event.type ==pg.KEYDOWN and event.key == pg.K_CAPSLOCK and len(shields) == 0 :
-                if score.score > 50:
-                    score.score_up(-50)
-                    shields.add(Shield(bird, 400))
+            if ev_type == pg.KEYDOWN and key == pg.K_CAPSLOCK and len(self.shields) == 0 :
+                if score.score > SHIELD_COST:
+                    score.score_up(-SHIELD_COST)
+                    self.shields.add(Shield(bird, 400))
                     
-            if event.type == pg.KEYDOWN and event.key == pg.K_F1 and score.score >40:
+            if ev_type == pg.KEYDOWN and key == pg.K_F1 and score.score >40:
                 levels.levelup(3) #レベル3アップ
-                beams.add(Beamplusalpha(bird, 6).gen_beams())
+                self.volleys.fire(Beamplusalpha(bird, 6).volley(self.beams))
                 score.score_up(-40)
-                   
 
-            if event.type == pg.KEYDOWN and event.key == pg.K_RSHIFT and score.score > 100:  #→Shiftキー押下、かつスコアが100より大きいとき
+            if ev_type == pg.KEYDOWN and key == pg.K_RSHIFT and score.score > 100:  #→Shiftキー押下、かつスコアが100より大きいとき
                 score.score -= 100 #
                 s_bird.change_state("hyper", 500)
                 
-            if event.type == pg.KEYDOWN and event.key == pg.K_x and len(FrontKS) == 0 : 
-                if score.score > 50:
-                    score.score_up(-50)
-                    FrontKS.add(FrontKoukaShield(bird, 400))
-                    BackKS.add(BackKoukaShield(bird, 400))
+            if ev_type == pg.KEYDOWN and key == pg.K_x and len(self.FrontKS) == 0 : 
+                if score.score > KOUKASHIELD_COST:
+                    score.score_up(-KOUKASHIELD_COST)
+                    self.FrontKS.add(FrontKoukaShield(bird, 400))
+                    self.BackKS.add(BackKoukaShield(bird, 400))
           
-            if event.type == pg.KEYDOWN and event.key == pg.K_d and score.score > 70:
-                Kkball.add(KoukaBall(bird))
-                score.score -= 70
-                
-        screen.blit(bg_img, [0, 0])
+            if ev_type == pg.KEYDOWN and key == pg.K_d and score.score > KOUKABALL_COST:
+                self.Kkball.add(KoukaBall(bird))
+                score.score -= KOUKABALL_COST
+
+    def spawn(self):
+        """
+        敵機の出現と爆弾の投下を行う（予定の入っている敵機だけを調べる）
+        """
+        self.droppers = []
+        self.spawner.run(self.tmr)
+        for emy in sorted(self.droppers, key=lambda emy: emy.serial):  # 敵機グループの順に投下する
+            self.bombs.add(Bomb.spawn(emy, self.bird))
 
+    def spawn_enemy(self, now: int) -> int:
+        """
+        ENEMY_PERIODステップに1回，敵機を出現させる
+        """
+        self.emys.add(Enemy())
+        return now+ENEMY_PERIOD
 
-        if tmr%200 == 0:  # 200フレームに1回，敵機を出現させる
-            emys.add(Enemy())
-        
-        for emy in emys:
-            if emy.state == "stop" and tmr%emy.interval == 0:
-                # 敵機が停止状態に入ったら，intervalに応じて爆弾投下
-                bombs.add(Bomb(emy, bird))
-
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.score_up(10)  # 10点アップ
-            levels.levelup(1)   #レベル1アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト  
-
-        for emy in pg.sprite.groupcollide(emys, beams, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.score_up(10)  # 10点アップ
-            bird.change_img(6, screen)  # こうかとんjr喜びエフェクト
-
-        for bomb in pg.sprite.groupcollide(bombs, beams, True, True).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
-
-           
-        for bomb in pg.sprite.spritecollide(bird, bombs, True):
-            if bird.state == "normal":
-                bird.change_img(8, screen) # こうかとん悲しみエフェクト
-                score.update(screen)
-                pg.display.update()
-                time.sleep(2)
-                return
-            elif bird.state == "hyper":
-                exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-                score.score_up(1)  # 1点アップ
+    def schedule_drops(self, emy: Enemy):
+        """
+        敵機が加えられたら，停止状態に入った後の最初の投下時刻（intervalの倍数）に予定を入れる
+        """
+        stop = self.tmr+emy.stop_delay()  # このステップの更新で停止状態になる
+        first = -(-(stop+1)//emy.interval)*emy.interval
+        self.spawner.schedule(first, self.drop, emy)
+
+    def drop(self, now: int, emy: Enemy) -> int|None:
+        """
+        敵機が停止状態に入ったら，intervalに応じて爆弾投下（打ち落とされていたら予定を終える）
+        """
+        if not emy.alive():
+            return None
+        self.droppers.append(emy)
+        return now+emy.interval
 
+    def start_timer(self, spr: Timed):
+        """
+        寿命のあるスプライトが加えられたら，その寿命をタイミングホイールに入れる
+        """
+        self.timers.schedule(spr.expires(self.tmr), spr.expire)
+
+    def queue_depth(self) -> dict[str, int]:
+        """
+        タイミングホイールに入っている予定の数と，生成を待っている一斉射撃のビームの数を返す（監視用）
+        """
+        return {"timers": self.timers.depth, "spawner": self.spawner.depth, "volleys": self.volleys.pending}
+
+    def collide(self) -> bool:
+        """
+        衝突判定の規則表を1回のパスで評価し，爆発エフェクトの生成とスコアの加算を行う
+        まず規則ごとに当たりうる組（候補）を求め，グループAのスプライトごとに候補のある規則を上から順に適用する
+        戻り値：こうかとんが無事ならTrue，爆弾に当たったらFalse
+        """
+        grid = self.grid
+        grid.clear()  # スプライトが動いたので登録し直す
+        by_group: dict[str, list[CollisionRule]] = {}
+        for rule in self.rules:
+            by_group.setdefault(rule.a, []).append(rule)
+        for name, rules in by_group.items():
+            group_a = getattr(self, name)
+            sprites = group_a.sprites()
+            if not sprites:
+                continue
+            targets = []
+            for rule in rules:
+                group_b = getattr(self, rule.b)
+                if group_b:  # 空のグループとは判定しない
+                    targets.append((rule, group_b, self.candidates(group_a, sprites, group_b, rule)))
+                    self.mark(rule.phase)
+            hit_idxs = sorted(set().union(*(cands for _, _, cands in targets)))
+            for i in hit_idxs:  # グループAの順に，候補のある規則だけを上から適用する
+                a = sprites[i]
+                for rule, group_b, cands in targets:
+                    hits = [b for b in cands.get(i, ()) if b in group_b]  # 先に消されたものは除く
+                    if not hits:
+                        continue
+                    rule.hits += 1
+                    if rule.kill_b:
+                        for b in hits:
+                            b.kill()
+                    if not self.apply(rule, a):
+                        return False
+                    if rule.kill_a:
+                        break
+            self.mark("collide:apply")
+        return True
+
+    def candidates(self, group_a: pg.sprite.AbstractGroup, sprites: list[pg.sprite.Sprite],
+                   group_b: pg.sprite.AbstractGroup, rule: CollisionRule) -> dict[int, list[pg.sprite.Sprite]]:
+        """
+        グループAのスプライトの番号をキー，矩形が重なるグループBのスプライトのリストを値とする辞書を返す
+        空間ハッシュへの登録と問い合わせはスプライト1つあたりPythonの処理が要るので，
+        組み合わせの数がスプライトの数の和のGRID_BRUTE_RATIO倍以下なら矩形のリストとの総当たり（Rect.collidelistall）のほうが速い
+        それより多ければグループAを空間ハッシュに1フレームに1回だけ登録し，Bの各スプライトの近くのセルだけを調べる
+        """
+        cands: dict[int, list[pg.sprite.Sprite]] = {}
+        n, m = len(sprites), len(group_b)
+        if n*m <= GRID_BRUTE_RATIO*(n+m):
+            rects = [a.rect for a in sprites]
+            for b in group_b.sprites():
+                for i in b.rect.collidelistall(rects):
+                    cands.setdefault(i, []).append(b)
+        else:
+            grid = self.grid
+            cells = grid.index.get(group_a)
+            if cells is None:
+                cells = grid.add(group_a)
+            order = {a: i for i, a in enumerate(sprites)}
+            for b in group_b.sprites():
+                for a in grid.query(b, group_a, cells):
+                    cands.setdefault(order[a], []).append(b)
+        rule.pairs += sum(map(len, cands.values()))
+        return cands
+
+    def apply(self, rule: CollisionRule, spr: pg.sprite.Sprite) -> bool:
+        """
+        当たった規則の効果（消去，爆発，得点，レベル，こうかとんの反応）を適用する
+        引数1 rule：当たった規則
+        引数2 spr：当たったグループAのスプライト
+        戻り値：こうかとんが無事ならTrue，爆弾に当たったらFalse
+        """
+        if rule.kill_a:
+            spr.kill()
+        if rule.reaction == "hit" and self.bird.state != "hyper":
+            self.bird.change_img(8) # こうかとん悲しみエフェクト
+            return False
+        if self.exp_max is None or len(self.exps) < self.exp_max:  # 上限を超えた分は出ている爆発で代用する
+            self.exps.add(Explosion.spawn(spr, max(1, round(rule.exp_life*self.exp_scale))))  # 爆発エフェクト
+        self.score.score_up(rule.score)
+        if rule.level:
+            self.levels.levelup(rule.level)
+        if rule.reaction in ("happy", "happy_all"):
+            self.bird.change_img(6)  # こうかとん喜びエフェクト
+        if rule.reaction == "happy_all":
+            self.s_bird.change_img(6)
+        return True
+
+    def collision_stats(self) -> dict[str, dict[str, int]]:
+        """
+        規則ごとの候補の組の数と衝突数を返す（計測用）
+        """
+        return {rule.name: {"pairs": rule.pairs, "hits": rule.hits} for rule in self.rules}
 
-        for emy in pg.sprite.groupcollide(emys, gravities, True, False).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            score.score_up(10)  # 10点アップ
-            levels.levelup(1)   #レベルが1上がる
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            s_bird.change_img(6, screen)  # こうかとん喜びエフェクト
+    def update(self, key_lst):
+        """
+        すべてのスプライトを1フレーム分動かす
+        引数 key_lst：押下キーの真理値リスト
+        """
+        mark = self.mark
+        self.bird.update(key_lst)
+        mark("update:bird")
+        self.s_bird.update(key_lst) 
+        mark("update:s_bird")
+        self.projectiles.step()  # beams，bombs，pluses，Kkballをまとめて動かす
+        mark("update:projectiles")
+        self.emys.update()
+        mark("update:emys")
+        self.timers.run(self.tmr)  # 寿命の来た爆発，画面全体の重力場，重力場，防御壁を消す
+        mark("update:timers")
+        self.gravities.update(self.bird)
+        mark("update:gravities")
+        self.auras.update()
+        self.auras.emit(self.bird.rect)
+        mark("update:auras")
+        self.FrontKS.update(self.bird)
+        mark("update:FrontKS")
+        self.BackKS.update(self.bird)
+        mark("update:BackKS")
+
+
+def lerp_rect(rect: pg.Rect, prev: tuple[int, int]|None, alpha: float) -> pg.Rect:
+    """
+    前のステップの位置と今の位置の間に補間した矩形を返す
+    引数1 rect：今の矩形
+    引数2 prev：前のステップの左上の座標（Noneなら補間しない）
+    引数3 alpha：補間の割合（0なら前のステップ，1なら今）
+    """
+    if prev is None:
+        return rect
+    x, y = prev
+    return pg.Rect(round(x+(rect.x-x)*alpha), round(y+(rect.y-y)*alpha), rect.w, rect.h)
 
-        for bomb in pg.sprite.groupcollide(bombs, gravities, True, False).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
 
-        for bomb in pg.sprite.groupcollide(bombs, shields, True, False).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
+def merge_rects(rects: list[pg.Rect]) -> list[pg.Rect]:
+    """
+    重なり合う矩形をまとめ，互いに重ならない矩形のリストにする
+    引数 rects：矩形のリスト
+    戻り値：重なりのない矩形のリスト（すべてのrectsを覆う）
+    """
+    merged = []
+    for rect in rects:
+        rect = rect.copy()
+        idx = rect.collidelist(merged)
+        while idx >= 0:
+            rect.union_ip(merged.pop(idx))
+            idx = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class Renderer:
+    """
+    Worldの状態を画面Surfaceに描画するクラス
+    前のフレームから変化した領域（動いた・消えた・現れたスプライトの矩形）だけ背景を描き直し，
+    その領域に掛かるスプライトをレイヤーごとに1回のblitsで描く
+    変化していない半透明の重ね絵（NeoGravity，Gravity，KoukaBall）は変化した領域の中だけ合成し直す
+    """
+    layers = (  # 描画する順番（後ろほど手前に描かれる）
+        "bird", "s_bird", "beams", "emys", "bombs", "exps", "neogrs", "score", "gravities",
+        "auras", "shields", "pluses", "levels", "FrontKS", "BackKS", "Kkball", "overlay",
+    )
+    phases = tuple(f"draw:{name}" for name in layers)  # 計測のときのレイヤーごとの処理名
 
-        for bomb in pg.sprite.groupcollide(bombs, FrontKS, True, False).keys():
+    def __init__(self, screen: pg.Surface, scale: float=RENDER_SCALE):
+        """
+        引数1 screen：画面Surface
+        引数2 scale：内部で描画する解像度の倍率（ゲーム内の座標はWIDTH×HEIGHTのまま）
+        """
+        self.target = screen
+        self.scale = scale
+        self.base_scale = scale  # 設定された倍率（品質を下げて縮めても，戻すときの上限）
+        self.offscreen = False  # Trueなら画面と同じ大きさでも別のSurface（裏の画面）に描き，presentで写す
+        self.build()
+        self.dups: set = set()
+        self.full_redraws = 0
+        self.partial_redraws = 0
+        self.alpha = 1.0
+        self.overlay: ProfileOverlay|None = None  # 計測結果の表示（Noneなら表示しない）
+        self.on_phase: Callable[[str], None]|None = None  # 各処理の終わりに処理名を渡して呼ぶ関数（計測用）
+
+    def invalidate(self):
+        """
+        次のフレームで画面全体を描き直させる（画面を別の用途に使った後に呼ぶ）
+        """
+        self.drawn = None
 
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
-        
-        for bomb in pg.sprite.groupcollide(bombs, BackKS, True, False).keys():
+    @property
+    def rescalable(self) -> bool:
+        """
+        内部解像度を変えられるか（ウィンドウ自体が内部解像度のpg.SCALEDでは変えられない）
+        """
+        return self.target.get_size() == (WIDTH, HEIGHT)
 
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
+    def set_scale(self, scale: float) -> bool:
+        """
+        内部で描画する解像度の倍率を変え，次のフレームで画面全体を描き直させる
+        引数 scale：WIDTH×HEIGHTに対する倍率
+        戻り値：変えたらTrue（同じ倍率か，変えられない画面ならFalse）
+        """
+        if scale == self.scale or not self.rescalable:
+            return False
+        self.scale = scale
+        self.build()
+        return True
 
-        for emy in pg.sprite.groupcollide(emys, Kkball, True, False).keys():
-            exps.add(Explosion(emy, 50))
-            score.score_up(10)
-        for bomb in pg.sprite.groupcollide(bombs, Kkball, True, False).keys():
-            exps.add(Explosion(bomb, 50))
-            score.score_up(1)
-        
-        if len(pg.sprite.spritecollide(bird, bombs, True)) != 0:
-            bird.change_img(8, screen) # こうかとん悲しみエフェクト
-            score.update(screen)
-            pg.display.update()
-            time.sleep(2)
+    def build(self):
+        """
+        内部解像度の画面と背景を用意し，次のフレームで画面全体を描き直させる
+        """
+        scale = self.scale
+        size = render_size(scale)
+        if self.target.get_size() == size and not self.offscreen:  # 画面がすでに内部解像度（pg.SCALEDなど）ならそのまま描く
+            self.screen = self.target
+        else:
+            self.screen = to_display(pg.Surface(size))
+        self.bg_img = Assets.get("pg_bg.jpg")
+        if scale != 1:
+            self.bg_img = pg.transform.smoothscale(self.bg_img, size)
+        self.scaled_imgs = weakref.WeakKeyDictionary()  # 元の画像と縮小した画像
+        self.area = self.screen.get_rect()
+        self.drawn: dict|None = None  # 前のフレームに描いた（画像のid, 左上の座標）と画像：Noneなら画面全体を描き直す
+
+    def rescale(self, items: list[tuple[pg.Surface, pg.Rect]]) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        ゲーム内の座標の画像とRectを，内部解像度に縮めた画像とRectに変換する
+        縮めた画像は元の画像が使われている間だけ覚えておく
+        引数 items：画像とRectのリスト
+        """
+        scale, cache = self.scale, self.scaled_imgs
+        scaled = []
+        for img, rect in items:
+            small = cache.get(img)
+            if small is None:
+                w, h = img.get_size()
+                small = cache[img] = pg.transform.scale(img, (max(1, round(w*scale)), max(1, round(h*scale))))
+            scaled.append((small, pg.Rect((round(rect.x*scale), round(rect.y*scale)), small.get_size())))
+        return scaled
+
+    def present(self, dirty: list[pg.Rect]) -> list[pg.Rect]:
+        """
+        内部解像度で描いた画面をウィンドウの大きさに拡大する
+        引数 dirty：内部解像度で描き直した矩形のリスト
+        戻り値：ウィンドウ上で描き直した矩形のリスト
+        """
+        if self.screen is self.target:
+            return dirty
+        if not dirty:
+            return dirty
+        if self.screen.get_size() == self.target.get_size():  # 裏の画面から描き直した領域だけ写す
+            self.target.blits([(self.screen, rect, rect) for rect in dirty], False)
+            return dirty
+        pg.transform.scale(self.screen, self.target.get_size(), self.target)
+        if dirty == [self.area]:
+            return [self.target.get_rect()]
+        scale = 1/self.scale
+        return [pg.Rect(int(r.x*scale), int(r.y*scale), math.ceil(r.w*scale)+1, math.ceil(r.h*scale)+1) for r in dirty]
+
+    def layer_items(self, world: World, name: str) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        レイヤーに描く画像とRectのリストを返す
+        引数1 world：描画するWorld
+        引数2 name：レイヤー名
+        """
+        if name == "auras":
+            return world.auras.items()
+        if name == "overlay":
+            return self.overlay.hud_items() if self.overlay is not None else []
+        if name in ("score", "levels"):
+            return getattr(world, name).hud_items()
+        prev = world.prev_pos if self.alpha < 1 else None
+        if name == "bird":
+            spr, img = world.bird, world.bird.image
+        elif name == "s_bird":
+            spr, img = world.s_bird, world.s_bird.image2
+        elif prev:
+            return [(spr.image, lerp_rect(spr.rect, prev.get(spr), self.alpha)) for spr in getattr(world, name)]
+        else:
+            return [(spr.image, spr.rect) for spr in getattr(world, name)]
+        rect = lerp_rect(spr.rect, prev.get(spr), self.alpha) if prev else spr.rect
+        # こうかとんは画像を変えてもrectの大きさがそのままなので，画像の大きさで矩形を作り直す
+        return [(img, pg.Rect(rect.topleft, img.get_size()))]
+
+    def dirty_rects(self, drawn: dict, dups: set) -> list[pg.Rect]:
+        """
+        前のフレームから変化した領域を求める
+        引数1 drawn：今のフレームに描く（画像のid, 左上の座標）と画像の辞書
+        引数2 dups：同じ画像を同じ位置に重ねて描く（画像のid, 左上の座標）の集合
+        戻り値：描き直す矩形のリスト（重なりなし）：画面全体を描き直すなら[画面の矩形]
+        """
+        if self.drawn is None:
+            return [self.area]
+        prev = self.drawn
+        changed = drawn.keys() ^ prev.keys() | dups | self.dups  # 重ねた枚数が変わると半透明の濃さも変わる
+        if len(changed) > DIRTY_MAX_RECTS:
+            return [self.area]
+        area = self.area
+        rects = [area.clip(key[1], (drawn.get(key) or prev[key]).get_size()) for key in changed]
+        dirty = merge_rects([rect for rect in rects if rect.w and rect.h])
+        if sum(rect.w*rect.h for rect in dirty) > DIRTY_MAX_RATIO*area.w*area.h:
+            return [self.area]
+        return dirty
+
+    def draw(self, world: World, alpha: float=1.0) -> list[pg.Rect]:
+        """
+        内部解像度で画面を組み立て，ウィンドウに拡大する
+        引数1 world：描画するWorld
+        引数2 alpha：前のステップから今のステップまでのどこを描くか（1なら今のステップ）
+        戻り値：ウィンドウ上で描き直した矩形のリスト（pg.display.updateに渡す）
+        """
+        self.alpha = alpha
+        dirty = self.present(self.compose(world))
+        self.mark("draw:present")
+        return dirty
+
+    def mark(self, phase: str):
+        """
+        処理phaseが終わったことをon_phaseに知らせる（未設定なら何もしない）
+        """
+        if self.on_phase is not None:
+            self.on_phase(phase)
+
+    def compose(self, world: World) -> list[pg.Rect]:
+        """
+        背景，こうかとん，各スプライトグループ，スコアとレベルの順に描画する
+        引数 world：描画するWorld
+        戻り値：内部解像度で描き直した矩形のリスト
+        """
+        return self.render(self.collect(world), self.mark if self.on_phase is not None else None)
+
+    def collect(self, world: World, rescale: bool=True) -> list[list[tuple[pg.Surface, pg.Rect]]]:
+        """
+        レイヤーごとに描く画像とRect（内部解像度）のリストを集める
+        引数1 world：描画するWorld
+        引数2 rescale：Falseならゲーム内の座標のまま返す（縮小は描くスレッドでrescaleする）
+        """
+        layers = [self.layer_items(world, name) for name in __class__.layers]
+        if rescale and self.scale != 1:
+            layers = [self.rescale(items) for items in layers]
+        self.mark("draw:collect")
+        return layers
+
+    def render(self, layers, mark: Callable[[str], None]|None=None) -> list[pg.Rect]:
+        """
+        集めたレイヤーを，前のフレームから変化した領域だけ描き直す
+        引数1 layers：collectで集めたレイヤーごとの画像とRectのリスト
+        引数2 mark：処理の終わりに処理名を渡して呼ぶ関数（Noneなら呼ばない）
+        戻り値：内部解像度で描き直した矩形のリスト
+        """
+        screen = self.screen
+        drawn = {(id(img), rect.topleft): img for items in layers for img, rect in items}
+        dups = set()
+        if len(drawn) < sum(map(len, layers)):
+            counts = Counter((id(img), rect.topleft) for items in layers for img, rect in items)
+            dups = {key for key, num in counts.items() if num > 1}
+        dirty = self.dirty_rects(drawn, dups)
+        self.drawn, self.dups = drawn, dups  # 辞書が画像を持っているので，次のフレームまで画像のidは使い回されない
+        if mark:
+            mark("draw:dirty")
+        if dirty == [self.area]:
+            self.full_redraws += 1
+            screen.blit(self.bg_img, [0, 0])
+            if mark:
+                mark("draw:bg")
+            for phase, items in zip(__class__.phases, layers):
+                screen.blits(items, False)
+                if mark:
+                    mark(phase)
+            return dirty
+        self.partial_redraws += 1
+        if not dirty:
+            return dirty
+        screen.blits([(self.bg_img, rect, rect) for rect in dirty], False)
+        if mark:
+            mark("draw:bg")
+        for phase, items in zip(__class__.phases, layers):
+            batch = []
+            for img, rect in items:
+                for idx in rect.collidelistall(dirty):
+                    clip = rect.clip(dirty[idx])
+                    batch.append((img, clip, clip.move(-rect.x, -rect.y)))
+            if batch:
+                screen.blits(batch, False)
+            if mark:
+                mark(phase)
+        return dirty
+
+
+class RenderThread:
+    """
+    描画（背景の描き直しとレイヤーごとのblits）を裏のスレッドで行うクラス
+    メインスレッドはRenderer.collectで集めたレイヤーを変わらない描画リスト（画像とRectの写しのタプル）にして渡し，
+    裏で前のフレームを描いている間に次のステップを進める
+    裏のスレッドは自分だけが触る裏の画面に描き，メインスレッドは描き終わった裏の画面をwaitで受け取ってから
+    ウィンドウに写す（拡大する）ので，ウィンドウに2つのフレームが混ざることはない
+    内部解像度への縮小（rescale）と縮小した画像の辞書も裏のスレッドだけが触る
+    描画リストの画像はキャッシュなどの書き換えない共有Surfaceなので，描いている間にメインスレッドが触るSurfaceとは重ならない
+    渡せるのは1フレーム分だけで，次を渡す前に前のフレームを描き終わるのを待つので，表示の遅れは最大1フレーム
+    pygame 2.6のblit・blitsはGILを手放さないので，裏の描画とステップの計算はほとんど重ならない
+    （重なるのはGILを手放すpg.transform.scaleなどだけ：効果はbench_kokaton.py --pipelineで計る）
+    """
+    def __init__(self, renderer: Renderer):
+        """
+        引数 renderer：描画に使うRenderer（描画の状態は裏のスレッドだけが触る）
+        """
+        self.renderer = renderer
+        if not renderer.offscreen:  # ウィンドウに直接描かず，裏の画面に描かせる
+            renderer.offscreen = True
+            renderer.build()
+        self.queue: queue.Queue = queue.Queue(maxsize=1)
+        self.dirty: list[pg.Rect] = []  # 描き終わったフレームの，裏の画面で描き直した矩形
+        self.error: Exception|None = None  # 裏のスレッドで起きた例外（呼び出し側は1スレッドの描画に戻す）
+        self.frames = 0
+        self.waited = 0.0  # メインスレッドが描き終わりを待った時間の合計（秒）
+        self.thread = threading.Thread(target=self.run, name="render", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def freeze(layers: list[list[tuple[pg.Surface, pg.Rect]]]) -> tuple[tuple[tuple[pg.Surface, pg.Rect], ...], ...]:
+        """
+        レイヤーごとの画像とRectを，次のステップで動かされないようRectを写したタプルにする
+        """
+        return tuple(tuple((img, rect.copy()) for img, rect in items) for items in layers)
+
+    def submit(self, world: World, alpha: float=1.0) -> list[pg.Rect]:
+        """
+        今のフレームの描画リストを作って裏のスレッドに渡す
+        引数1 world：描画するWorld
+        引数2 alpha：前のステップから今のステップまでのどこを描くか
+        戻り値：前のフレームでウィンドウ上に描き直した矩形のリスト（pg.display.updateに渡す）
+        """
+        renderer = self.renderer
+        renderer.alpha = alpha
+        drawlist = self.freeze(renderer.collect(world, rescale=False))
+        dirty = self.wait()
+        renderer.mark("draw:wait")
+        self.queue.put(drawlist)
+        return dirty
+
+    def wait(self) -> list[pg.Rect]:
+        """
+        渡したフレームを描き終わるのを待ち，描き終わった裏の画面をウィンドウに写す（裏のスレッドが止まっている間に行う）
+        戻り値：そのフレームでウィンドウ上に描き直した矩形のリスト
+        """
+        start = time.perf_counter()
+        self.queue.join()
+        self.waited += time.perf_counter()-start
+        dirty, self.dirty = self.dirty, []
+        if self.error is not None:
+            return []
+        return self.renderer.present(dirty)
+
+    def run(self):
+        """
+        裏のスレッドで描画リストを受け取って描く（Noneを受け取ったら終わる）
+        """
+        renderer = self.renderer
+        while True:
+            drawlist = self.queue.get()
+            try:
+                if drawlist is None:
+                    return
+                if self.error is None:
+                    if renderer.scale != 1:
+                        drawlist = [renderer.rescale(items) for items in drawlist]
+                    self.dirty = renderer.render(drawlist)
+                    self.frames += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def close(self) -> list[pg.Rect]:
+        """
+        最後に渡したフレームを描き終わるのを待ってスレッドを終える
+        戻り値：そのフレームでウィンドウ上に描き直した矩形のリスト
+        """
+        dirty = self.wait()
+        self.queue.put(None)
+        self.thread.join()
+        return dirty
+
+    def report(self) -> dict[str, Any]:
+        """
+        描いたフレーム数と，メインスレッドが待った時間の1フレームあたりの平均を返す
+        """
+        return {
+            "frames": self.frames,
+            "wait_ms": round(self.waited/max(self.frames, 1)*1000, 3),
+            "error": repr(self.error) if self.error is not None else None,
+        }
+
+
+class Profiler:
+    """
+    フレームの処理（フェーズ）ごとの時間を計測するクラス
+    markをWorld.on_phaseとRenderer.on_phaseに渡すと，前のmarkからの経過時間がそのフェーズの時間になる
+    直近window個のフレームの時間を持っておき，分布（ヒストグラム）と統計を求める
+    """
+    def __init__(self, window: int=PROFILE_WINDOW, trace: bool=False):
+        """
+        引数1 window：分布に使う直近のフレーム数
+        引数2 trace：Trueならすべてのフレームの記録を残す（exportで書き出す）
+        """
+        self.window = window
+        self.history: dict[str, deque] = {}  # フェーズ名と直近のフレームの時間（ミリ秒）
+        self.current: dict[str, float] = {}
+        self.rows: list[dict]|None = [] if trace else None
+        self.events: list[dict] = []  # フレームの途中で起きたこと（品質の段階の変化など）
+        self.frames = 0
+        self.start = self.last = time.perf_counter()
+
+    def begin(self):
+        """
+        フレームの計測を始める
+        """
+        self.current = {}
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, phase: str):
+        """
+        前のmarkからの経過時間をフェーズphaseの時間に加える（1フレームに何度呼んでもよい）
+        """
+        now = time.perf_counter()
+        self.current[phase] = self.current.get(phase, 0.0)+now-self.last
+        self.last = now
+
+    def end(self, counts: dict[str, int]|None=None):
+        """
+        フレームの計測を終え，フェーズごとの時間を直近の記録に加える
+        引数 counts：このフレームのグループごとのスプライトの数（記録に残す）
+        """
+        current = self.current
+        current["frame"] = time.perf_counter()-self.start
+        for phase in current.keys()-self.history.keys():
+            self.history[phase] = deque([0.0]*min(self.frames, self.window), maxlen=self.window)
+        for phase, xs in self.history.items():
+            xs.append(current.get(phase, 0.0)*1000)
+        if self.rows is not None:
+            row = {"frame": self.frames}
+            row.update({f"{phase}_ms": round(t*1000, 4) for phase, t in current.items()})
+            row.update({f"n_{name}": num for name, num in (counts or {}).items()})
+            self.rows.append(row)
+        self.frames += 1
+
+    def event(self, name: str, **data):
+        """
+        このフレームで起きたことを記録する（exportで書き出し，終了時に表示する）
+        引数1 name：起きたことの名前
+        引数2 data：その内容
+        """
+        self.events.append({"frame": self.frames, "event": name, **data})
+
+    def histogram(self, phase: str) -> list[int]:
+        """
+        フェーズphaseの直近の時間の分布（PROFILE_BINSで区切った各区間のフレーム数）を返す
+        """
+        edges = [0.0, *PROFILE_BINS, math.inf]
+        return np.histogram(np.fromiter(self.history.get(phase, ()), float), edges)[0].tolist()
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """
+        フェーズごとの直近の時間の平均・パーセンタイル・最大値（ミリ秒）を返す（平均の大きい順）
+        """
+        stats = {}
+        for phase, xs in self.history.items():
+            arr = np.fromiter(xs, float)
+            if not len(arr):
+                continue
+            p50, p90, p99 = np.percentile(arr, (50, 90, 99))
+            stats[phase] = {"mean": arr.mean(), "p50": p50, "p90": p90, "p99": p99, "max": arr.max()}
+            stats[phase] = {k: round(float(v), 4) for k, v in stats[phase].items()}
+        return dict(sorted(stats.items(), key=lambda kv: -kv[1]["mean"]))
+
+    def export(self, path: str):
+        """
+        計測結果を書き出す
+        拡張子が.csvならフレームごとの記録，それ以外ならJSONで統計，分布，フレームごとの記録を書き出す
+        """
+        rows = self.rows or []
+        if path.endswith(".csv"):
+            import csv
+            fields = list(dict.fromkeys(key for row in rows for key in row))
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fields, restval=0)
+                writer.writeheader()
+                writer.writerows(rows)
             return
-        
-        for bomb in pg.sprite.groupcollide(bombs, neogrs, True, False).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
-            
-        for emy in pg.sprite.groupcollide(emys, neogrs, True, False).keys():
-            exps.add(Explosion(emy, 100)) # 爆発エフェクト
-            score.score_up(10)  # 10点アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-            
-        for emy in pg.sprite.groupcollide(emys, pluses, True, True).keys():
-            exps.add(Explosion(emy, 100))  # 爆発エフェクト
-            levels.levelup(1)   #レベルが1上がる
-            score.score_up(10)  # 10点アップ
-            bird.change_img(6, screen)  # こうかとん喜びエフェクト
-
-        for bomb in pg.sprite.groupcollide(bombs, pluses, True, True).keys():
-            exps.add(Explosion(bomb, 50))  # 爆発エフェクト
-            score.score_up(1)  # 1点アップ
-
-        bird.update(key_lst, screen)
-        s_bird.update(key_lst, screen) 
-        beams.update()
-        beams.draw(screen)
-        emys.update()
-        emys.draw(screen)
-        bombs.update()
-        bombs.draw(screen)
-        exps.update()
-        exps.draw(screen)
-        neogrs.update()
-        neogrs.draw(screen)
-        score.update(screen)
-        gravities.update(bird)
-        gravities.draw(screen)
-        auras.update()
-        auras.add(Aura(bird))
-        auras.draw(screen)
-
-
-        shields.update()
-        shields.draw(screen)
-        pluses.update()
-        pluses.draw(screen)
-        levels.update(screen)
- 
-        FrontKS.update(bird)
-        FrontKS.draw(screen)
-        BackKS.update(bird)
-        BackKS.draw(screen)
-        Kkball.update()
-        Kkball.draw(screen)
-        pg.display.update()
-        tmr += 1
-        clock.tick(50)
+        import json
+        data = {
+            "frames": self.frames,
+            "bins_ms": list(PROFILE_BINS),
+            "summary": self.summary(),
+            "histograms": {phase: self.histogram(phase) for phase in self.history},
+            "events": self.events,
+            "trace": rows,
+        }
+        with open(path, "w") as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
 
 
-if __name__ == "__main__":
+class MemoryMonitor:
+    """
+    メモリの使い方を調べるクラス
+    every ステップごとにグループごとのスプライトの数を記録し，window 回続けて増え続けたグループを警告する
+    traceならevery ステップごとにtracemallocのスナップショットを取り，前回からの増加の大きい行を記録する
+    reportでは，クラスごとの生きているインスタンスの数，クラス・グループごとの画像のバイト数，
+    キャッシュのバイト数，記録したtracemallocの増加をまとめる
+    """
+    def __init__(self, world: World, every: int=MEMORY_EVERY, window: int=MEMORY_WINDOW, trace: bool=True):
+        """
+        引数1 world：調べるWorld
+        引数2 every：何ステップごとに記録するか
+        引数3 window：何回続けて増えたら警告するか
+        引数4 trace：Trueならtracemallocで確保されたメモリを追跡する（遅くなる）
+        """
+        self.world = world
+        self.every = every
+        self.window = window
+        self.history: dict[str, deque] = {}  # グループ名と記録したスプライトの数
+        self.warned: set[str] = set()
+        self.warnings: list[str] = []
+        self.snapshot = None
+        self.snapshot_step = 0  # スナップショットを取ったステップ
+        self.growth: list[dict] = []  # スナップショットの間隔ごとの，ステップの範囲と増加の大きい行
+        if trace:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def sample(self):
+        """
+        ステップごとに呼ぶ：every ステップごとにグループの大きさを記録し，増え続けていれば警告する
+        """
+        if self.world.tmr % self.every:
+            return
+        sizes = self.world.counts()
+        sizes["SurfaceCache"] = len(SurfaceCache.surfaces())
+        sizes.update({f"queue:{name}": num for name, num in self.world.queue_depth().items()})
+        for name, num in sizes.items():
+            xs = self.history.setdefault(name, deque(maxlen=self.window+1))
+            xs.append(num)
+            if len(xs) > self.window and all(a < b for a, b in zip(xs, list(xs)[1:])) and name not in self.warned:
+                self.warned.add(name)
+                msg = f"{name} grew in each of the last {self.window} samples ({xs[0]} -> {xs[-1]})"
+                self.warnings.append(msg)
+                warnings.warn(msg, RuntimeWarning, stacklevel=2)
+        self.diff_snapshot()
+
+    def diff_snapshot(self):
+        """
+        tracemallocのスナップショットを取り，前回のスナップショットから増えた行の上位MEMORY_TOP行を記録する
+        """
+        if self.snapshot is None:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        diff = [stat for stat in snapshot.compare_to(self.snapshot, "lineno") if stat.size_diff > 0]
+        if diff:
+            self.growth.append({
+                "steps": (self.snapshot_step, self.world.tmr),
+                "bytes": sum(stat.size_diff for stat in diff),
+                "top": [str(stat) for stat in diff[:MEMORY_TOP]],
+            })
+        self.snapshot, self.snapshot_step = snapshot, self.world.tmr
+
+    def report(self) -> dict:
+        """
+        メモリの使い方をまとめた辞書を返す
+        """
+        world = self.world
+        instances = Counter(
+            type(obj).__name__ for obj in gc.get_objects() if isinstance(obj, (pg.sprite.Sprite, pg.sprite.AbstractGroup))
+        )
+        classes: dict[str, dict[str, int]] = {}
+        groups: dict[str, dict[str, int]] = {}
+        for name, group in world.groups().items():
+            imgs = {id(spr.image): spr.image for spr in group}
+            groups[name] = {"sprites": len(group), "surfaces": len(imgs), "bytes": sum(map(surface_bytes, imgs.values()))}
+            for spr in group:
+                st = classes.setdefault(type(spr).__name__, {"sprites": 0, "surfaces": 0, "bytes": 0, "_ids": set()})
+                st["sprites"] += 1
+                if id(spr.image) not in st["_ids"]:  # 共有している画像は1回だけ数える
+                    st["_ids"].add(id(spr.image))
+                    st["surfaces"] += 1
+                    st["bytes"] += surface_bytes(spr.image)
+        for st in classes.values():
+            del st["_ids"]
+        groups["auras"] = {"sprites": len(world.auras), "surfaces": 1, "bytes": surface_bytes(world.auras.image)}
+        caches = {
+            "Assets": sum(map(surface_bytes, Assets.imgs.values())),
+            "SurfaceCache": sum(map(surface_bytes, SurfaceCache.surfaces())),
+            "Beam.atlas": Beam.get_atlas().nbytes(),
+            "BirdBank": sum(map(surface_bytes, {id(img): img for bank in BirdBank.banks.values() for img in bank.values()}.values())),
+            "GlyphAtlas": sum(surface_bytes(img) for atlas in GlyphAtlas.atlases.values() for img in atlas.glyphs.values()),
+        }
+        report = {
+            "step": world.tmr,
+            "instances": dict(instances.most_common()),
+            "classes": classes,
+            "groups": groups,
+            "caches": caches,
+            "pools": pool_stats(),
+            "warnings": list(self.warnings),
+        }
+        if self.snapshot is not None:
+            if self.snapshot_step != world.tmr:  # 最後の記録から終わりまでの分
+                self.diff_snapshot()
+            report["tracemalloc"] = list(self.growth)
+        return report
+
+
+def print_memory_report(report: dict):
+    """
+    MemoryMonitor.reportの結果を読みやすく表示する
+    """
+    print(f"memory report (step {report['step']})")
+    for title, label in (("classes", "class"), ("groups", "group")):
+        for name, st in report[title].items():
+            print(f"  {label:6s} {name:20s} sprites {st['sprites']:6d}  surfaces {st['surfaces']:4d}  {st['bytes']/1024:9.1f} KiB")
+    for name, nbytes in report["caches"].items():
+        print(f"  cache  {name:20s} {nbytes/1024:9.1f} KiB")
+    print("  instances:", ", ".join(f"{name} {num}" for name, num in report["instances"].items()))
+    for growth in report.get("tracemalloc", []):
+        start, end = growth["steps"]
+        print(f"  tracemalloc steps {start}-{end}: +{growth['bytes']/1024:.1f} KiB")
+        for line in growth["top"]:
+            print("    +", line)
+    for msg in report["warnings"]:
+        print("  WARNING", msg)
+
+
+class QualityGovernor:
+    """
+    直近のフレームの処理時間を見て，見た目の品質をQUALITY_LEVELSの段階で上げ下げするクラス
+    直近window フレームの90パーセンタイルが1フレームの予算を超えたら1段下げ（オーラの粒を減らし，爆発を短く・少なくし，
+    内部解像度を下げる），restore フレーム続けて予算のheadroom倍未満に収まったら1段戻す
+    変えるのは見た目だけなので，ゲームの進行（当たり判定や得点）と記録した入力の再生の結果には影響しない
+    ただしオーラの粒の数が変わるとオーラの乱数列の使い方も変わるので，再生したときのオーラの見た目は記録したときと違うことがある
+    """
+    def __init__(self, budget: float=1/FRAME_RATE, window: int=QUALITY_WINDOW, restore: int=QUALITY_RESTORE,
+                 headroom: float=QUALITY_HEADROOM, levels: tuple=QUALITY_LEVELS):
+        """
+        引数1 budget：1フレームの処理時間の予算（秒）
+        引数2 window：品質を下げるか決めるのに使う直近のフレーム数
+        引数3 restore：品質を1段戻すのに必要な，続けて余裕のあったフレーム数
+        引数4 headroom：予算に対するこの割合未満なら余裕があるとみなす
+        引数5 levels：品質の段階（QUALITY_LEVELSと同じ形）
+        """
+        self.budget = budget
+        self.restore = restore
+        self.headroom = headroom
+        self.levels = levels
+        self.level = 0
+        self.times: deque = deque(maxlen=window)  # 今の段階になってからの直近のフレームの処理時間（秒）
+        self.calm = 0  # 続けて余裕のあったフレーム数
+        self.frames = 0
+        self.frames_at = [0]*len(levels)  # 段階ごとのフレーム数
+        self.transitions: list[dict] = []
+
+    def p90(self) -> float:
+        """
+        直近のフレームの処理時間の90パーセンタイル（ミリ秒）
+        """
+        xs = sorted(self.times) or [0.0]
+        return round(xs[min(len(xs)-1, int(0.9*len(xs)))]*1000, 3)
+
+    def observe(self, elapsed: float) -> int|None:
+        """
+        1フレームの処理時間を記録し，品質の段階を変えるべきなら新しい段階を返す
+        引数 elapsed：フレームの処理時間（秒，次の描画までの待ち時間は含めない）
+        戻り値：新しい段階（変えないならNone）
+        """
+        self.frames += 1
+        self.frames_at[self.level] += 1
+        self.times.append(elapsed)
+        self.calm = self.calm+1 if elapsed < self.budget*self.headroom else 0
+        if len(self.times) == self.times.maxlen and self.level < len(self.levels)-1 and self.p90() > self.budget*1000:
+            return self.level+1
+        if self.calm >= self.restore and self.level > 0:
+            return self.level-1
+        return None
+
+    def apply(self, level: int, world: World, renderer: Renderer|None=None) -> dict:
+        """
+        品質の段階をlevelにし，WorldとRendererの設定を変える
+        引数1 level：新しい段階
+        引数2 world：オーラと爆発の設定を変えるWorld
+        引数3 renderer：内部解像度を変えるRenderer（Noneなら変えない）
+        戻り値：段階の変化の記録（フレーム，ステップ，前後の段階，直近の処理時間の90パーセンタイル）
+        """
+        transition = {"frame": self.frames, "step": world.tmr, "from": self.level, "to": level, "p90_ms": self.p90()}
+        self.transitions.append(transition)
+        self.level = level
+        self.times.clear()
+        self.calm = 0
+        aura_rate, aura_max, exp_scale, exp_max, render_scale = self.levels[level]
+        world.auras.configure(aura_rate, aura_max)
+        world.exp_scale, world.exp_max = exp_scale, exp_max
+        if renderer is not None:
+            renderer.set_scale(min(renderer.base_scale, render_scale))
+        return transition
+
+    def report(self) -> dict[str, Any]:
+        """
+        今の段階，段階の変化の回数，段階ごとのフレーム数を返す
+        """
+        return {"level": self.level, "transitions": len(self.transitions), "frames_at": self.frames_at}
+
+
+class ProfileOverlay:
+    """
+    画面の左上に，フレーム時間，時間のかかった処理，グループごとのスプライトの数を表示するクラス
+    """
+    def __init__(self, profiler: Profiler, world: World, every: int=PROFILE_OVERLAY_EVERY):
+        """
+        引数1 profiler：表示する計測結果
+        引数2 world：スプライトの数を数えるWorld
+        引数3 every：表示を書き換えるフレームの間隔
+        """
+        self.profiler = profiler
+        self.world = world
+        self.every = every
+        self.atlas = GlyphAtlas.get(24, (255, 255, 255))
+        self.items: list[tuple[pg.Surface, pg.Rect]] = []
+        self.updated = -every
+        self.governor: QualityGovernor|None = None  # 品質の段階も表示する（Noneなら表示しない）
+
+    def lines(self) -> list[str]:
+        """
+        表示する行のリストを返す
+        """
+        summary = self.profiler.summary()
+        frame = summary.get("frame", {"p50": 0.0, "p90": 0.0, "max": 0.0})
+        lines = [f"frame p50 {frame['p50']:.1f} p90 {frame['p90']:.1f} max {frame['max']:.1f} ms"]
+        top = [(phase, st) for phase, st in summary.items() if phase != "frame"][:4]
+        lines += [f"  {phase} {st['mean']:.2f} ms" for phase, st in top]
+        counts = [f"{name} {num}" for name, num in self.world.counts().items() if num]
+        lines += [" ".join(counts[i:i+4]) for i in range(0, len(counts), 4)]
+        lines.append("queue " + " ".join(f"{name} {num}" for name, num in self.world.queue_depth().items()))
+        if self.governor is not None:
+            governor = self.governor
+            lines.append(f"quality {governor.level}/{len(governor.levels)-1} p90 {governor.p90():.1f} ms "
+                         f"changes {len(governor.transitions)}")
+        return lines
+
+    def hud_items(self) -> list[tuple[pg.Surface, pg.Rect]]:
+        """
+        表示の画像とRectのリストを返す（every フレームごとに書き換える）
+        """
+        if self.profiler.frames-self.updated < self.every:
+            return self.items
+        self.updated = self.profiler.frames
+        glyphs = []
+        height = self.atlas.font.get_linesize()
+        for i, line in enumerate(self.lines()):
+            glyphs += self.atlas.layout(list(line), (14, 12+i*height))
+        box = glyphs[0][1].unionall([rect for _, rect in glyphs]).inflate(12, 8) if glyphs else pg.Rect(8, 8, 0, 0)
+        bg = SurfaceCache.get(
+            ("rect", box.size, (0, 0, 0), 160, 0), lambda: make_rect(box.size, (0, 0, 0), alpha=160)
+        )
+        self.items = [(bg, box)]+glyphs
+        return self.items
+
+
+class FixedStepLoop:
+    """
+    ゲームの進行と描画を切り離すループの時間管理
+    経過時間をためておき，1/sim_rate秒たまるごとにゲームを1ステップ進める
+    描画が遅れても，1回の描画の間に進めるステップ数はmax_stepsまでにして残りの時間は捨てる
+    """
+    def __init__(self, sim_rate: int=SIM_RATE, frame_rate: int=FRAME_RATE, max_steps: int=MAX_CATCHUP,
+                 pacing: str=PACING):
+        """
+        引数1 sim_rate：1秒あたりのステップ数
+        引数2 frame_rate：1秒あたりの描画回数の上限
+        引数3 max_steps：1回の描画の間に進めるステップ数の上限
+        引数4 pacing：描画の間隔の取り方（"tick"，"tick_busy_loop"，"vsync"）
+        """
+        if pacing not in ("tick", "tick_busy_loop", "vsync"):
+            raise ValueError(f"unknown pacing: {pacing}")
+        self.dt = 1/sim_rate
+        self.frame_rate = frame_rate
+        self.max_steps = max_steps
+        self.pacing = pacing
+        self.clock = pg.time.Clock()
+        self.acc = self.dt  # 最初の描画の前に1ステップ進める
+        self.last: float|None = None
+        self.intervals = deque(maxlen=JITTER_WINDOW)  # 直近の描画間隔（秒）
+        self.steps = 0
+        self.frames = 0
+        self.dropped = 0.0  # 追いつけずに捨てた時間（秒）
+
+    def advance(self) -> int:
+        """
+        前回からの経過時間をため，今回の描画までに進めるステップ数を返す
+        """
+        now = time.perf_counter()
+        if self.last is not None:
+            self.intervals.append(now-self.last)
+            self.acc += now-self.last
+        self.last = now
+        steps = int(self.acc/self.dt)
+        self.acc -= steps*self.dt
+        if steps > self.max_steps:
+            self.dropped += (steps-self.max_steps)*self.dt
+            steps = self.max_steps
+        self.steps += steps
+        self.frames += 1
+        return steps
+
+    @property
+    def alpha(self) -> float:
+        """
+        最後のステップから次のステップまでの時間のうち，すでに経過した割合
+        """
+        return min(1.0, self.acc/self.dt)
+
+    def pace(self):
+        """
+        次の描画まで待つ（vsyncのときは画面の更新が待つので何もしない）
+        """
+        if self.pacing == "tick":
+            self.clock.tick(self.frame_rate)
+        elif self.pacing == "tick_busy_loop":
+            self.clock.tick_busy_loop(self.frame_rate)
+
+    def report(self) -> dict[str, float]:
+        """
+        直近の描画間隔の統計（ミリ秒）と，ステップ・描画の回数を返す
+        jitterは描画間隔の標準偏差，over_budgetは目標の間隔より1.5倍以上長かった描画の割合
+        """
+        xs = sorted(self.intervals) or [0.0]
+        mean = sum(xs)/len(xs)
+        target = 1/self.frame_rate
+        return {
+            "mean_ms": round(mean*1000, 3),
+            "jitter_ms": round(math.sqrt(sum((x-mean)**2 for x in xs)/len(xs))*1000, 3),
+            "p99_ms": round(xs[min(len(xs)-1, int(0.99*len(xs)))]*1000, 3),
+            "max_ms": round(xs[-1]*1000, 3),
+            "over_budget": round(sum(x > 1.5*target for x in xs)/len(xs), 4),
+            "steps": self.steps,
+            "frames": self.frames,
+            "dropped_ms": round(self.dropped*1000, 3),
+        }
+
+
+def render_size(scale: float=RENDER_SCALE) -> tuple[int, int]:
+    """
+    内部で描画する解像度を返す
+    引数 scale：WIDTH×HEIGHTに対する倍率
+    """
+    return round(WIDTH*scale), round(HEIGHT*scale)
+
+
+def init_headless():
+    """
+    画面を開かずにWorldを動かせるよう，SDLのダミードライバでpygameを初期化する
+    """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
     pg.init()
-    main()
+
+
+def open_screen() -> pg.Surface:
+    """
+    設定（RENDER_SCALE，RENDER_UPSCALE，PACING）に合わせてウィンドウを開く
+    """
+    pg.display.set_caption("真！こうかとん無双")
+    size, flags = (WIDTH, HEIGHT), 0
+    if RENDER_SCALE != 1 and RENDER_UPSCALE == "scaled":
+        size, flags = render_size(RENDER_SCALE), pg.SCALED  # 拡大はSDLに任せる
+    if PACING == "vsync":
+        flags |= pg.SCALED  # vsyncはpg.SCALEDかOpenGLの画面でしか使えない
+    return pg.display.set_mode(size, flags, vsync=int(PACING == "vsync"))
+
+
+def replay(path: str, headless: bool=False, speed: float=1.0, memory: bool=False,
+           quality: bool=QUALITY_GOVERNOR) -> World:
+    """
+    記録した入力を再生してゲームを再現する
+    引数1 path：InputLogで記録したファイル
+    引数2 headless：Trueなら描画せずに最高速度で再生する
+    引数3 speed：描画するときの再生速度の倍率
+    引数4 memory：Trueなら描画せずに再生するときにメモリの使い方を調べ，終わりに表示する
+    引数5 quality：Trueなら描画するときにフレームの処理時間に応じて見た目の品質を自動で上げ下げする（mainと同じ）
+    戻り値：再生し終わったWorld
+    """
+    seed, sim_rate, steps = InputLog.read(path)
+    Rng.seed(seed)
+    if headless:
+        Assets.load_all()
+        world = World()
+        monitor = MemoryMonitor(world) if memory else None
+        start = time.perf_counter()
+        for inputs in steps:
+            if not world.step(inputs):
+                break
+            if monitor is not None:
+                monitor.sample()
+        elapsed = time.perf_counter()-start
+        print(f"replay: steps={world.tmr}/{len(steps)}, score={world.score.score}, level={world.levels.level}, "
+              f"over={world.over}, {elapsed:.3f} s ({world.tmr/max(elapsed, 1e-9):.0f} steps/s)")
+        print("volleys:", ", ".join(f"{k}={v}" for k, v in world.volleys.stats.items()))
+        if monitor is not None:
+            print_memory_report(monitor.report())
+        return world
+    screen = open_screen()
+    Assets.load_all()
+    world = World()
+    prebuild_atlases(world.bird)
+    renderer = Renderer(screen, RENDER_SCALE)
+    world.interpolate = INTERPOLATE
+    loop = FixedStepLoop(sim_rate*speed, FRAME_RATE, MAX_CATCHUP, PACING)
+    governor = QualityGovernor(1/FRAME_RATE) if quality else None
+    steps = iter(steps)
+    while not world.over:
+        frame_start = time.perf_counter()
+        if FrameInput.poll().quit:
+            break
+        for _ in range(loop.advance()):
+            inputs = next(steps, None)
+            if inputs is None or not world.step(inputs):
+                world.over = True  # 記録の終わりもゲームオーバーと同じく終了にする
+                break
+        pg.display.update(renderer.draw(world, loop.alpha if INTERPOLATE else 1.0))
+        level = governor.observe(time.perf_counter()-frame_start) if governor is not None else None
+        if level is not None:
+            governor.apply(level, world, renderer)
+        loop.pace()
+    return world
+
+
+def main(record: str|None=None, seed: int|None=None, profile: bool=False, overlay: bool=False,
+         profile_out: str|None=None, memory: bool=False, pipeline: bool=False, quality: bool=QUALITY_GOVERNOR,
+         frame_report: bool=False, startup_report: bool=False):
+    """
+    ゲームを実行する
+    引数1 record：入力を記録するファイル（Noneなら記録しない）
+    引数2 seed：乱数の種（Noneならランダム）
+    引数3 profile：Trueなら処理ごとの時間を計測する
+    引数4 overlay：Trueなら計測結果を画面に表示する（profileも有効になる）
+    引数5 profile_out：計測結果を終了時に書き出すファイル（.csvか.json，profileも有効になる）
+    引数6 memory：Trueならメモリの使い方を調べ，終了時に表示する
+    引数7 pipeline：Trueなら描画を裏のスレッドで行い，次のステップと重ねる
+    引数8 quality：Trueならフレームの処理時間に応じて見た目の品質を自動で上げ下げする
+    引数9 frame_report：Trueなら終了時にフレーム時間の揺らぎなどを表示する（profileのときも表示する）
+    引数10 startup_report：Trueなら最初のフレームを描いたときに起動にかかった時間を表示する（profileのときも表示する）
+    """
+    screen = open_screen()
+    Startup.mark("open_screen")
+    Assets.preload()  # 画像はスタート画面の表示中に裏で読み込む
+    warm = warm_up()
+    start_screen(screen, warm)
+    Startup.mark("title")
+    for _ in warm:  # スタート画面の間に終わらなかった準備の残り
+        pass
+
+    seed = Rng.seed(seed)
+    log = InputLog(record, seed, SIM_RATE) if record else None
+    world = World()
+    renderer = Renderer(screen, RENDER_SCALE)
+    world.interpolate = INTERPOLATE
+    loop = FixedStepLoop(SIM_RATE, FRAME_RATE, MAX_CATCHUP, PACING)
+    profiler = Profiler(trace=profile_out is not None) if profile or overlay or profile_out else None
+    if profiler is not None:
+        world.on_phase = renderer.on_phase = profiler.mark
+        if overlay:
+            renderer.overlay = ProfileOverlay(profiler, world)
+    monitor = MemoryMonitor(world) if memory else None
+    render_thread = RenderThread(renderer) if pipeline else None
+    governor = QualityGovernor(1/FRAME_RATE) if quality else None
+    if governor is not None and renderer.overlay is not None:
+        renderer.overlay.governor = governor
+    pending = FrameInput()  # まだステップに渡していない入力
+    while True:
+        frame_start = time.perf_counter()
+        if profiler is not None:
+            profiler.begin()
+        pending = pending.merged(FrameInput.poll())
+        if pending.quit:
+            break
+        if profiler is not None:
+            profiler.mark("poll")
+        for _ in range(loop.advance()):
+            if log is not None:
+                log.write(pending)
+            world.step(pending)
+            pending = pending.held()  # キーイベントは最初のステップにだけ渡す
+            if monitor is not None:
+                monitor.sample()
+            if world.over:
+                break
+        if render_thread is not None and render_thread.error is not None:  # 裏の描画が失敗したら1スレッドに戻す
+            warnings.warn(f"render thread failed: {render_thread.error!r}; falling back to single-thread rendering",
+                          RuntimeWarning)
+            render_thread.close()
+            render_thread = None
+            renderer.invalidate()
+        if render_thread is not None:
+            pg.display.update(render_thread.submit(world, loop.alpha if INTERPOLATE else 1.0))  # 前のフレームを画面に送る
+        else:
+            pg.display.update(renderer.draw(world, loop.alpha if INTERPOLATE else 1.0))  # 変化した領域だけ画面に送る
+        if "first_frame" not in Startup.marks:
+            Startup.mark("first_frame")
+            if startup_report or profiler is not None:
+                print("startup:", ", ".join(f"{k}={v}" for k, v in Startup.report().items()))
+        if profiler is not None:
+            profiler.mark("flip")
+            profiler.end(world.counts())
+        level = governor.observe(time.perf_counter()-frame_start) if governor is not None else None
+        if level is not None:
+            if render_thread is not None:  # 描画の設定を変える前に裏の描画を終わらせる
+                pg.display.update(render_thread.wait())
+            transition = governor.apply(level, world, renderer)
+            if profiler is not None:
+                profiler.event("quality", **transition)
+        if world.over:
+            if render_thread is not None:
+                pg.display.update(render_thread.wait())  # 最後のフレームを見せてから終わる
+            time.sleep(2)
+            break
+        loop.pace()
+    if render_thread is not None:
+        render_thread.close()
+    if log is not None:
+        log.close()
+    if frame_report or profiler is not None:
+        print("frame time:", ", ".join(f"{k}={v}" for k, v in loop.report().items()))
+        print("volleys:", ", ".join(f"{k}={v}" for k, v in world.volleys.stats.items()))
+        if render_thread is not None:
+            print("render thread:", ", ".join(f"{k}={v}" for k, v in render_thread.report().items()))
+        if governor is not None:
+            print("quality:", ", ".join(f"{k}={v}" for k, v in governor.report().items()))
+            for transition in governor.transitions:
+                print("  ", ", ".join(f"{k}={v}" for k, v in transition.items()))
+    if profiler is not None:
+        for phase, st in list(profiler.summary().items())[:8]:
+            print(f"  {phase:24s} mean {st['mean']:7.3f}  p90 {st['p90']:7.3f}  max {st['max']:7.3f} ms")
+        if profile_out:
+            profiler.export(profile_out)
+    if monitor is not None:
+        print_memory_report(monitor.report())
+    return 0 if pending.quit else None
+
+
+if __name__ == "__main__":
+    Startup.start()
+    parser = argparse.ArgumentParser(description="真！こうかとん無双")
+    parser.add_argument("--seed", type=int, help="乱数の種")
+    parser.add_argument("--record", metavar="LOG", help="入力をLOGに記録する")
+    parser.add_argument("--replay", metavar="LOG", help="LOGに記録した入力を再生する")
+    parser.add_argument("--headless", action="store_true", help="再生を描画せずに最高速度で行う")
+    parser.add_argument("--speed", type=float, default=1.0, help="描画して再生するときの速度の倍率")
+    parser.add_argument("--profile", action="store_true", help="処理ごとの時間を計測し，終了時に表示する")
+    parser.add_argument("--overlay", action="store_true", help="計測結果を画面に表示する")
+    parser.add_argument("--profile-out", metavar="FILE", help="計測結果をFILE（.csvか.json）に書き出す")
+    parser.add_argument("--memory", action="store_true", help="メモリの使い方を調べ，終了時に表示する")
+    parser.add_argument("--pipeline", action=argparse.BooleanOptionalAction, default=PIPELINE,
+                        help="描画を裏のスレッドで行う（--no-pipelineで1スレッドに戻す）")
+    parser.add_argument("--frame-report", action=argparse.BooleanOptionalAction, default=FRAME_REPORT,
+                        help="終了時にフレーム時間の揺らぎ，一斉射撃の数などを表示する")
+    parser.add_argument("--startup-report", action=argparse.BooleanOptionalAction, default=STARTUP_REPORT,
+                        help="最初のフレームを描いたときに起動にかかった時間を表示する")
+    parser.add_argument("--quality", action=argparse.BooleanOptionalAction, default=QUALITY_GOVERNOR,
+                        help="重いときに見た目の品質を自動で下げる（--no-qualityで止める）")
+    args = parser.parse_args()
+    if args.replay and args.headless:
+        init_headless()
+    else:
+        pg.init()
+    Startup.mark("pg_init")
+    if args.replay:
+        replay(args.replay, args.headless, args.speed, args.memory, args.quality)
+    else:
+        main(args.record, args.seed, args.profile, args.overlay, args.profile_out, args.memory, args.pipeline,
+             args.quality, args.frame_report, args.startup_report)
     pg.quit()
-    sys.exit
     sys.exit()
-
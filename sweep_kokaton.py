@@ -0,0 +1,271 @@
+"""
+こうかとん無双のバランス調整用の一括実行スクリプト
+設定値（敵機の出現間隔，爆弾の速さ，ビームの速さ，各機能のスコアのコストなど）の組み合わせごとに，
+画面を開かずに（SDLのダミードライバで）ゲームを何回も自動で遊ばせ，生き残った時間・スコア・1ステップの処理時間をまとめる
+実行は複数のプロセスに分けて並列に行い，同じ設定値と乱数の種なら何プロセスで実行しても同じ結果になる
+
+使い方：
+    python sweep_kokaton.py --grid ENEMY_PERIOD=100,200,300 --grid BOMB_SPEED=4,6,8
+    python sweep_kokaton.py --grid GRAVITY_COST=30,50 --policy random --policy scripted --seeds 16
+    python sweep_kokaton.py --grid BEAM_SPEED_MAX=15,20,30 --workers 4 --out sweep.csv  # .jsonなら1回ごとの結果も書き出す
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import musou_kokaton as mk
+import pygame as pg
+from bench_kokaton import circle_keys, percentiles, press
+
+
+TUNABLES = (  # --gridで変えられる設定値
+    "ENEMY_PERIOD", "BOMB_SPEED", "BEAM_SPEED_MIN", "BEAM_SPEED_MAX",
+    "NEOGRAVITY_COST", "GRAVITY_COST", "SHIELD_COST", "KOUKASHIELD_COST", "KOUKABALL_COST",
+)
+DEFAULTS = {name: getattr(mk, name) for name in TUNABLES}  # 実行ごとに設定し直すための既定値
+ABILITY_KEYS = (  # ランダムな方針が押すキー
+    pg.K_SPACE, pg.K_RETURN, pg.K_RSHIFT, pg.K_TAB, pg.K_CAPSLOCK, pg.K_F1, pg.K_x, pg.K_d, pg.K_LSHIFT,
+)
+
+
+class Policy:
+    """
+    自動で遊ぶ方針の基底クラス
+    inputsで毎ステップの入力を返す（乱数はrngだけを使うので，同じ種なら同じ入力になる）
+    """
+    name = ""
+    description = ""
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+
+    def inputs(self, world: mk.World, step: int) -> mk.FrameInput:
+        return mk.FrameInput()
+
+
+class RandomPolicy(Policy):
+    name = "random"
+    description = "10ステップごとに移動の向きを変え，ときどきランダムな機能のキーを押す"
+
+    def __init__(self, seed: int):
+        super().__init__(seed)
+        self.keys = {k: False for k in mk.Bird.delta}
+
+    def inputs(self, world: mk.World, step: int) -> mk.FrameInput:
+        rng = self.rng
+        if step % 10 == 0:
+            self.keys = {k: rng.random() < 0.3 for k in mk.Bird.delta}
+        events = press(rng.choice(ABILITY_KEYS)) if rng.random() < 0.05 else []
+        return mk.FrameInput(dict(self.keys), events)
+
+
+class ScriptedPolicy(Policy):
+    name = "scripted"
+    description = "画面内を回りながら10ステップごとにビームを撃ち，防御壁と重力場を切らさないようにする"
+
+    def inputs(self, world: mk.World, step: int) -> mk.FrameInput:
+        events = []
+        if step % 10 == 0:
+            events += press(pg.K_SPACE)
+        if len(world.shields) == 0:
+            events += press(pg.K_CAPSLOCK)
+        if len(world.FrontKS) == 0:
+            events += press(pg.K_x)
+        if len(world.gravities) == 0:
+            events += press(pg.K_TAB)
+        if step % 50 == 25:
+            events += press(pg.K_d)
+        return mk.FrameInput(circle_keys(step), events)
+
+
+POLICIES = {policy.name: policy for policy in (RandomPolicy, ScriptedPolicy)}
+
+
+def init_worker(render: bool):
+    """
+    ワーカープロセスの初期化：画面を開かずにpygameを初期化し，画像を一度だけ読み込む
+    引数 render：Trueなら描画もする（ダミーの画面を開き，アトラスを生成しておく）
+    """
+    os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")  # SDLにSIGTERMを横取りさせない（Poolのterminateで終われるように）
+    mk.init_headless()
+    if render:
+        pg.display.set_mode((mk.WIDTH, mk.HEIGHT))
+    mk.Assets.load_all()
+    if render:
+        mk.prebuild_atlases(mk.Bird(3, (0, 0)))
+
+
+def run_session(job: dict) -> dict:
+    """
+    1回分のゲームを実行し，結果を返す（ワーカープロセスで呼ばれる）
+    引数 job：設定値params，乱数の種seed，方針policy，最大ステップ数steps，描画するかrender，番号index
+    戻り値：生き残ったステップ数，スコア，レベル，1ステップの処理時間の統計と計測値（秒）などの辞書
+    """
+    for name, value in {**DEFAULTS, **job["params"]}.items():  # 前の実行の設定値を残さない
+        setattr(mk, name, value)
+    mk.Rng.seed(job["seed"])
+    world = mk.World()
+    policy = POLICIES[job["policy"]](job["seed"])
+    renderer = mk.Renderer(pg.display.get_surface()) if job["render"] else None
+    samples = []
+    for step in range(job["steps"]):
+        inputs = policy.inputs(world, step)
+        t0 = time.perf_counter()
+        alive = world.step(inputs)
+        if renderer is not None:
+            renderer.draw(world)
+        samples.append(time.perf_counter()-t0)
+        if not alive:
+            break
+    world.close()  # プールから取り出したスプライトを次の実行のために返す
+    return {
+        "index": job["index"],
+        "params": job["params"],
+        "policy": job["policy"],
+        "seed": job["seed"],
+        "steps": world.tmr,
+        "over": world.over,
+        "score": world.score.score,
+        "level": world.levels.level,
+        "step_ms": percentiles(samples),
+        "samples": samples,  # まとめるときに同じ分布から平均とp90を求めるため（書き出す前に除く）
+    }
+
+
+def make_jobs(grid: dict[str, list], policies: list[str], seeds: list[int], steps: int, render: bool) -> list[dict]:
+    """
+    設定値の組み合わせ×方針×乱数の種ごとの実行内容のリストを作る
+    """
+    jobs = []
+    names = list(grid)
+    for values in itertools.product(*grid.values()):
+        for policy in policies:
+            for seed in seeds:
+                jobs.append({
+                    "index": len(jobs), "params": dict(zip(names, values)), "policy": policy,
+                    "seed": seed, "steps": steps, "render": render,
+                })
+    return jobs
+
+
+def run_jobs(jobs: list[dict], workers: int, render: bool) -> list[dict]:
+    """
+    実行内容をworkers個のプロセスで並列に実行する（1なら今のプロセスで順に実行する）
+    戻り値：実行内容の順に並べた結果のリスト
+    """
+    if workers <= 1:
+        init_worker(render)
+        results = [run_session(job) for job in jobs]
+    else:
+        ctx = multiprocessing.get_context("spawn")  # pygame（SDL）の状態をforkで子プロセスに持ち込まない
+        with ctx.Pool(workers, init_worker, (render,)) as pool:
+            results = list(pool.imap_unordered(run_session, jobs, chunksize=1))  # 終わったプロセスから次を渡す
+    return sorted(results, key=lambda result: result["index"])
+
+
+def summarize(results: list[dict], sim_rate: int) -> list[dict]:
+    """
+    設定値の組み合わせと方針ごとに結果をまとめる
+    引数1 results：run_sessionの結果のリスト
+    引数2 sim_rate：1秒あたりのステップ数（生き残った時間を秒にする）
+    戻り値：組み合わせごとの，実行回数，生き残った時間，スコア，レベル，1ステップの処理時間の辞書のリスト
+    1ステップの処理時間の平均とp90は，組み合わせのすべての実行の計測値をまとめた分布から求める
+    """
+    groups: dict[tuple, list[dict]] = {}
+    for result in results:
+        key = tuple(result["params"].items()), result["policy"]
+        groups.setdefault(key, []).append(result)
+    rows = []
+    for (params, policy), runs in groups.items():
+        survival = [run["steps"]/sim_rate for run in runs]
+        step_ms = percentiles([x for run in runs for x in run["samples"]])
+        rows.append({
+            **dict(params),
+            "policy": policy,
+            "runs": len(runs),
+            "alive": round(sum(not run["over"] for run in runs)/len(runs), 3),  # 最後まで生き残った割合
+            "survival_s": round(sum(survival)/len(runs), 2),
+            "survival_min_s": round(min(survival), 2),
+            "score": round(sum(run["score"] for run in runs)/len(runs), 1),
+            "score_max": max(run["score"] for run in runs),
+            "level": round(sum(run["level"] for run in runs)/len(runs), 1),
+            "step_ms": step_ms["mean"],
+            "step_p90_ms": step_ms["p90"],
+        })
+    return rows
+
+
+def print_table(rows: list[dict]):
+    """
+    まとめた結果を表にして表示する
+    """
+    if not rows:
+        return
+    cols = list(rows[0])
+    widths = [max(len(col), *(len(str(row[col])) for row in rows)) for col in cols]
+    print("  ".join(col.rjust(w) for col, w in zip(cols, widths)))
+    for row in rows:
+        print("  ".join(str(row[col]).rjust(w) for col, w in zip(cols, widths)))
+
+
+def parse_grid(specs: list[str]) -> dict[str, list]:
+    """
+    "名前=値1,値2,..."のリストを設定値の名前と値のリストの辞書にする（値の型は既定値に合わせる）
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition("=")
+        if name not in TUNABLES or not values:
+            raise SystemExit(f"--grid {spec}: 名前=値1,値2,... の形で，名前は {', '.join(TUNABLES)} のどれか")
+        kind = type(DEFAULTS[name])
+        grid[name] = [kind(value) for value in values.split(",")]
+    return grid
+
+
+def main(argv: list[str]|None=None) -> int:
+    parser = argparse.ArgumentParser(description="こうかとん無双の設定値の一括実行")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=V1,V2",
+                        help=f"変える設定値と値（複数指定で組み合わせ）：{', '.join(TUNABLES)}")
+    parser.add_argument("--policy", action="append", choices=list(POLICIES), help="自動で遊ぶ方針（複数指定可）")
+    parser.add_argument("--seeds", type=int, default=8, help="組み合わせごとに実行する回数（乱数の種の数）")
+    parser.add_argument("--seed", type=int, default=0, help="最初の乱数の種")
+    parser.add_argument("--steps", type=int, default=3000, help="1回の最大ステップ数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="並列に実行するプロセス数")
+    parser.add_argument("--render", action="store_true", help="描画も行い，1ステップの処理時間に含める")
+    parser.add_argument("--out", help="結果を書き出すファイル（.csvならまとめた表，.jsonなら1回ごとの結果も）")
+    args = parser.parse_args(argv)
+
+    grid = parse_grid(args.grid)
+    policies = args.policy or list(POLICIES)
+    jobs = make_jobs(grid, policies, list(range(args.seed, args.seed+args.seeds)), args.steps, args.render)
+    start = time.perf_counter()
+    results = run_jobs(jobs, args.workers, args.render)
+    elapsed = time.perf_counter()-start
+    rows = summarize(results, mk.SIM_RATE)
+    print_table(rows)
+    steps = sum(result["steps"] for result in results)
+    print(f"{len(jobs)} runs, {args.workers} workers, {elapsed:.1f} s ({len(jobs)/elapsed:.2f} runs/s, {steps/elapsed:.0f} steps/s)")
+
+    if args.out:
+        if args.out.endswith(".csv"):
+            with open(args.out, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            meta = {"grid": grid, "policies": policies, "seeds": args.seeds, "seed": args.seed, "steps": args.steps,
+                    "render": args.render, "workers": args.workers, "elapsed_s": round(elapsed, 3)}
+            with open(args.out, "w") as f:
+                runs = [{k: v for k, v in result.items() if k != "samples"} for result in results]
+                json.dump({"meta": meta, "summary": rows, "runs": runs}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,24 @@
+import os
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+import pytest
+
+import musou_kokaton as mk
+
+
+@pytest.fixture(scope="session", autouse=True)
+def headless():
+    """
+    画面を開かずにpygameを初期化し，画像を画面のピクセル形式に変換するための小さなダミーの画面を開く
+    """
+    mk.init_headless()
+    pg.display.set_mode((1, 1))
+    mk.Assets.load_all()
+    yield
+    pg.quit()
@@ -0,0 +1,80 @@
+import random
+
+import pygame as pg
+import pytest
+
+import musou_kokaton as mk
+
+
+def scene(seed: int) -> tuple[mk.World, dict[str, list[pg.sprite.Sprite]]]:
+    """
+    すべての規則が当たりうるように，スプライトを画面の一部に散らばらせたWorldを作る
+    戻り値：Worldと，グループ名ごとの作った順のスプライトのリスト
+    """
+    mk.Rng.seed(seed)
+    world = mk.World()
+    bird = world.bird
+    bird.rect.center = mk.WIDTH//2, mk.HEIGHT//2
+    bird.state = "hyper"  # 爆弾に当たってもゲームを終わらせず，残りの規則も調べる
+    world.emys.add(mk.Enemy() for _ in range(20))
+    world.bombs.add(mk.Bomb.spawn(emy, bird) for emy in world.emys for _ in range(3))
+    world.beams.add(mk.Beam.spawn(bird, angle) for angle in range(0, 360, 20))
+    world.pluses.add(mk.BeamPlus(bird) for _ in range(10))
+    world.Kkball.add(mk.KoukaBall(bird) for _ in range(2))
+    world.gravities.add(mk.Gravity(bird, 100))
+    world.shields.add(mk.Shield(bird, 100))
+    world.FrontKS.add(mk.FrontKoukaShield(bird, 100))
+    world.BackKS.add(mk.BackKoukaShield(bird, 100))
+    rng = random.Random(seed)
+    for name in ("emys", "bombs", "beams", "pluses", "Kkball"):
+        for spr in getattr(world, name):
+            spr.rect.center = rng.randrange(200, 1400), rng.randrange(100, 800)
+    built = {name: group.sprites() for name, group in world.groups().items()}
+    return world, built
+
+
+def groupcollide_order(world: mk.World) -> tuple[int, int, int]:
+    """
+    規則表の前の実装と同じく，規則ごとにpg.sprite.groupcollideを上から順に呼んで衝突を処理する
+    戻り値：スコア，レベル，出した爆発の数
+    """
+    score, level, exps = world.score.score, world.levels.level, 0
+    for a, b, kill_a, kill_b, add, lv, _, _ in mk.COLLISION_RULES:
+        for _ in pg.sprite.groupcollide(getattr(world, a), getattr(world, b), kill_a, kill_b):
+            score += add
+            level += lv
+            exps += 1
+    return score, level, exps
+
+
+def survivors(built: dict[str, list[pg.sprite.Sprite]]) -> dict[str, list[int]]:
+    """
+    グループ名ごとに，生き残ったスプライトの作った順の番号のリストを返す
+    """
+    return {name: [i for i, spr in enumerate(sprites) if spr.alive()] for name, sprites in built.items()}
+
+
+@pytest.mark.parametrize("ratio", [0, 10**9], ids=["hash", "brute"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_rule_table_matches_groupcollide_order(monkeypatch, seed, ratio):
+    monkeypatch.setattr(mk, "GRID_BRUTE_RATIO", ratio)  # 空間ハッシュと総当たりの両方を調べる
+    expected_world, expected_built = scene(seed)
+    expected = groupcollide_order(expected_world)
+    expected_alive = survivors(expected_built)  # 消えたスプライトは次のsceneでプールから使い回されるので先に調べる
+    world, built = scene(seed)
+    assert world.collide()
+    assert (world.score.score, world.levels.level, len(world.exps)) == expected
+    assert expected[2] > 0
+    assert survivors(built) == expected_alive
+    assert sum(rule.hits for rule in world.rules) == expected[2]
+
+
+def test_bomb_ends_game_unless_hyper():
+    mk.Rng.seed(0)
+    world = mk.World()
+    bomb = mk.Bomb.spawn(mk.Enemy(), world.bird)
+    bomb.rect.center = world.bird.rect.center
+    world.bombs.add(bomb)
+    assert not world.collide()
+    assert not bomb.alive()
+    assert world.score.score == 0
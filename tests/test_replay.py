@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+import env_kokaton as ek
+import musou_kokaton as mk
+
+
+def play(path: str, seed: int, steps: int) -> mk.World:
+    """
+    ランダムな行動でゲームを進め，入力をpathに記録する
+    """
+    rng = random.Random(seed)
+    mk.Rng.seed(seed)
+    log = mk.InputLog(path, seed)
+    world = mk.World()
+    for _ in range(steps):
+        inputs = ek.action_input(rng.randrange(ek.NUM_ACTIONS))
+        log.write(inputs)
+        if not world.step(inputs):
+            break
+    log.close()
+    return world
+
+
+def snapshot(world: mk.World) -> tuple:
+    """
+    ゲームの進行（ステップ数，スコア，レベル，終わったか）とすべてのスプライトの位置を返す
+    """
+    positions = {name: [spr.rect.topleft for spr in group] for name, group in world.groups().items()}
+    return world.tmr, world.score.score, world.levels.level, world.over, positions, world.auras.pos.tolist()
+
+
+@pytest.mark.parametrize("seed", [0, 7])
+def test_replay_matches_recorded_game(tmp_path, seed):
+    path = str(tmp_path/"play.log")
+    live = snapshot(play(path, seed, 1500))
+    assert mk.InputLog.read(path)[0] == seed
+    assert snapshot(mk.replay(path, headless=True)) == live
+    assert snapshot(mk.replay(path, headless=True)) == live  # プールやキャッシュが温まっていても同じ
+
+
+def test_replay_differs_for_other_seed(tmp_path):
+    a = snapshot(play(str(tmp_path/"a.log"), 1, 600))
+    b = snapshot(play(str(tmp_path/"b.log"), 2, 600))
+    assert a != b
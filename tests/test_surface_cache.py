@@ -0,0 +1,50 @@
+import pygame as pg
+import pytest
+
+import musou_kokaton as mk
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """
+    他のテストのSurfaceを追い出さないよう，空の小さなSurfaceCacheにする
+    """
+    monkeypatch.setattr(mk.SurfaceCache, "kinds", {})
+    monkeypatch.setattr(mk.SurfaceCache, "pinned", {})
+    monkeypatch.setattr(mk.SurfaceCache, "maxsize", 2)
+    monkeypatch.setattr(mk.SurfaceCache, "pin_bytes", 100*100*4)
+    return mk.SurfaceCache
+
+
+def small(key: tuple) -> pg.Surface:
+    return mk.SurfaceCache.get(key, lambda: pg.Surface((10, 10)))
+
+
+def test_evicts_least_recently_used_per_shape(cache):
+    a, b = small(("bar", 1)), small(("bar", 2))
+    assert small(("bar", 1)) is a  # 1を使ったので，次に追い出されるのは2
+    small(("bar", 3))
+    assert list(cache.kinds["bar"]) == [("bar", 1), ("bar", 3)]
+    assert small(("bar", 1)) is a
+    assert small(("bar", 2)) is not b  # 追い出されたので作り直す
+
+
+def test_other_shapes_do_not_evict(cache):
+    bars = [small(("bar", i)) for i in range(2)]
+    for i in range(10):
+        small(("plus", i))
+    assert len(cache.kinds["plus"]) == 2
+    assert [small(("bar", i)) for i in range(2)] == bars
+
+
+def test_pins_large_surfaces(cache):
+    big = cache.get(("rect", "big"), lambda: pg.Surface((200, 200)))
+    assert ("rect", "big") in cache.pinned
+    assert not cache.kinds.get("rect")
+    for i in range(10):
+        small(("rect", i))
+    misses = cache.misses
+    assert cache.get(("rect", "big"), lambda: pg.Surface((200, 200))) is big
+    assert cache.misses == misses
+    assert big in cache.surfaces()
+    assert len(cache.surfaces()) == 3
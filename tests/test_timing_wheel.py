@@ -0,0 +1,56 @@
+import pygame as pg
+
+import musou_kokaton as mk
+
+
+def test_fires_at_due_step_in_insertion_order():
+    wheel = mk.TimingWheel(8)
+    fired = []
+    for at, name in [(3, "a"), (5, "b"), (3, "c")]:
+        wheel.schedule(at, lambda now, name: fired.append((now, name)), name)
+    for now in range(7):
+        wheel.run(now)
+    assert fired == [(3, "a"), (3, "c"), (5, "b")]
+    assert wheel.depth == 0
+    assert wheel.fired == 3
+
+
+def test_waits_for_later_laps():
+    wheel = mk.TimingWheel(8)
+    fired = []
+    wheel.schedule(19, lambda now: fired.append(now))  # 8スロットなので2周あとの3番のスロット
+    for now in range(19):
+        wheel.run(now)
+    assert fired == []
+    assert wheel.depth == 1
+    wheel.run(19)
+    assert fired == [19]
+    assert wheel.depth == 0
+
+
+def test_reschedules_when_callback_returns_a_step():
+    wheel = mk.TimingWheel(4)
+    fired = []
+
+    def every_three(now: int) -> int|None:
+        fired.append(now)
+        return now+3 if now < 9 else None
+
+    wheel.schedule(0, every_three)
+    for now in range(20):
+        wheel.run(now)
+    assert fired == [0, 3, 6, 9]
+    assert wheel.depth == 0
+
+
+def test_timed_sprite_expires_after_life():
+    wheel = mk.TimingWheel(8)
+    group = pg.sprite.Group()
+    spr = mk.Shield(mk.Bird(3, (100, 100)), 10)
+    group.add(spr)
+    wheel.schedule(spr.expires(5), spr.expire)  # 時刻5に加えた
+    for now in range(5, 15):
+        wheel.run(now)
+    assert spr.alive()
+    wheel.run(15)
+    assert not spr.alive()